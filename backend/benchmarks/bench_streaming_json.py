@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark of the incremental JSON parser used by the streaming components.
+
+Compares `StreamingJSONParser` with the previous approach, which re-parsed the whole
+accumulated output with `json.loads` after every delta. Recorded streams are JSON files
+with a list of deltas under the `deltas` key, e.g. dumped from the `content.delta` events
+of `client.beta.chat.completions.stream`. Without `--streams-dir`, streams with the shape
+of the annotations, docstrings and comments outputs are synthesized.
+
+Run from the backend directory:
+    python benchmarks/bench_streaming_json.py [--streams-dir DIR] [--sizes 50 200 800]
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from pydocass.utils.streaming_json import StreamingJSONParser
+
+
+def legacy_parse(deltas: list[str], closing: str) -> int:
+    """The parsing loop previously used in `_process_streaming_*` functions."""
+    output = ""
+    output_length = 0
+    boundary = 1
+    finished_keys = set()
+    for delta in deltas:
+        output += delta
+        output_length += len(delta)
+        for end_pos in range(output_length, boundary, -1):
+            try:
+                valid_dict = json.loads(output[:end_pos] + closing)
+            except ValueError:
+                continue
+            for key in valid_dict:
+                finished_keys.add(key)
+        boundary = output_length
+    return len(finished_keys)
+
+
+def incremental_parse(deltas: list[str]) -> int:
+    parser = StreamingJSONParser()
+    num_events = 0
+    for delta in deltas:
+        num_events += len(parser.feed(delta))
+    return num_events
+
+
+def split_into_deltas(output: str, rng: random.Random) -> list[str]:
+    # LLM tokens are ~4 characters long on average
+    deltas = []
+    pos = 0
+    while pos < len(output):
+        size = rng.randint(1, 8)
+        deltas.append(output[pos : pos + size])
+        pos += size
+    return deltas
+
+
+def synthesize_streams(
+    num_nodes: int, seed: int = 0
+) -> dict[str, tuple[list[str], str]]:
+    rng = random.Random(seed)
+    annotations = {
+        f"FunctionFunc{i}": {
+            f"arg{j}": rng.choice(
+                ["int", "list[str]", "dict[str, Any]", "Optional[float]"]
+            )
+            for j in range(4)
+        }
+        for i in range(num_nodes)
+    }
+    docstrings = {
+        f"function_func{i}": "Computes the value.\\n\\nArgs:\\n    arg0 (`int`):\\n        The value."
+        for i in range(num_nodes)
+    }
+    comments = {
+        f"line{i}": ("Iterate over the items" if rng.random() < 0.3 else "")
+        for i in range(1, num_nodes * 10 + 1)
+    }
+    return {
+        "annotations": (split_into_deltas(json.dumps(annotations), rng), "}}"),
+        "docstrings": (split_into_deltas(json.dumps(docstrings), rng), "}"),
+        "comments": (split_into_deltas(json.dumps(comments), rng), "}"),
+    }
+
+
+def load_recorded_streams(streams_dir: Path) -> dict[str, tuple[list[str], str]]:
+    streams = {}
+    for path in sorted(streams_dir.glob("*.json")):
+        with open(path) as f:
+            deltas = json.load(f)["deltas"]
+        # Annotations outputs are nested one level deeper
+        closing = "}}" if "annotation" in path.stem else "}"
+        streams[path.stem] = (deltas, closing)
+    return streams
+
+
+def run(streams: dict[str, tuple[list[str], str]], repeats: int, skip_legacy: bool):
+    print(
+        f"{'stream':<28}{'chars':>10}{'deltas':>8}{'legacy MB/s':>14}{'incremental MB/s':>19}"
+    )
+    for name, (deltas, closing) in streams.items():
+        num_chars = sum(len(x) for x in deltas)
+        timings = {}
+        for label, func in (
+            ("legacy", lambda: legacy_parse(deltas, closing)),
+            ("incremental", lambda: incremental_parse(deltas)),
+        ):
+            if label == "legacy" and skip_legacy:
+                timings[label] = float("nan")
+                continue
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            timings[label] = num_chars / best / 1e6
+        print(
+            f"{name:<28}{num_chars:>10}{len(deltas):>8}"
+            f"{timings['legacy']:>14.3f}{timings['incremental']:>19.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams-dir", type=Path, default=None)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[15, 60, 240])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--skip-legacy",
+        action="store_true",
+        help="Only time the incremental parser (the legacy one is quadratic).",
+    )
+    args = parser.parse_args()
+
+    if args.streams_dir is not None:
+        streams = load_recorded_streams(args.streams_dir)
+    else:
+        streams = {}
+        for size in args.sizes:
+            for name, stream in synthesize_streams(size).items():
+                streams[f"{name} ({size} nodes)"] = stream
+    run(streams, repeats=args.repeats, skip_legacy=args.skip_legacy)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import datetime
 from argparse import ArgumentParser
@@ -7,7 +8,20 @@ from flask_cors import CORS
 
 from pydocass.core.document_python_code import document_python_code
 from pydocass.connection import submit_record
+from pydocass.connection.record_writer import RECORD_WRITER
 from pydocass.utils.utils import format_code_with_black, get_client
+from pydocass.utils.cache import create_results_cache
+from pydocass.utils.client_pool import OPENAI_CLIENT_POOL
+from pydocass.utils.constants import (
+    BASE_URL,
+    COMMENTS_FORMAT_LINES,
+    COMMENTS_FORMAT_SPARSE,
+    DEFAULT_MODEL_CHECKPOINT,
+    STREAM_FORMAT_DELTAS,
+    STREAM_FORMAT_SNAPSHOTS,
+)
+from pydocass.utils.delta_stream import iterate_deltas, throttle_snapshots
+from pydocass.utils.tokenizer_registry import TOKENIZER_REGISTRY
 
 import logging
 
@@ -18,12 +32,47 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 USE_STREAMING = True
+# Results of the nodes that were already documented, shared by all requests
+RESULTS_CACHE = create_results_cache(os.getenv("PYDOCASS_CACHE_DIR"))
 
 
 @app.route("/document", methods=["POST"])
 def document_code():
     data = request.json
     code = rf"{data.get('code', '')}"
+    stream_format = data.get("stream_format", STREAM_FORMAT_SNAPSHOTS)
+    if stream_format not in (STREAM_FORMAT_SNAPSHOTS, STREAM_FORMAT_DELTAS):
+        return jsonify({"error": f"Unknown stream format: {stream_format}"}), 400
+    # Minimum number of seconds between two streamed snapshots, the last one is always sent
+    try:
+        snapshot_interval = float(data.get("snapshot_interval", 0))
+    except (TypeError, ValueError):
+        snapshot_interval = None
+    # NaN fails the comparison too
+    if snapshot_interval is None or not 0 <= snapshot_interval < float("inf"):
+        error = f"Invalid snapshot interval: {data.get('snapshot_interval')}"
+        return jsonify({"error": error}), 400
+    comments_format = data.get("comments_format", COMMENTS_FORMAT_LINES)
+    if comments_format not in (COMMENTS_FORMAT_LINES, COMMENTS_FORMAT_SPARSE):
+        return jsonify({"error": f"Unknown comments format: {comments_format}"}), 400
+    # Share of the lines sent to the LLM for comments, None for all of them
+    comments_budget = data.get("comments_budget")
+    if comments_budget is not None:
+        try:
+            comments_budget = float(comments_budget)
+        except (TypeError, ValueError):
+            comments_budget = None
+        if comments_budget is None or not 0 <= comments_budget <= 1:
+            error = f"Invalid comments budget: {data.get('comments_budget')}"
+            return jsonify({"error": error}), 400
+    pipeline_group_size = data.get("pipeline_group_size")
+    if pipeline_group_size is not None and (
+        isinstance(pipeline_group_size, bool)
+        or not isinstance(pipeline_group_size, int)
+        or pipeline_group_size < 1
+    ):
+        error = f"Invalid pipeline group size: {pipeline_group_size}"
+        return jsonify({"error": error}), 400
     in_time = datetime.now()
     try:
         submit_record(table="inputs", in_time=in_time, in_code=code)
@@ -45,15 +94,48 @@ def document_code():
             in_time=in_time,
             model_checkpoint=data["model_checkpoint"],
             use_streaming=USE_STREAMING,
+            cache=RESULTS_CACHE,
+            concurrent_docstrings_and_comments=data.get(
+                "concurrent_docstrings_and_comments", False
+            ),
+            pipeline_group_size=pipeline_group_size,
+            comments_format=comments_format,
+            comments_budget=comments_budget,
         ):
             yield chunk
         yield format_code_with_black(chunk)
 
-    return Response(stream_with_context(generate()), mimetype="text/plain")
+    snapshots = throttle_snapshots(generate(), snapshot_interval)
+    if stream_format == STREAM_FORMAT_DELTAS:
+        # Newline-delimited JSON edits against the previous snapshot, then the checksum
+        events = (json.dumps(event) + "\n" for event in iterate_deltas(snapshots, code))
+        return Response(stream_with_context(events), mimetype="application/x-ndjson")
+    return Response(stream_with_context(snapshots), mimetype="text/plain")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(
+        {
+            "cache": RESULTS_CACHE.stats(),
+            "tokenizers": TOKENIZER_REGISTRY.stats(),
+            "clients": OPENAI_CLIENT_POOL.stats(),
+            "records": RECORD_WRITER.stats(),
+        }
+    )
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--port", default="4000", type=str, required=False)
     args = parser.parse_args()
+    # Load the tokenizers before serving so that the first requests do not pay for it. The
+    # registry is keyed by the model checkpoint of the requests, which is mapped to the
+    # fallback tokenizer if it has none of its own
+    checkpoints = os.getenv("PYDOCASS_PRELOAD_TOKENIZERS", DEFAULT_MODEL_CHECKPOINT)
+    TOKENIZER_REGISTRY.preload(checkpoints.split(","))
+    # Open the connection to the LLM provider for the server's own API key in advance
+    api_key = os.getenv("NEBIUS_API_KEY") or os.getenv("OPENAI_API_KEY")
+    if api_key:
+        OPENAI_CLIENT_POOL.prewarm(api_key, BASE_URL)
     app.run(host="0.0.0.0", port=args.port)
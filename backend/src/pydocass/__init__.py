@@ -1,3 +1,10 @@
-from .core import document_python_code
+__all__ = ["document_python_code", "adocument_python_code"]
 
-__all__ = ["document_python_code"]
+
+def __getattr__(name: str):
+    # The pipeline imports pydantic and the database models, so it is loaded on first use
+    if name in __all__:
+        from . import core
+
+        return getattr(core, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,10 @@
-from .write_docstrings import write_docstrings
-from .write_arguments_annotations import write_arguments_annotations
-from .write_comments import write_comments
-from .maybe_add_class_to_typing_import import maybe_add_class_to_typing_import
+from .write_docstrings import write_docstrings, awrite_docstrings
+from .write_arguments_annotations import (
+    write_arguments_annotations,
+    awrite_arguments_annotations,
+)
+from .write_comments import write_comments, awrite_comments
+from .maybe_add_class_to_typing_import import (
+    maybe_add_class_to_typing_import,
+    maybe_add_classes_to_typing_import,
+)
@@ -1,48 +1,68 @@
+from __future__ import annotations
+
 import ast
+from typing import Iterable
+
+from ..utils.module_index import ModuleIndex
+
 
+def maybe_add_class_to_typing_import(
+    code: str, class_name: str = "Union", module_index: ModuleIndex | None = None
+) -> str:
+    return maybe_add_classes_to_typing_import(
+        code, [class_name], module_index=module_index
+    )
 
-def maybe_add_class_to_typing_import(code: str, class_name: str = "Union") -> str:
-    tree = ast.parse(code)
-    idx_node_from_typing = None
-    # Find `from typing import` section
-    for i, node in enumerate(tree.body):
-        if isinstance(node, ast.ImportFrom) and node.module == "typing":
-            if idx_node_from_typing is None:
-                idx_node_from_typing = i
-            for name in node.names:
-                if name.name == class_name:
-                    return code
 
-    if idx_node_from_typing is None:
+def maybe_add_classes_to_typing_import(
+    code: str, class_names: Iterable[str], module_index: ModuleIndex | None = None
+) -> str:
+    # All the missing classes are added with one edit of the import, in alphabetical order.
+    # The index of the code is used instead of parsing it and is updated with the edit
+    if module_index is None:
+        module_index = ModuleIndex(code)
+    missing_class_names = sorted(set(class_names) - module_index.typing_imports)
+    if not missing_class_names:
+        return code
+    module_index.typing_imports.update(missing_class_names)
+    class_names_text = ", ".join(missing_class_names)
+
+    if module_index.typing_import_span is None:
         num_line_breaks_after_import = (
-            3 if not isinstance(tree.body[0], (ast.Import, ast.ImportFrom)) else 1
+            3
+            if not isinstance(module_index.tree.body[0], (ast.Import, ast.ImportFrom))
+            else 1
         )
-        code = (
-            f"from typing import {class_name}"
-            + "\n" * num_line_breaks_after_import
-            + code
+        code = module_index.replace_lines(
+            0,
+            0,
+            [f"from typing import {class_names_text}"]
+            + [""] * (num_line_breaks_after_import - 1),
         )
+        module_index.typing_import_span = (1, 1)
         return code
 
-    # In this case, there is `from typing import` section, but the `class_name` is not in the `names` list.
-    # Hence, we need to add it.
-    node_from_typing = tree.body[idx_node_from_typing]
-    start_line = node_from_typing.lineno - 1
-    end_line = node_from_typing.end_lineno
+    # In this case, there is `from typing import` section, but the classes are not in the `names` list.
+    # Hence, we need to add them.
+    start_line, end_line = module_index.typing_import_span
+    start_line -= 1
 
     # Get the lines containing the import statement
-    import_lines = code.splitlines()[start_line:end_line]
+    line_starts = module_index.line_starts
+    import_lines = module_index.code[
+        line_starts[start_line] : line_starts[end_line]
+    ].splitlines()
     import_text = "\n".join(import_lines)
 
     # Handle single-line imports: from typing import Type1, Type2
     if len(import_lines) == 1:
-        # Insert the new class before the end of the line
+        # Insert the new classes before the end of the line
         if import_text.strip().endswith(")"):
             # It's a single line with parentheses: from typing import (Type1, Type2)
-            modified_import = import_text.replace(")", f", {class_name})")
+            modified_import = import_text.replace(")", f", {class_names_text})")
         else:
             # Regular single line: from typing import Type1, Type2
-            modified_import = import_text + f", {class_name}"
+            modified_import = import_text + f", {class_names_text}"
     # Handle multi-line imports: from typing import (Type1, Type2)
     else:
         # Check if the import uses parentheses
@@ -50,18 +70,21 @@ def maybe_add_class_to_typing_import(code: str, class_name: str = "Union") -> st
             # Find the line with the closing parenthesis
             for i, line in enumerate(import_lines):
                 if ")" in line:
-                    # Add the new class before the closing parenthesis
+                    # Add the new classes before the closing parenthesis
                     indent = len(line) - len(line.lstrip())
                     spaces = " " * indent
-                    import_lines[i] = line.replace(")", f"    {class_name},\n{spaces})")
+                    class_lines = "".join(
+                        f"    {class_name},\n" for class_name in missing_class_names
+                    )
+                    import_lines[i] = line.replace(")", f"{class_lines}{spaces})")
                     break
             modified_import = "\n".join(import_lines)
         else:
             # Convert to multi-line format
-            modified_import = import_lines[0] + f", {class_name}"
+            modified_import = import_lines[0] + f", {class_names_text}"
 
     # Replace the import statement in the code
-    lines = code.splitlines()
-    lines[start_line:end_line] = modified_import.splitlines()
-
-    return "\n".join(lines)
+    new_lines = modified_import.splitlines()
+    code = module_index.replace_lines(start_line, end_line, new_lines)
+    module_index.typing_import_span = (start_line + 1, start_line + len(new_lines))
+    return code
@@ -1,33 +1,54 @@
+from __future__ import annotations
+
 import ast
+import asyncio
 import re
 import typing
-from typing import Union, Optional
+from functools import cache, partial
+from typing import TYPE_CHECKING, Union, Optional
 import json
 
-from openai import Client
 from pydantic import create_model, Field, BaseModel
-from transformers import PreTrainedTokenizerFast
+
+if TYPE_CHECKING:
+    from openai import AsyncClient, Client
+    from transformers import PreTrainedTokenizerFast
 
 from ..utils.prompts import (
     MESSAGES_ARGUMENTS_ANNOTATION,
-    MESSAGES_FIX_ANNOTATION,
+    MESSAGES_FIX_ANNOTATIONS,
     USER_PROMPT,
 )
 from ..utils.utils import (
-    get_valid_json_if_possible,
     get_model_checkpoint_and_params,
     extract_llm_response_data,
+    get_anthropic_client,
+)
+from ..utils.streaming_json import JSONEvent, StreamingJSONParser
+from ..utils.annotation_repair import repair_annotation
+from ..utils.type_inference import TypeInference
+from ..utils.cache import ResultsCache, get_node_source, make_cache_key
+from ..utils.edit_buffer import EditBuffer
+from ..utils.module_index import ModuleIndex
+from ..utils.concurrency import (
+    LLM_REQUEST_LIMITER,
+    iterate_concurrently_in_order,
+    aiterate_concurrently_in_order,
 )
 from ..utils.constants import (
     DEFAULT_TOP_P_ANNOTATIONS,
+    DEFAULT_MAX_TOKENS_DICT,
     DEFAULT_MODEL_CHECKPOINT,
     ANNOTATION_MAX_NUM_NODES_PER_MODEL,
+    ANNOTATION_MAX_CONCURRENT_BATCHES,
     FORBIDDEN_ARG_NAMES_IN_ANNOTATION,
 )
 from .write_docstrings import get_docstring_position_for_node_with_no_docstring
 
 
 TYPING_CLASSES = set(name for name in dir(typing) if name[0].isupper())
+# The identifiers that are not attributes
+_NAME_PATTERN = re.compile(r"(?<![\w.])[A-Za-z_]\w*")
 
 POSSIBLE_RETURNS_ANNOTATION_TYPES = (
     ast.Constant,
@@ -56,156 +77,389 @@ def write_arguments_annotations(
     model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
     annotate_with_any: bool = False,
     use_streaming: bool = True,
+    cache: ResultsCache | None = None,
+    max_concurrent_batches: int = ANNOTATION_MAX_CONCURRENT_BATCHES,
+    module_index: ModuleIndex | None = None,
 ):
-    if use_streaming:
-        generation_function = _process_streaming_completion
-    else:
-        generation_function = _process_non_streaming_completion
-    # Create the Pydantic models and get the nodes and args
-    models_and_args = _create_pydantic_model_and_get_nodes_args(
-        target_nodes_dict, modify_existing_documentation=modify_existing_documentation
+    prepared = _prepare_annotations(
+        target_nodes_dict=target_nodes_dict,
+        code=code,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        annotate_with_any=annotate_with_any,
+        cache=cache,
+        module_index=module_index,
     )
-    if models_and_args is None:
+    if prepared is None:
         # In this case, there are no arguments to annotate
         return
-    pydantic_models, all_nodes_with_args = models_and_args
-
-    # Initialize tracking variables
-    mutable_vars = {
-        "code": code,
-        "prev_arg_lineno": 0,
-        "shift_inside_line": 0,
-        "lines_shift": 0,
-    }
+    pydantic_models, cache_keys, apply_kwargs = prepared
+    # The edits are independent of each other, so the known annotations go first
+    yield from _apply_known_annotations(**apply_kwargs)
+    batch_kwargs = dict(
+        client=client,
+        code=code,
+        tokenizer=tokenizer,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+        cache_keys=cache_keys,
+    )
 
-    for pydantic_model in pydantic_models:
-        user_prompt = str(USER_PROMPT).format(
-            code=code, json_schema=pydantic_model.model_json_schema()
-        )
-        model_checkpoint, max_tokens = get_model_checkpoint_and_params(
-            user_prompt=user_prompt,
-            tokenizer=tokenizer,
-            pydantic_model=pydantic_model,
-            task="annotations",
+    response_data = {}
+    if use_streaming:
+        # The batches are generated concurrently, while their annotations are applied in the
+        # order of the batches since the positions in the code depend on the previous edits
+        for output in iterate_concurrently_in_order(
+            [
+                partial(_stream_batch_annotations, pydantic_model=x, **batch_kwargs)
+                for x in pydantic_models
+            ],
+            max_workers=max_concurrent_batches,
+        ):
+            if isinstance(output, dict):
+                response_data = output
+            else:
+                yield from _apply_generated_annotation(
+                    *output, apply_kwargs=apply_kwargs
+                )
+    else:
+        for pydantic_model in pydantic_models:
+            batch_model_checkpoint, max_tokens, messages = _create_batch_request(
+                pydantic_model=pydantic_model,
+                code=code,
+                tokenizer=tokenizer,
+                model_checkpoint=model_checkpoint,
+            )
+            response_data = yield from _process_non_streaming_completion(
+                client=client,
+                model_checkpoint=batch_model_checkpoint,
+                messages=messages,
+                max_tokens=max_tokens,
+                pydantic_model=pydantic_model,
+                apply_kwargs=apply_kwargs,
+                cache=cache,
+                cache_keys=cache_keys,
+            )
+    mutable_vars = apply_kwargs["mutable_vars"]
+    # The annotations that could not be repaired locally are fixed with one request
+    if mutable_vars["broken_annotations"]:
+        fixed_annotations = _request_annotations_fix(
+            client=client,
             model_checkpoint=model_checkpoint,
+            broken_annotations=mutable_vars["broken_annotations"],
         )
-        messages = list(MESSAGES_ARGUMENTS_ANNOTATION) + [
-            {"role": "user", "content": user_prompt}
-        ]
-        yield from generation_function(
+        yield from _apply_fixed_annotations(
+            fixed_annotations,
+            apply_kwargs=apply_kwargs,
+            cache=cache,
+            cache_keys=cache_keys,
+        )
+    yield mutable_vars["buffer"].code, mutable_vars[
+        "required_typing_imports"
+    ], response_data
+
+
+async def awrite_arguments_annotations(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    client: AsyncClient,
+    tokenizer: PreTrainedTokenizerFast,
+    modify_existing_documentation: bool = False,
+    model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
+    annotate_with_any: bool = False,
+    cache: ResultsCache | None = None,
+    max_concurrent_batches: int = ANNOTATION_MAX_CONCURRENT_BATCHES,
+    module_index: ModuleIndex | None = None,
+):
+    """Async version of `write_arguments_annotations`. Only the streaming mode is supported."""
+    prepared = await asyncio.to_thread(
+        _prepare_annotations,
+        target_nodes_dict=target_nodes_dict,
+        code=code,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        annotate_with_any=annotate_with_any,
+        cache=cache,
+        module_index=module_index,
+    )
+    if prepared is None:
+        # In this case, there are no arguments to annotate
+        return
+    pydantic_models, cache_keys, apply_kwargs = prepared
+    # The edits are independent of each other, so the known annotations go first
+    for output in _apply_known_annotations(**apply_kwargs):
+        yield output
+    batch_kwargs = dict(
+        client=client,
+        code=code,
+        tokenizer=tokenizer,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+        cache_keys=cache_keys,
+    )
+
+    response_data = {}
+    # The batches are generated concurrently, while their annotations are applied in the
+    # order of the batches since the positions in the code depend on the previous edits
+    async for output in aiterate_concurrently_in_order(
+        [
+            partial(_astream_batch_annotations, pydantic_model=x, **batch_kwargs)
+            for x in pydantic_models
+        ],
+        max_concurrency=max_concurrent_batches,
+    ):
+        if isinstance(output, dict):
+            response_data = output
+        else:
+            for code_snapshot in _apply_generated_annotation(
+                *output, apply_kwargs=apply_kwargs
+            ):
+                yield code_snapshot
+    mutable_vars = apply_kwargs["mutable_vars"]
+    # The annotations that could not be repaired locally are fixed with one request
+    if mutable_vars["broken_annotations"]:
+        fixed_annotations = await _arequest_annotations_fix(
             client=client,
             model_checkpoint=model_checkpoint,
-            messages=messages,
-            max_tokens=max_tokens,
-            pydantic_model=pydantic_model,
-            all_nodes_with_args=all_nodes_with_args,
+            broken_annotations=mutable_vars["broken_annotations"],
+        )
+        for code_snapshot in _apply_fixed_annotations(
+            fixed_annotations,
+            apply_kwargs=apply_kwargs,
+            cache=cache,
+            cache_keys=cache_keys,
+        ):
+            yield code_snapshot
+    yield mutable_vars["buffer"].code, mutable_vars[
+        "required_typing_imports"
+    ], response_data
+
+
+def _prepare_annotations(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    modify_existing_documentation: bool,
+    model_checkpoint: str,
+    annotate_with_any: bool,
+    cache: ResultsCache | None,
+    module_index: ModuleIndex | None = None,
+) -> tuple[list[type[BaseModel]], dict[str, str], dict] | None:
+    """
+    Creates the pydantic models of the nodes that need to be annotated by the LLM and the
+    state shared by the edits. Returns None if there are no arguments to annotate.
+    """
+    # The obvious annotations are inferred locally and left out of the models
+    type_inference = TypeInference(
+        tree=module_index.tree if module_index is not None else ast.parse(code),
+        nodes=(node for node, _ in target_nodes_dict.values()),
+    )
+    # Create the Pydantic models for each node and get the nodes and args
+    node_models, all_nodes_with_args, inferred_annotations = (
+        _create_node_models_and_get_nodes_args(
+            target_nodes_dict,
             modify_existing_documentation=modify_existing_documentation,
-            mutable_vars=mutable_vars,
-            annotate_with_any=annotate_with_any,
+            type_inference=type_inference,
         )
+    )
+    if len(node_models) == 0 and len(inferred_annotations) == 0:
+        return
+    # Nodes that have not changed since they were annotated last time are taken from the cache
+    cache_keys, cached_annotations = _get_cached_annotations(
+        node_models=node_models,
+        all_nodes_with_args=all_nodes_with_args,
+        code=code,
+        cache=cache,
+        model_checkpoint=model_checkpoint,
+        modify_existing_documentation=modify_existing_documentation,
+    )
+    pydantic_models = _batch_node_models(
+        [x for x in node_models if x.__name__ not in cached_annotations]
+    )
+
+    # Initialize tracking variables
+    mutable_vars = {
+        # The edits are made in the coordinates of `code`, which the nodes were parsed from
+        "buffer": EditBuffer(code),
+        "required_typing_imports": set(),
+        "cached_annotations": cached_annotations,
+        "inferred_annotations": inferred_annotations,
+        # `(node_name, key, value)` of the annotations that could not be repaired locally
+        "broken_annotations": [],
+    }
+    apply_kwargs = dict(
+        all_nodes_with_args=all_nodes_with_args,
+        mutable_vars=mutable_vars,
+        modify_existing_documentation=modify_existing_documentation,
+        annotate_with_any=annotate_with_any,
+    )
+    return pydantic_models, cache_keys, apply_kwargs
 
 
-def _process_streaming_completion(
+def _create_batch_request(
+    pydantic_model: type[BaseModel],
+    code: str,
+    tokenizer: PreTrainedTokenizerFast,
+    model_checkpoint: str,
+) -> tuple[str, int, list[dict[str, str]]]:
+    user_prompt = str(USER_PROMPT).format(
+        code=code, json_schema=pydantic_model.model_json_schema()
+    )
+    batch_model_checkpoint, max_tokens = get_model_checkpoint_and_params(
+        user_prompt=user_prompt,
+        tokenizer=tokenizer,
+        pydantic_model=pydantic_model,
+        task="annotations",
+        model_checkpoint=model_checkpoint,
+    )
+    messages = list(MESSAGES_ARGUMENTS_ANNOTATION) + [
+        {"role": "user", "content": user_prompt}
+    ]
+    return batch_model_checkpoint, max_tokens, messages
+
+
+def _stream_batch_annotations(
+    pydantic_model: type[BaseModel],
     client: Client,
+    code: str,
+    tokenizer: PreTrainedTokenizerFast,
     model_checkpoint: str,
-    messages: list,
-    max_tokens: int,
-    pydantic_model: BaseModel,
-    all_nodes_with_args: dict,
-    modify_existing_documentation: bool,
-    mutable_vars: dict[str, int | str],
-    annotate_with_any: bool = False,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
 ):
-    """Process the completion request using streaming."""
-    with client.beta.chat.completions.stream(
-        model=model_checkpoint,
+    """
+    Streams the annotations of one batch of nodes. Yields `(node_name, key, value)` for each
+    generated annotation and then the response data.
+    """
+    batch_model_checkpoint, max_tokens, messages = _create_batch_request(
+        pydantic_model=pydantic_model,
+        code=code,
+        tokenizer=tokenizer,
+        model_checkpoint=model_checkpoint,
+    )
+    with LLM_REQUEST_LIMITER, client.beta.chat.completions.stream(
+        model=batch_model_checkpoint,
         messages=messages,
         top_p=DEFAULT_TOP_P_ANNOTATIONS,
         max_tokens=max_tokens,
         response_format=pydantic_model,
         stream_options={"include_usage": True},
     ) as stream:
-        code = mutable_vars["code"]
-        prev_arg_lineno = mutable_vars["prev_arg_lineno"]
-        shift_inside_line = mutable_vars["shift_inside_line"]
-        lines_shift = mutable_vars["lines_shift"]
-        output = ""
-        output_length = 0
-        boundary = 1
-        finished_keys = {
-            x: set() for x in pydantic_model.model_json_schema()["$defs"].keys()
-        }
-        required_typing_imports = set()
+        parser = StreamingJSONParser()
+        stream_vars = _init_stream_vars(pydantic_model)
         for i, chunk in enumerate(stream):
-            if hasattr(chunk, "delta"):
-                output += chunk.delta
-                output_length += len(chunk.delta)
-                # Check that a new key has been processed
-                for end_pos in range(output_length, boundary, -1):
-                    # The output looks smth like `{"ClassKekMethodLol": {"arg1": "list[int]", "ar`
-                    if valid_dict := (
-                        get_valid_json_if_possible(output[:end_pos] + "}}")
-                        or get_valid_json_if_possible(output[:end_pos] + "}}")
-                    ):
-                        # TODO: stop checking all keys, only do for the last N keys and only if `chunk.delta` length is too large
-                        for node_name, node_annotations in valid_dict.items():
-                            for key, value in node_annotations.items():
-                                if not key in finished_keys[node_name] and value:
-                                    # If parts of the annotation belong to the `typing` package, add the imports
-                                    required_typing_imports = _potentially_add_typing_import(
-                                        value=value,
-                                        required_typing_imports=required_typing_imports,
-                                    )
-                                    # If the annotation is broken
-                                    value = _maybe_fix_unclosed_annotation(
-                                        value, client, model_checkpoint, max_tokens
-                                    )
-                                    # Update key value in the code
-                                    update_annotation_kwargs = dict(
-                                        arg_value=value,
-                                        code=code,
-                                        modify_existing_documentation=modify_existing_documentation,
-                                        prev_arg_lineno=prev_arg_lineno,
-                                        shift_inside_line=shift_inside_line,
-                                        lines_shift=lines_shift,
-                                        annotate_with_any=annotate_with_any,
-                                    )
-                                    # In this case this is an argument annotation
-                                    arg_data = all_nodes_with_args[node_name][1][key][0]
-                                    if not (
-                                        arg_data is None
-                                        or isinstance(
-                                            arg_data,
-                                            POSSIBLE_RETURNS_ANNOTATION_TYPES,
-                                        )
-                                    ):
-                                        (
-                                            code,
-                                            prev_arg_lineno,
-                                            shift_inside_line,
-                                            lines_shift,
-                                        ) = _update_argument_annotation_in_code(
-                                            arg_data=arg_data,
-                                            **update_annotation_kwargs,
-                                        )
-                                        yield code
-                                    else:
-                                        code, lines_shift = (
-                                            _update_returns_annotation_in_code(
-                                                func=all_nodes_with_args[node_name][0],
-                                                **update_annotation_kwargs,
-                                            )
-                                        )
-                                        yield code
-                                    finished_keys[node_name].add(key)
-                boundary = output_length
-        response_data = extract_llm_response_data(chunk)
-        # Update the mutable variables
-        mutable_vars["code"] = code
-        mutable_vars["prev_arg_lineno"] = prev_arg_lineno
-        mutable_vars["shift_inside_line"] = shift_inside_line
-        mutable_vars["lines_shift"] = lines_shift
-        yield code, required_typing_imports, response_data
+            if not hasattr(chunk, "delta"):
+                continue
+            for node_name, key, value in _iter_streamed_annotations(
+                events=parser.feed(chunk.delta),
+                stream_vars=stream_vars,
+                cache=cache,
+                cache_keys=cache_keys,
+            ):
+                # If the annotation is broken, it is repaired without the LLM when possible
+                value = repair_annotation(value) or value
+                stream_vars["generated_annotations"][node_name][key] = value
+                stream_vars["finished_keys"][node_name].add(key)
+                yield node_name, key, value
+        yield extract_llm_response_data(chunk)
+
+
+async def _astream_batch_annotations(
+    pydantic_model: type[BaseModel],
+    client: AsyncClient,
+    code: str,
+    tokenizer: PreTrainedTokenizerFast,
+    model_checkpoint: str,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
+):
+    """Async version of `_stream_batch_annotations`."""
+    # Tokenization of the prompt is CPU-bound
+    batch_model_checkpoint, max_tokens, messages = await asyncio.to_thread(
+        _create_batch_request,
+        pydantic_model=pydantic_model,
+        code=code,
+        tokenizer=tokenizer,
+        model_checkpoint=model_checkpoint,
+    )
+    async with client.beta.chat.completions.stream(
+        model=batch_model_checkpoint,
+        messages=messages,
+        top_p=DEFAULT_TOP_P_ANNOTATIONS,
+        max_tokens=max_tokens,
+        response_format=pydantic_model,
+        stream_options={"include_usage": True},
+    ) as stream:
+        parser = StreamingJSONParser()
+        stream_vars = _init_stream_vars(pydantic_model)
+        async for chunk in stream:
+            if not hasattr(chunk, "delta"):
+                continue
+            for node_name, key, value in _iter_streamed_annotations(
+                events=parser.feed(chunk.delta),
+                stream_vars=stream_vars,
+                cache=cache,
+                cache_keys=cache_keys,
+            ):
+                # If the annotation is broken, it is repaired without the LLM when possible
+                value = repair_annotation(value) or value
+                stream_vars["generated_annotations"][node_name][key] = value
+                stream_vars["finished_keys"][node_name].add(key)
+                yield node_name, key, value
+        yield extract_llm_response_data(chunk)
+
+
+def _init_stream_vars(pydantic_model: BaseModel) -> dict[str, dict]:
+    finished_keys = {
+        x: set() for x in pydantic_model.model_json_schema()["$defs"].keys()
+    }
+    return {
+        "finished_keys": finished_keys,
+        # Fixed annotations of each node, to be cached once the node is complete
+        "generated_annotations": {x: {} for x in finished_keys},
+    }
+
+
+def _iter_streamed_annotations(
+    events: list[JSONEvent],
+    stream_vars: dict[str, dict],
+    cache: ResultsCache | None,
+    cache_keys: dict[str, str] | None,
+):
+    """
+    Yields `(node_name, key, value)` for each annotation completed by the streamed events.
+    Must be consumed lazily: a node is cached only after its yielded annotations are recorded.
+    """
+    generated_annotations = stream_vars["generated_annotations"]
+    finished_keys = stream_vars["finished_keys"]
+    # The output looks smth like `{"ClassKekMethodLol": {"arg1": "list[int]", "ar`
+    for event in events:
+        if len(event.path) == 1:
+            # All the annotations of the node are generated
+            (node_name,) = event.path
+            if cache is not None and node_name in generated_annotations:
+                cache.set(cache_keys[node_name], generated_annotations[node_name])
+            continue
+        # Only the values of the arguments are of interest, not the whole node objects
+        if len(event.path) != 2:
+            continue
+        (node_name, key), value = event
+        if key in finished_keys[node_name] or not value:
+            continue
+        yield node_name, key, value
+
+
+def _apply_generated_annotation(
+    node_name: str,
+    key: str,
+    value: str,
+    apply_kwargs: dict,
+):
+    _apply_annotation(node_name=node_name, key=key, value=value, **apply_kwargs)
+    yield apply_kwargs["mutable_vars"]["buffer"].code
 
 
 def _process_non_streaming_completion(
@@ -214,118 +468,149 @@ def _process_non_streaming_completion(
     messages: list,
     max_tokens: int,
     pydantic_model: BaseModel,
-    all_nodes_with_args: dict,
-    modify_existing_documentation: bool,
-    mutable_vars: dict[str, int | str],
-    annotate_with_any: bool = False,
+    apply_kwargs: dict,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
 ):
     """
     Process the completion request without streaming.
     NB! Currently only supported for Anthropic with Instructor syntax
     """
     # Work-around for Anthropic models
-    import instructor
-    from anthropic import Anthropic
-    import os
-
-    api_key = os.getenv("ANTHROPIC_API_KEY", client.api_key)
-    client_anthropic = instructor.from_anthropic(client=Anthropic(api_key=api_key))
+    client_anthropic = get_anthropic_client(client)
 
-    code = mutable_vars["code"]
-    prev_arg_lineno = mutable_vars["prev_arg_lineno"]
-    shift_inside_line = mutable_vars["shift_inside_line"]
-    lines_shift = mutable_vars["lines_shift"]
-
-    response = client_anthropic.messages.create(
-        model=model_checkpoint,
-        messages=messages,
-        top_p=DEFAULT_TOP_P_ANNOTATIONS,
-        max_tokens=max_tokens,
-        response_model=pydantic_model,
-    )
+    with LLM_REQUEST_LIMITER:
+        response = client_anthropic.messages.create(
+            model=model_checkpoint,
+            messages=messages,
+            top_p=DEFAULT_TOP_P_ANNOTATIONS,
+            max_tokens=max_tokens,
+            response_model=pydantic_model,
+        )
     annotations_data = response.dict()
 
     if not annotations_data:
         # If we couldn't parse the JSON, yield the original code
-        yield code
-        return
-
-    required_typing_imports = set()
+        yield apply_kwargs["mutable_vars"]["buffer"].code
+        return {}
 
+    all_nodes_with_args = apply_kwargs["all_nodes_with_args"]
     # For each node in the response
     for node_name, node_annotations in annotations_data.items():
         if node_name not in all_nodes_with_args:
             continue
-
+        generated_annotations = {}
         for key, value in node_annotations.items():
             if not value:
                 continue
+            # If the annotation is broken, it is repaired without the LLM when possible
+            value = repair_annotation(value) or value
+            # Update the annotation in the code
+            _apply_annotation(node_name=node_name, key=key, value=value, **apply_kwargs)
+            generated_annotations[key] = value
+        if cache is not None:
+            cache.set(cache_keys[node_name], generated_annotations)
 
-            # If parts of the annotation belong to the `typing` package, add the imports
-            required_typing_imports = _potentially_add_typing_import(
-                value=value, required_typing_imports=required_typing_imports
-            )
+    # Final return with the response data
+    response_data = {"model": model_checkpoint, "output": response.model_dump_json()}
+    # Current work-around to handle Anthropic limits
+    import time
 
-            # If the annotation is broken
-            value = _maybe_fix_unclosed_annotation(
-                value, client, model_checkpoint, max_tokens
-            )
+    time.sleep(60)
+    return response_data
 
-            # Update key value in the code
-            update_annotation_kwargs = dict(
-                arg_value=value,
-                code=code,
-                modify_existing_documentation=modify_existing_documentation,
-                prev_arg_lineno=prev_arg_lineno,
-                shift_inside_line=shift_inside_line,
-                lines_shift=lines_shift,
-                annotate_with_any=annotate_with_any,
-            )
 
-            # Get the argument data
-            arg_data = all_nodes_with_args[node_name][1][key][0]
+def _apply_annotation(
+    node_name: str,
+    key: str,
+    value: str,
+    all_nodes_with_args: dict,
+    mutable_vars: dict,
+    modify_existing_documentation: bool,
+    annotate_with_any: bool = False,
+) -> None:
+    """Inserts the annotation into `mutable_vars["buffer"]`."""
+    # The annotations that can't be repaired locally are fixed by the LLM in the end
+    if (repaired_value := repair_annotation(value)) is None:
+        mutable_vars["broken_annotations"].append((node_name, key, value))
+        return
+    value = repaired_value
+    # If parts of the annotation belong to the `typing` package, add the imports
+    mutable_vars["required_typing_imports"] = _potentially_add_typing_import(
+        value=value, required_typing_imports=mutable_vars["required_typing_imports"]
+    )
+    # Update key value in the code
+    update_annotation_kwargs = dict(
+        arg_value=value,
+        buffer=mutable_vars["buffer"],
+        modify_existing_documentation=modify_existing_documentation,
+        annotate_with_any=annotate_with_any,
+    )
+    arg_data = all_nodes_with_args[node_name][1][key][0]
+    # In this case this is an argument annotation
+    if not (
+        arg_data is None or isinstance(arg_data, POSSIBLE_RETURNS_ANNOTATION_TYPES)
+    ):
+        _update_argument_annotation_in_code(
+            arg_data=arg_data, **update_annotation_kwargs
+        )
+    else:
+        _update_returns_annotation_in_code(
+            func=all_nodes_with_args[node_name][0], **update_annotation_kwargs
+        )
+
 
-            # Update the appropriate annotation in the code
-            if not (
-                arg_data is None
-                or isinstance(arg_data, POSSIBLE_RETURNS_ANNOTATION_TYPES)
-            ):
-                # Update argument annotation
-                code, prev_arg_lineno, shift_inside_line, lines_shift = (
-                    _update_argument_annotation_in_code(
-                        arg_data=arg_data, **update_annotation_kwargs
-                    )
-                )
-            else:
-                # Update returns annotation
-                code, lines_shift = _update_returns_annotation_in_code(
-                    func=all_nodes_with_args[node_name][0], **update_annotation_kwargs
-                )
+def _apply_known_annotations(**apply_kwargs):
+    """Applies the inferred and the cached annotations, yielding the code after each node."""
+    mutable_vars = apply_kwargs["mutable_vars"]
+    cached_annotations = mutable_vars["cached_annotations"]
+    inferred_annotations = mutable_vars["inferred_annotations"]
+    for node_name in list(inferred_annotations) + list(cached_annotations):
+        # The annotations cached before they could be inferred are applied once
+        node_annotations = {
+            **cached_annotations.pop(node_name, {}),
+            **inferred_annotations.pop(node_name, {}),
+        }
+        if not node_annotations:
+            continue
+        for key, value in node_annotations.items():
+            _apply_annotation(node_name=node_name, key=key, value=value, **apply_kwargs)
+        yield mutable_vars["buffer"].code
 
-    # Final yield with the updated code and required imports
-    response_data = {"model": model_checkpoint, "output": response.model_dump_json()}
-    # Current work-around to handle Anthropic limits
-    import time
 
-    time.sleep(60)
-    # Update the mutable variables
-    mutable_vars["code"] = code
-    mutable_vars["prev_arg_lineno"] = prev_arg_lineno
-    mutable_vars["shift_inside_line"] = shift_inside_line
-    mutable_vars["lines_shift"] = lines_shift
-    yield code, required_typing_imports, response_data
+def _get_cached_annotations(
+    node_models: list[type[BaseModel]],
+    all_nodes_with_args: dict,
+    code: str,
+    cache: ResultsCache | None,
+    model_checkpoint: str,
+    modify_existing_documentation: bool,
+) -> tuple[dict[str, str], dict[str, dict[str, str]]]:
+    cache_keys = {}
+    cached_annotations = {}
+    if cache is None:
+        return cache_keys, cached_annotations
+    lines = code.splitlines()
+    for node_model in node_models:
+        node_name = node_model.__name__
+        cache_keys[node_name] = make_cache_key(
+            source=get_node_source(lines, all_nodes_with_args[node_name][0]),
+            stage="annotations",
+            model_checkpoint=model_checkpoint,
+            modify_existing_documentation=modify_existing_documentation,
+        )
+        if (annotations := cache.get(cache_keys[node_name])) is not None:
+            cached_annotations[node_name] = annotations
+    return cache_keys, cached_annotations
 
 
 def _update_argument_annotation_in_code(
     arg_value: str,
     arg_data: Union[ast.arg, ast.AnnAssign, ast.Assign, ast.Subscript],
-    code: str,
-    prev_arg_lineno: int = 0,
-    shift_inside_line: int = 0,
-    lines_shift: int = 0,
+    buffer: EditBuffer,
     modify_existing_documentation: bool = False,
     annotate_with_any: bool = False,
-) -> tuple[str, int, int, int]:
+) -> None:
     # If the argument is `self`, we don't need to annotate it
     arg_name = (
         arg_data.arg
@@ -337,113 +622,60 @@ def _update_argument_annotation_in_code(
         )
     )
     if arg_name == "self":
-        return code, prev_arg_lineno, shift_inside_line, lines_shift
+        return
     elif arg_value == "Any" and not annotate_with_any:
-        return code, prev_arg_lineno, shift_inside_line, lines_shift
-    lineno = arg_data.lineno
-    lines = code.splitlines()
+        return
     if isinstance(arg_data, ast.Assign) or arg_data.annotation is None:
-        position = sum(len(line) + 1 for line in lines[: lineno - 1 + lines_shift])
         if isinstance(arg_data, (ast.arg, ast.AnnAssign)):
-            position += arg_data.end_col_offset
+            name_node = arg_data
         else:
-            position += arg_data.targets[0].end_col_offset
-        if prev_arg_lineno == lineno:
-            position += shift_inside_line
-            shift_inside_line += len(arg_value) + 2
-        else:
-            shift_inside_line = len(arg_value) + 2
-        code = code[:position] + ": " + arg_value + code[position:]
+            name_node = arg_data.targets[0]
+        position = buffer.offset(name_node.end_lineno, name_node.end_col_offset)
+        buffer.insert(position, ": " + arg_value)
     elif modify_existing_documentation:
-        annotation_start = (
-            sum(
-                len(line) + 1
-                for line in lines[: arg_data.annotation.lineno - 1 + lines_shift]
-            )
-            + arg_data.annotation.col_offset
-        )
-        annotation_end = (
-            sum(
-                len(line) + 1
-                for line in lines[: arg_data.annotation.end_lineno - 1 + lines_shift]
-            )
-            + arg_data.annotation.end_col_offset
+        annotation = arg_data.annotation
+        buffer.replace(
+            buffer.offset(annotation.lineno, annotation.col_offset),
+            buffer.offset(annotation.end_lineno, annotation.end_col_offset),
+            arg_value,
         )
-        if prev_arg_lineno == lineno:
-            annotation_start += shift_inside_line
-            annotation_end += shift_inside_line
-            shift_inside_line += len(arg_value) + annotation_start - annotation_end
-        else:
-            shift_inside_line = len(arg_value) + annotation_start - annotation_end
-        lines_shift -= arg_data.annotation.end_lineno - arg_data.annotation.lineno
-        code = code[:annotation_start] + arg_value + code[annotation_end:]
-    return code, lineno, shift_inside_line, lines_shift
 
 
 def _update_returns_annotation_in_code(
     arg_value: str,
-    code: str,
+    buffer: EditBuffer,
     func: Union[ast.FunctionDef, ast.AsyncFunctionDef],
     modify_existing_documentation: bool = False,
-    prev_arg_lineno: int = 0,
-    shift_inside_line: int = 0,
-    lines_shift: int = 0,
     annotate_with_any: bool = False,
-) -> tuple[str, int]:
+) -> None:
     if arg_value == "Any" and not annotate_with_any:
-        return code, lines_shift
+        return
 
+    code = buffer.original
     if func.returns is None:
         docstring_position = get_docstring_position_for_node_with_no_docstring(
-            node=func,
-            code=code,
-            lines_shift=lines_shift,
-            prev_arg_lineno=prev_arg_lineno,
-            shift_inside_line=shift_inside_line,
-        )
-        closing_bracket_position = code[:docstring_position].rfind(")") + 1
-        code = (
-            code[:closing_bracket_position]
-            + " -> "
-            + arg_value
-            + code[closing_bracket_position:]
+            node=func, buffer=buffer
         )
+        closing_bracket_position = code.rfind(")", 0, docstring_position) + 1
+        buffer.insert(closing_bracket_position, " -> " + arg_value)
     # This means the annotation exists
     elif modify_existing_documentation:
-        splitlines = code.splitlines()
-        start_position = (
-            sum(len(l) + 1 for l in splitlines[: func.returns.lineno - 1 + lines_shift])
-            + func.returns.col_offset
+        start_position = buffer.offset(func.returns.lineno, func.returns.col_offset)
+        end_position = buffer.offset(
+            func.returns.end_lineno, func.returns.end_col_offset
         )
-        end_position = (
-            sum(
-                len(l) + 1
-                for l in splitlines[: func.returns.end_lineno - 1 + lines_shift]
-            )
-            + func.returns.end_col_offset
-        )
-        if func.returns.lineno == prev_arg_lineno:
-            start_position += shift_inside_line
-            end_position += shift_inside_line
-        if (
-            code[:start_position].strip()[-1] == "("
-            and code[end_position:].strip()[0] == ")"
-        ):
-            new_code = (
-                code[:start_position].strip()[:-1]
-                + arg_value
-                + code[end_position + 1 :].strip()[1:]
-            )
+        # Skip the whitespace around the annotation
+        start = start_position
+        while start > 0 and code[start - 1].isspace():
+            start -= 1
+        end = end_position
+        while end < len(code) and code[end].isspace():
+            end += 1
+        # The annotation is wrapped in brackets, e.g. `-> (int)`
+        if code[start - 1] == "(" and code.startswith(")", end):
+            buffer.replace(start - 1, end + 1, arg_value)
         else:
-            new_code = (
-                code[:start_position].strip()
-                + " "
-                + arg_value
-                + code[end_position:].strip()
-            )
-        lines_shift -= len(code.strip().splitlines()) - len(new_code.splitlines())
-        code = new_code
-    return code, lines_shift
+            buffer.replace(start, end_position, " " + arg_value)
 
 
 def _create_pydantic_model_and_get_args_for_node(
@@ -451,6 +683,7 @@ def _create_pydantic_model_and_get_args_for_node(
     node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
     node_type: str,
     modify_existing_documentation: bool = False,
+    type_inference: TypeInference | None = None,
 ):
     if node_type == "class":
         node_args = _get_class_args_data(node)
@@ -467,9 +700,15 @@ def _create_pydantic_model_and_get_args_for_node(
         model_name = f"Class{class_name.title()}Method{method_name.title()}"
     else:
         raise NotImplementedError(f"Unsupported node type: {node_type}")
+    # The annotations inferred without the LLM
+    inferred_annotations = {}
     # Create a description and potentially default value for each argument
     args_with_field_data = {}
     for arg, arg_data in node_args.items():
+        inferred_annotation = _infer_annotation(node, arg, arg_data, type_inference)
+        if inferred_annotation is not None:
+            inferred_annotations[arg] = inferred_annotation
+            continue
         arg_kwargs = {}
         description = f"Annotation of the argument: `{arg}`"
         # Then the default value is not None
@@ -516,10 +755,14 @@ def _create_pydantic_model_and_get_args_for_node(
         or (node.returns is not None and not modify_existing_documentation)
     ):
         # Check that this node needs to be annotated in this case
-        if not len(args_data) and not modify_existing_documentation:
+        if (
+            not len(args_data)
+            and not inferred_annotations
+            and not modify_existing_documentation
+        ):
             return
         model = create_model(model_name, **args_data)
-        return model, node_args
+        return model, node_args, inferred_annotations
     else:
         node_args_names = set(node_args.keys())
         returns_argument_name = next(
@@ -543,12 +786,35 @@ def _create_pydantic_model_and_get_args_for_node(
         node_args[returns_argument_name] = (node.returns, returns_annotation)
     args_data, node_args = _fix_unavailable_arg_names(args_data, node_args)
 
-    model = create_model(
-        model_name,
-        **args_data,
-        **{returns_argument_name: (str, Field(**return_kwargs))},
-    )
-    return model, node_args
+    returns_data = {returns_argument_name: (str, Field(**return_kwargs))}
+    if node.returns is None and type_inference is not None:
+        if (returns_type := type_inference.infer_return_type(node)) is not None:
+            inferred_annotations[returns_argument_name] = returns_type
+            returns_data = {}
+    # Check that this node needs to be annotated in this case
+    if not args_data and not returns_data and not inferred_annotations:
+        return
+    model = create_model(model_name, **args_data, **returns_data)
+    return model, node_args, inferred_annotations
+
+
+def _infer_annotation(
+    node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
+    arg: str,
+    arg_data: tuple,
+    type_inference: TypeInference | None,
+) -> str | None:
+    # Only the missing annotations are inferred
+    if (
+        type_inference is None
+        or arg_data[1] is not None
+        or arg in FORBIDDEN_ARG_NAMES_IN_ANNOTATION
+    ):
+        return None
+    if isinstance(arg_data[0], ast.arg):
+        return type_inference.infer_argument_type(node, arg_data[0])
+    # Class attributes, e.g. `x = 1`
+    return type_inference.get_value_type(arg_data[0].value)
 
 
 def _create_pydantic_model_and_get_nodes_args(
@@ -576,34 +842,58 @@ def _create_pydantic_model_and_get_nodes_args(
         ],
     ]
 ]:
+    node_models, all_nodes_and_args, _ = _create_node_models_and_get_nodes_args(
+        target_nodes_dict, modify_existing_documentation=modify_existing_documentation
+    )
+    if len(node_models) == 0:
+        return
+    return (
+        _batch_node_models(node_models, max_num_nodes_per_model),
+        all_nodes_and_args,
+    )
+
+
+def _create_node_models_and_get_nodes_args(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    modify_existing_documentation: bool = False,
+    type_inference: TypeInference | None = None,
+) -> tuple[list[type[BaseModel]], dict, dict[str, dict[str, str]]]:
     node_models = []
     all_nodes_and_args = {}
+    inferred_annotations = {}
     for node_name, (node, node_type) in target_nodes_dict.items():
         model_and_args = _create_pydantic_model_and_get_args_for_node(
             node_name=node_name,
             node=node,
             node_type=node_type,
             modify_existing_documentation=modify_existing_documentation,
+            type_inference=type_inference,
         )
         if model_and_args is not None:
-            node_model, node_args = model_and_args
+            node_model, node_args, node_inferred_annotations = model_and_args
             all_nodes_and_args[node_model.__name__] = (node, node_args)
-            node_models.append(node_model)
-    if (num_nodes := len(node_models)) == 0:
-        return
-    elif num_nodes <= max_num_nodes_per_model:
-        fields = {model.__name__: (model, ...) for model in node_models}
-        pydantic_model = create_model("ArgumentsModel", **fields)
-        # Return a list for type consistency
-        return [pydantic_model], all_nodes_and_args
-    # Otherwise, we need to create several models
+            if node_inferred_annotations:
+                inferred_annotations[node_model.__name__] = node_inferred_annotations
+            # The nodes whose annotations are all inferred are not sent to the LLM
+            if node_model.model_fields:
+                node_models.append(node_model)
+    return node_models, all_nodes_and_args, inferred_annotations
+
+
+def _batch_node_models(
+    node_models: list[type[BaseModel]],
+    max_num_nodes_per_model: int = ANNOTATION_MAX_NUM_NODES_PER_MODEL,
+) -> list[type[BaseModel]]:
+    # Several models are created if there are too many nodes for one request
     pydantic_models = []
-    for i in range(0, num_nodes, max_num_nodes_per_model):
+    for i in range(0, len(node_models), max_num_nodes_per_model):
         batch = node_models[i : i + max_num_nodes_per_model]
         batch_fields = {model.__name__: (model, ...) for model in batch}
-        pydantic_model = create_model(f"ArgumentsModel", **batch_fields)
+        pydantic_model = create_model("ArgumentsModel", **batch_fields)
         pydantic_models.append(pydantic_model)
-    return pydantic_models, all_nodes_and_args
+    return pydantic_models
 
 
 def _arguments_without_annotation_exist(func_args_data: list[ast.arg]) -> bool:
@@ -689,41 +979,100 @@ def _get_function_or_method_args_data(
 def _potentially_add_typing_import(
     value: str, required_typing_imports: set[str]
 ) -> set[str]:
-    # e.g. value = Any
-    if value in TYPING_CLASSES:
-        required_typing_imports.add(value)
-        return required_typing_imports
-    # e.g. value = dict[str, Any] -> inner_values_in_typing_classes = [Any]
-    inner_values_in_typing_classes = [x for x in TYPING_CLASSES if ("[" + x) in value]
-    for inner_value in inner_values_in_typing_classes:
-        required_typing_imports.add(inner_value)
-    # e.g. value = Optional[Union[dict[str, Any], int]] -> outer_values_in_typing_classes = [Optional, Union]
-    outer_values_in_typing_classes = [x for x in TYPING_CLASSES if (x + "[") in value]
-    for outer_value in outer_values_in_typing_classes:
-        required_typing_imports.add(outer_value)
+    # e.g. value = Optional[Union[dict[str, Any], int]] -> Optional, Union, Any
+    required_typing_imports.update(_get_annotation_names(value) & TYPING_CLASSES)
     return required_typing_imports
 
 
-def _maybe_fix_unclosed_annotation(
-    value: str, client: Client, model_checkpoint: str, max_tokens: int = 1024
-):
-    if value.count("[") != value.count("]") or value.count("(") != value.count(")"):
-        print("Fixing unclosed annotation. Current annotation:\n" + value)
-        messages = list(MESSAGES_FIX_ANNOTATION) + [{"role": "user", "content": value}]
-        resp = client.beta.chat.completions.parse(
+@cache
+def _get_annotation_names(value: str) -> frozenset[str]:
+    # The names referenced by the annotation, not the attributes like `typing.Any`
+    try:
+        tree = ast.parse(value, mode="eval")
+    except SyntaxError:
+        # e.g. an unclosed annotation, whose identifiers are taken as they are
+        return frozenset(_NAME_PATTERN.findall(value))
+    return frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+
+
+def _create_fix_request(
+    broken_annotations: list[tuple[str, str, str]],
+) -> tuple[type[BaseModel], list[dict[str, str]]]:
+    fields = {
+        f"annotation{i}": (str, Field(description=f"Broken annotation: {value}"))
+        for i, (_, _, value) in enumerate(broken_annotations, start=1)
+    }
+    pydantic_model = create_model("AnnotationsFixModel", **fields)
+    json_schema = json.dumps(pydantic_model.model_json_schema()["properties"])
+    user_prompt = f"Json schema:\n```\n{json_schema}\n```"
+    messages = list(MESSAGES_FIX_ANNOTATIONS) + [
+        {"role": "user", "content": user_prompt}
+    ]
+    return pydantic_model, messages
+
+
+def _request_annotations_fix(
+    client: Client,
+    model_checkpoint: str,
+    broken_annotations: list[tuple[str, str, str]],
+) -> str:
+    """Asks the LLM to fix all the broken annotations at once. Returns the JSON output."""
+    pydantic_model, messages = _create_fix_request(broken_annotations)
+    with LLM_REQUEST_LIMITER:
+        response = client.beta.chat.completions.parse(
             model=model_checkpoint,
             messages=messages,
-            top_p=0.5,
-            max_tokens=max_tokens,
-            response_format=PythonAnnotationFixModel,
+            top_p=DEFAULT_TOP_P_ANNOTATIONS,
+            max_tokens=DEFAULT_MAX_TOKENS_DICT["annotations"],
+            response_format=pydantic_model,
         )
-        value = resp.choices[0].message.content
-        value = json.dumps(json.loads(value))
-    return value
+    return response.choices[0].message.content
 
 
-class PythonAnnotationFixModel(BaseModel):
-    fixed_annotation: str = Field(description="Fixed annotation of the argument.")
+async def _arequest_annotations_fix(
+    client: AsyncClient,
+    model_checkpoint: str,
+    broken_annotations: list[tuple[str, str, str]],
+) -> str:
+    """Async version of `_request_annotations_fix`."""
+    pydantic_model, messages = _create_fix_request(broken_annotations)
+    response = await client.beta.chat.completions.parse(
+        model=model_checkpoint,
+        messages=messages,
+        top_p=DEFAULT_TOP_P_ANNOTATIONS,
+        max_tokens=DEFAULT_MAX_TOKENS_DICT["annotations"],
+        response_format=pydantic_model,
+    )
+    return response.choices[0].message.content
+
+
+def _apply_fixed_annotations(
+    fixed_annotations: str,
+    apply_kwargs: dict,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
+):
+    """
+    Applies the annotations fixed by the LLM and yields the code. The annotations that are
+    still broken are skipped, so that the code remains valid.
+    """
+    mutable_vars = apply_kwargs["mutable_vars"]
+    broken_annotations = mutable_vars["broken_annotations"]
+    mutable_vars["broken_annotations"] = []
+    fixed_annotations = json.loads(fixed_annotations)
+    fixed_node_annotations = {}
+    for i, (node_name, key, _) in enumerate(broken_annotations, start=1):
+        value = fixed_annotations.get(f"annotation{i}")
+        if not value or (value := repair_annotation(value)) is None:
+            continue
+        _apply_annotation(node_name=node_name, key=key, value=value, **apply_kwargs)
+        fixed_node_annotations.setdefault(node_name, {})[key] = value
+    # The cached annotations of the nodes still have the broken values
+    if cache is not None:
+        for node_name, node_annotations in fixed_node_annotations.items():
+            if (annotations := cache.get(cache_keys[node_name])) is not None:
+                cache.set(cache_keys[node_name], {**annotations, **node_annotations})
+    yield mutable_vars["buffer"].code
 
 
 def _fix_unavailable_arg_names(args_data: dict, node_args: dict) -> tuple[dict, dict]:
@@ -1,19 +1,46 @@
+from __future__ import annotations
+
+import asyncio
+import functools
 import json
-from openai import Client
+from functools import partial
 from pydantic import create_model, Field, BaseModel
-from typing import Any
-from transformers import PreTrainedTokenizerFast
+from pydantic.fields import FieldInfo
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from openai import AsyncClient, Client
+    from transformers import PreTrainedTokenizerFast
 
 from ..utils.prompts import (
     MESSAGES_COMMENTS,
+    SPARSE_COMMENTS_INSTRUCTION,
     USER_PROMPT,
+    USER_PROMPT_SPARSE_COMMENTS,
 )
 from ..utils.utils import (
-    get_valid_json_if_possible,
     get_model_checkpoint_and_params,
     extract_llm_response_data,
+    get_anthropic_client,
+)
+from ..utils.streaming_json import JSONEvent, StreamingJSONParser
+from ..utils.cache import ResultsCache, make_cache_key
+from ..utils.comment_candidates import select_comment_candidates
+from ..utils.line_index import LineIndex
+from ..utils.module_index import ModuleIndex
+from ..utils.concurrency import (
+    LLM_REQUEST_LIMITER,
+    aiterate_concurrently_in_order,
+    iterate_concurrently_in_order,
+)
+from ..utils.constants import (
+    COMMENTS_FORMAT_LINES,
+    COMMENTS_FORMAT_SPARSE,
+    COMMENTS_MAX_CONCURRENT_REQUESTS,
+    COMMENTS_MAX_LINES_PER_REQUEST,
+    DEFAULT_MODEL_CHECKPOINT,
+    DEFAULT_TOP_P_COMMENTS,
 )
-from ..utils.constants import DEFAULT_TOP_P_COMMENTS, DEFAULT_MODEL_CHECKPOINT
 
 
 def write_comments(
@@ -23,13 +50,258 @@ def write_comments(
     modify_existing_documentation: bool = False,
     model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
     use_streaming: bool = True,
+    cache: ResultsCache | None = None,
+    line_numbers: set[int] | None = None,
+    max_lines_per_request: int | None = COMMENTS_MAX_LINES_PER_REQUEST,
+    max_concurrent_requests: int = COMMENTS_MAX_CONCURRENT_REQUESTS,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
+    module_index: ModuleIndex | None = None,
+):
+    scopes_keys, apply_kwargs, requests_kwargs = _prepare_comments(
+        code=code,
+        tokenizer=tokenizer,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+        line_numbers=line_numbers,
+        max_lines_per_request=max_lines_per_request,
+        comments_format=comments_format,
+        comments_budget=comments_budget,
+        module_index=module_index,
+    )
+    mutable_vars = apply_kwargs["mutable_vars"]
+    response_data = {}
+    if requests_kwargs:
+        # Choose between streaming and non-streaming based on user preference
+        if use_streaming:
+            # The requests are generated concurrently, while their comments are applied in
+            # the order of the requests since the lines must be processed in order
+            for output in iterate_concurrently_in_order(
+                [
+                    partial(_stream_comments, client=client, **request_kwargs)
+                    for request_kwargs in requests_kwargs
+                ],
+                max_workers=max_concurrent_requests,
+            ):
+                if isinstance(output, dict):
+                    response_data = _merge_response_data(response_data, output)
+                else:
+                    yield from _apply_generated_comment(
+                        *output, apply_kwargs=apply_kwargs
+                    )
+        else:
+            for request_kwargs in requests_kwargs:
+                output = yield from _process_non_streaming_comments(
+                    client=client, **request_kwargs, apply_kwargs=apply_kwargs
+                )
+                if output is None:
+                    return
+                response_data = _merge_response_data(response_data, output)
+        if cache is not None:
+            _cache_generated_comments(
+                scopes_keys, mutable_vars["generated_comments"], cache
+            )
+    # Apply the cached comments of the lines located after the last generated one
+    if _apply_cached_comments(before_key=None, **apply_kwargs):
+        mutable_vars["code"] = "\n".join(mutable_vars["splitlines"])
+    yield mutable_vars["code"], response_data
+
+
+async def awrite_comments(
+    code: str,
+    client: AsyncClient,
+    tokenizer: PreTrainedTokenizerFast,
+    modify_existing_documentation: bool = False,
+    model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
+    cache: ResultsCache | None = None,
+    line_numbers: set[int] | None = None,
+    max_lines_per_request: int | None = COMMENTS_MAX_LINES_PER_REQUEST,
+    max_concurrent_requests: int = COMMENTS_MAX_CONCURRENT_REQUESTS,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
+    module_index: ModuleIndex | None = None,
 ):
-    pydantic_model, lines_dict, splitlines, model_kwargs = _create_pydantic_model(code)
+    """Async version of `write_comments`. Only the streaming mode is supported."""
+    # Parsing of the code and tokenization of the prompt are CPU-bound
+    scopes_keys, apply_kwargs, requests_kwargs = await asyncio.to_thread(
+        _prepare_comments,
+        code=code,
+        tokenizer=tokenizer,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+        line_numbers=line_numbers,
+        max_lines_per_request=max_lines_per_request,
+        comments_format=comments_format,
+        comments_budget=comments_budget,
+        module_index=module_index,
+    )
+    mutable_vars = apply_kwargs["mutable_vars"]
+    response_data = {}
+    if requests_kwargs:
+        async for output in aiterate_concurrently_in_order(
+            [
+                partial(_astream_comments, client=client, **request_kwargs)
+                for request_kwargs in requests_kwargs
+            ],
+            max_concurrency=max_concurrent_requests,
+        ):
+            if isinstance(output, dict):
+                response_data = _merge_response_data(response_data, output)
+            else:
+                for code_snapshot in _apply_generated_comment(
+                    *output, apply_kwargs=apply_kwargs
+                ):
+                    yield code_snapshot
+        if cache is not None:
+            _cache_generated_comments(
+                scopes_keys, mutable_vars["generated_comments"], cache
+            )
+    # Apply the cached comments of the lines located after the last generated one
+    if _apply_cached_comments(before_key=None, **apply_kwargs):
+        mutable_vars["code"] = "\n".join(mutable_vars["splitlines"])
+    yield mutable_vars["code"], response_data
+
+
+def _prepare_comments(
+    code: str,
+    tokenizer: PreTrainedTokenizerFast,
+    modify_existing_documentation: bool,
+    model_checkpoint: str,
+    cache: ResultsCache | None,
+    line_numbers: set[int] | None = None,
+    max_lines_per_request: int | None = None,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
+    module_index: ModuleIndex | None = None,
+) -> tuple[dict[str, list[str]], dict, list[dict]]:
+    """
+    Creates the state shared by the edits and the requests for the lines missing in the cache.
+    If `line_numbers` (1-based) are given, only the comments of these lines are written and
+    the other lines are left as they are. If more than `max_lines_per_request` lines are to
+    be commented, the module is split by its top-level functions and classes into several
+    requests, each with the code of its scopes only. With `COMMENTS_FORMAT_SPARSE`, the lines
+    are numbered in the code and the model lists only the lines that need comments. With
+    `comments_budget`, only the lines picked by `select_comment_candidates` are commented.
+    The structure of the module is taken from `module_index`, or the code is parsed once if
+    it is needed and the index is not given.
+
+    Returns:
+        `tuple[dict[str, list[str]], dict, list[dict]]`:
+            The keys of the lines of each cached scope, the kwargs of the edits and the kwargs
+            of the LLM requests (empty if all the comments are cached).
+    """
+
+    @functools.cache
+    def get_module_index() -> ModuleIndex:
+        return module_index or ModuleIndex(code)
+
+    if comments_budget is not None:
+        # The trivial lines are not sent to the LLM at all
+        candidate_lines = select_comment_candidates(
+            code, comments_budget, tree=get_module_index().tree
+        )
+        if line_numbers is not None:
+            candidate_lines &= line_numbers
+        line_numbers = candidate_lines
+    pydantic_model, line_index, model_kwargs = _create_pydantic_model(code)
+    schema = _get_prompt_schema(pydantic_model)
+    # Comments of the functions and classes that have not changed are taken from the cache
+    scopes_keys, cached_comments = {}, {}
+    if cache is not None:
+        scopes_keys, cached_comments = _get_cached_comments(
+            line_index=line_index,
+            scope_spans=get_module_index().scope_spans,
+            cache=cache,
+            model_checkpoint=model_checkpoint,
+            modify_existing_documentation=modify_existing_documentation,
+        )
+    original_lines = line_index.lines
+    keys_by_index = _get_keys_by_index(line_index)
+    if line_numbers is not None:
+        keys_to_write = {
+            key for i, key in keys_by_index.items() if i + 1 in line_numbers
+        }
+        model_kwargs = {
+            key: value for key, value in model_kwargs.items() if key in keys_to_write
+        }
+        cached_comments = {
+            key: value for key, value in cached_comments.items() if key in keys_to_write
+        }
+    mutable_vars = {
+        "code": code,
+        "splitlines": list(original_lines),
+        # The lines added above the processed lines so far and the last processed line
+        "num_added_lines": 0,
+        "last_line_id": -1,
+        "cached_comments": cached_comments,
+        "generated_comments": {},
+    }
+    apply_kwargs = {
+        "line_index": line_index,
+        "schema": schema,
+        "mutable_vars": mutable_vars,
+        "modify_existing_documentation": modify_existing_documentation,
+    }
+    if len(cached_comments) == len(model_kwargs):
+        return scopes_keys, apply_kwargs, []
+
+    if cached_comments or line_numbers is not None:
+        model_kwargs = {
+            key: value
+            for key, value in model_kwargs.items()
+            if key not in cached_comments
+        }
+        pydantic_model = create_model("CodeCommentsModel", **model_kwargs)
+    if max_lines_per_request is None or len(model_kwargs) <= max_lines_per_request:
+        request_kwargs = _create_request(
+            code=code,
+            pydantic_model=pydantic_model,
+            tokenizer=tokenizer,
+            model_checkpoint=model_checkpoint,
+            comments_format=comments_format,
+        )
+        keys_map = {key: key for key in model_kwargs}
+        return scopes_keys, apply_kwargs, [dict(request_kwargs, keys_map=keys_map)]
+
+    requests_kwargs = []
+    for start, end in _split_lines_by_scopes(
+        scope_spans=get_module_index().scope_spans,
+        num_lines=len(original_lines),
+        keys_to_write=set(model_kwargs),
+        keys_by_index=keys_by_index,
+        max_lines=max_lines_per_request,
+    ):
+        # The lines are numerated anew within the code of the request
+        chunk_keys = [keys_by_index[i] for i in range(start, end) if i in keys_by_index]
+        keys_map = {}
+        chunk_model_kwargs = {}
+        for local_id, key in enumerate(chunk_keys, 1):
+            if key not in model_kwargs:
+                continue
+            local_key = f"line{local_id}"
+            keys_map[local_key] = key
+            chunk_model_kwargs[local_key] = _renumber_field(
+                model_kwargs[key], key=key, local_id=local_id
+            )
+        request_kwargs = _create_request(
+            code="\n".join(original_lines[start:end]),
+            pydantic_model=create_model("CodeCommentsModel", **chunk_model_kwargs),
+            tokenizer=tokenizer,
+            model_checkpoint=model_checkpoint,
+            comments_format=comments_format,
+        )
+        requests_kwargs.append(dict(request_kwargs, keys_map=keys_map))
+    return scopes_keys, apply_kwargs, requests_kwargs
+
+
+def _get_prompt_schema(pydantic_model: type[BaseModel]) -> dict:
     # We reduced the schema with this "trick" in system prompt to add more examples.
     # Hence, need to match the same format here.
     schema = pydantic_model.model_json_schema()["properties"]
     # For the sake of prompt length, we remove 'redundant' attributes
-    schema = {
+    return {
         key: {
             key2: value2
             for key2, value2 in value.items()
@@ -37,7 +309,27 @@ def write_comments(
         }
         for key, value in schema.items()
     }
-    user_prompt = str(USER_PROMPT).format(code=code, json_schema=json.dumps(schema))
+
+
+def _create_request(
+    code: str,
+    pydantic_model: type[BaseModel],
+    tokenizer: PreTrainedTokenizerFast,
+    model_checkpoint: str,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+) -> dict:
+    if comments_format == COMMENTS_FORMAT_SPARSE:
+        # Only the lines to comment are numbered, the model refers to them by the numbers
+        user_prompt = str(USER_PROMPT_SPARSE_COMMENTS).format(
+            code=_number_lines(code, set(pydantic_model.model_fields))
+        )
+        pydantic_model = SparseCodeCommentsModel
+        base_messages = _get_sparse_comments_messages()
+    else:
+        user_prompt = str(USER_PROMPT).format(
+            code=code, json_schema=json.dumps(_get_prompt_schema(pydantic_model))
+        )
+        base_messages = MESSAGES_COMMENTS
     model_checkpoint, max_tokens = get_model_checkpoint_and_params(
         user_prompt=user_prompt,
         tokenizer=tokenizer,
@@ -45,50 +337,142 @@ def write_comments(
         task="comments",
         model_checkpoint=model_checkpoint,
     )
-    messages = list(MESSAGES_COMMENTS) + [{"role": "user", "content": user_prompt}]
-    # Choose between streaming and non-streaming based on user preference
-    if use_streaming:
-        yield from _process_streaming_comments(
-            client=client,
-            model_checkpoint=model_checkpoint,
-            messages=messages,
-            max_tokens=max_tokens,
-            pydantic_model=pydantic_model,
-            lines_dict=lines_dict,
-            splitlines=splitlines,
-            schema=schema,
-            code=code,
-            modify_existing_documentation=modify_existing_documentation,
+    messages = list(base_messages) + [{"role": "user", "content": user_prompt}]
+    return {
+        "model_checkpoint": model_checkpoint,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "pydantic_model": pydantic_model,
+    }
+
+
+class LineComment(BaseModel):
+    line: int
+    comment: str
+
+
+class SparseCodeCommentsModel(BaseModel):
+    comments: list[LineComment]
+
+
+def _number_lines(code: str, keys: set[str]) -> str:
+    # Same numeration `N. line` as in the schema of the per-line format
+    line_index = LineIndex(code)
+    lines = list(line_index.lines)
+    for i, key in _get_keys_by_index(line_index).items():
+        if key in keys:
+            lines[i] = f"{_get_line_number(key)}. {lines[i]}"
+    return "\n".join(lines)
+
+
+@functools.cache
+def _get_sparse_comments_messages() -> list[dict]:
+    """
+    Converts the examples of the per-line format in `MESSAGES_COMMENTS` to the sparse one:
+    the code with the numbered lines and the list of the non-empty comments.
+    """
+    system_message, *examples = MESSAGES_COMMENTS
+    messages = [
+        {
+            "role": "system",
+            "content": system_message["content"]
+            .replace("following the provided json schema", "for the numbered lines")
+            .replace("leave the comment empty", "leave the line out")
+            .replace("leave it empty as well", "leave the line out as well")
+            + SPARSE_COMMENTS_INSTRUCTION,
+        }
+    ]
+    for user_message, assistant_message in zip(examples[::2], examples[1::2]):
+        code = user_message["content"].split("```\n", 1)[1].split("\n```", 1)[0]
+        comments = json.loads(assistant_message["content"])
+        content = json.dumps(
+            {
+                "comments": [
+                    {"line": _get_line_number(key), "comment": value}
+                    for key, value in comments.items()
+                    if value
+                ]
+            }
         )
-    else:
-        yield from _process_non_streaming_comments(
-            client=client,
-            model_checkpoint=model_checkpoint,
-            messages=messages,
-            max_tokens=max_tokens,
-            pydantic_model=pydantic_model,
-            lines_dict=lines_dict,
-            splitlines=splitlines,
-            schema=schema,
-            code=code,
-            modify_existing_documentation=modify_existing_documentation,
+        messages += [
+            {
+                "role": "user",
+                "content": str(USER_PROMPT_SPARSE_COMMENTS).format(
+                    code=_number_lines(code, set(comments))
+                ),
+            },
+            {"role": "assistant", "content": content},
+        ]
+    return messages
+
+
+def _split_lines_by_scopes(
+    scope_spans: list[tuple[int, int]],
+    num_lines: int,
+    keys_to_write: set[str],
+    keys_by_index: dict[int, str],
+    max_lines: int,
+) -> list[tuple[int, int]]:
+    """
+    Splits the lines of the code into the ranges `[start, end)` of consecutive top-level
+    functions, classes and module-level statements, so that each range has at most `max_lines`
+    lines to comment. A scope with more lines than that makes a range of its own.
+    """
+    # The boundaries of the scopes, the decorators of a node stay with it
+    boundaries = [0]
+    for first_lineno, end_lineno in scope_spans:
+        boundaries += [first_lineno - 1, end_lineno]
+    boundaries.append(num_lines)
+    boundaries = sorted(set(boundaries))
+
+    ranges = []
+    range_start, range_lines = 0, 0
+    for start, end in zip(boundaries, boundaries[1:]):
+        scope_lines = sum(
+            keys_by_index.get(i) in keys_to_write for i in range(start, end)
         )
+        if range_lines and range_lines + scope_lines > max_lines:
+            ranges.append((range_start, start))
+            range_start, range_lines = start, 0
+        range_lines += scope_lines
+    if range_lines:
+        ranges.append((range_start, num_lines))
+    return [
+        (start, end)
+        for start, end in ranges
+        if any(keys_by_index.get(i) in keys_to_write for i in range(start, end))
+    ]
+
+
+def _renumber_field(
+    field_kwargs: tuple[type, FieldInfo], key: str, local_id: int
+) -> tuple[type, FieldInfo]:
+    annotation, field = field_kwargs
+    line_kwargs = {
+        "description": field.description.replace(
+            f"Comment for line {_get_line_number(key)}:",
+            f"Comment for line {local_id}:",
+            1,
+        )
+    }
+    if not field.is_required():
+        line_kwargs["default"] = field.default
+    return annotation, Field(**line_kwargs)
 
 
-def _process_streaming_comments(
+def _stream_comments(
     client: Client,
     model_checkpoint: str,
     messages: list,
     max_tokens: int,
     pydantic_model,
-    lines_dict: dict,
-    splitlines: list,
-    schema: dict,
-    code: str,
-    modify_existing_documentation: bool,
+    keys_map: dict[str, str] | None,
 ):
-    """Process the comments completion request using streaming."""
-    with client.beta.chat.completions.stream(
+    """
+    Streams the comments of one request. Yields `(key, value)` for each generated comment,
+    with the key of the line in the whole module, and then the response data.
+    """
+    with LLM_REQUEST_LIMITER, client.beta.chat.completions.stream(
         model=model_checkpoint,
         messages=messages,
         top_p=DEFAULT_TOP_P_COMMENTS,
@@ -96,67 +480,128 @@ def _process_streaming_comments(
         response_format=pydantic_model,
         stream_options={"include_usage": True},
     ) as stream:
-        output = ""
-        output_length = 0
-        boundary = 1
-        finished_keys = set()
-        id_line_in_splitlines = -1
+        parser = StreamingJSONParser()
+        stream_vars = {"next_index": 0}
         for i, chunk in enumerate(stream):
-            if hasattr(chunk, "delta"):
-                output += chunk.delta
-                output_length += len(chunk.delta)
-                # Check that a new key has been processed
-                for end_pos in range(output_length, boundary, -1):
-                    if valid_dict := get_valid_json_if_possible(output[:end_pos] + "}"):
-                        for key, value in valid_dict.items():
-                            # TODO: optimize here
-                            if not key in finished_keys:
-                                # The outputted keys will look like `line{id}`
-                                line = lines_dict[key]
-                                finished_keys.add(key)
-                                if value or (
-                                    "default" in schema[key]
-                                    and modify_existing_documentation
-                                ):
-                                    (
-                                        ids_comment_lines,
-                                        line_has_inline_comment,
-                                        id_line_in_splitlines,
-                                    ) = _find_ids_comments_for_line(
-                                        line=line,
-                                        splitlines=splitlines,
-                                        next_line_index_in_code=id_line_in_splitlines
-                                        + 1,
-                                    )
-                                    # TODO: maybe remove already commented lines from schema if not `modify_existing_documentation`
-                                    # If existing comments should not be modified, continue
-                                    if (
-                                        len(ids_comment_lines) > 0
-                                        or line_has_inline_comment
-                                    ) and not modify_existing_documentation:
-                                        continue
-                                    # Insert comment to the code
-                                    splitlines, id_line_in_splitlines = (
-                                        _update_line_comment_in_code(
-                                            new_value=value,
-                                            line=line,
-                                            splitlines=splitlines,
-                                            id_line_in_splitlines=id_line_in_splitlines,
-                                            ids_comment_lines=ids_comment_lines,
-                                            line_has_inline_comment=line_has_inline_comment,
-                                        )
-                                    )
-                                    code = _restore_code_from_numerated_lines(
-                                        splitlines
-                                    )
-                                    yield code
-                                else:
-                                    id_line_in_splitlines = splitlines.index(
-                                        line, id_line_in_splitlines + 1
-                                    )
-                boundary = output_length
-        response_data = extract_llm_response_data(chunk)
-        yield code, response_data
+            if not hasattr(chunk, "delta"):
+                continue
+            yield from _iter_streamed_comments(
+                parser.feed(chunk.delta), keys_map, pydantic_model, stream_vars
+            )
+        yield extract_llm_response_data(chunk)
+
+
+async def _astream_comments(
+    client: AsyncClient,
+    model_checkpoint: str,
+    messages: list,
+    max_tokens: int,
+    pydantic_model,
+    keys_map: dict[str, str] | None,
+):
+    """Async version of `_stream_comments`."""
+    async with client.beta.chat.completions.stream(
+        model=model_checkpoint,
+        messages=messages,
+        top_p=DEFAULT_TOP_P_COMMENTS,
+        max_tokens=max_tokens,
+        response_format=pydantic_model,
+        stream_options={"include_usage": True},
+    ) as stream:
+        parser = StreamingJSONParser()
+        stream_vars = {"next_index": 0}
+        async for chunk in stream:
+            if not hasattr(chunk, "delta"):
+                continue
+            for output in _iter_streamed_comments(
+                parser.feed(chunk.delta), keys_map, pydantic_model, stream_vars
+            ):
+                yield output
+        yield extract_llm_response_data(chunk)
+
+
+def _iter_streamed_comments(
+    events: list[JSONEvent],
+    keys_map: dict[str, str],
+    pydantic_model: type[BaseModel],
+    stream_vars: dict,
+):
+    """Yields `(key, value)` for the comments completed by the events, keyed in the whole module."""
+    if pydantic_model is SparseCodeCommentsModel:
+        yield from _iter_sparse_comments(events, keys_map, stream_vars)
+        return
+    for event in events:
+        # Only the top-level keys hold the comments
+        if len(event.path) != 1:
+            continue
+        (key,), value = event
+        if key in keys_map:
+            yield keys_map[key], value
+
+
+def _iter_sparse_comments(
+    events: list[JSONEvent], keys_map: dict[str, str], stream_vars: dict
+):
+    """
+    Turns the items `{"line": N, "comment": ...}` of the sparse format into the comments of
+    all the lines in order, as in the per-line format: the lines skipped by the model get empty
+    comments. The items out of order or for the lines that were not asked are ignored.
+    """
+    if "keys" not in stream_vars:
+        stream_vars["keys"] = list(keys_map)
+        stream_vars["positions"] = {key: i for i, key in enumerate(keys_map)}
+    keys, positions = stream_vars["keys"], stream_vars["positions"]
+    for event in events:
+        if event.path == ():
+            # The output is complete, so the remaining lines need no comments
+            end_index = len(keys)
+        elif (
+            len(event.path) == 2
+            and event.path[0] == "comments"
+            and isinstance(event.value, dict)
+        ):
+            key = f"line{event.value.get('line')}"
+            if key not in positions:
+                continue
+            end_index = positions[key]
+            if end_index < stream_vars["next_index"]:
+                continue
+        else:
+            continue
+        for skipped_key in keys[stream_vars["next_index"] : end_index]:
+            yield keys_map[skipped_key], ""
+        if end_index < len(keys):
+            yield keys_map[key], str(event.value.get("comment") or "")
+            end_index += 1
+        stream_vars["next_index"] = end_index
+
+
+def _apply_generated_comment(key: str, value: str, apply_kwargs: dict):
+    """Inserts the generated comment and yields the new code if it has changed."""
+    mutable_vars = apply_kwargs["mutable_vars"]
+    # The outputted keys will look like `line{id}`
+    if key in mutable_vars["generated_comments"]:
+        return
+    mutable_vars["generated_comments"][key] = value
+    # Lines must be processed in order, so the cached lines before go first
+    code_changed = _apply_cached_comments(before_key=key, **apply_kwargs)
+    code_changed |= _apply_comment(key=key, value=value, **apply_kwargs)
+    if code_changed:
+        mutable_vars["code"] = "\n".join(mutable_vars["splitlines"])
+        yield mutable_vars["code"]
+
+
+def _merge_response_data(response_data: dict, new_response_data: dict) -> dict:
+    # The token usage is summed over the requests
+    if not response_data:
+        return new_response_data
+    merged = dict(new_response_data)
+    for key in ("prompt_tokens", "completion_tokens"):
+        if key in response_data or key in new_response_data:
+            merged[key] = (response_data.get(key) or 0) + (
+                new_response_data.get(key) or 0
+            )
+    return merged
 
 
 def _process_non_streaming_comments(
@@ -165,77 +610,51 @@ def _process_non_streaming_comments(
     messages: list,
     max_tokens: int,
     pydantic_model: BaseModel,
-    lines_dict: dict,
-    splitlines: list,
-    schema: dict,
-    code: str,
-    modify_existing_documentation: bool,
+    keys_map: dict[str, str] | None,
+    apply_kwargs: dict,
 ):
     """
     Process the comments completion request without streaming.
     NB! Currently only supported for Anthropic with Instructor syntax
     """
+    mutable_vars = apply_kwargs["mutable_vars"]
     # Work-around for Anthropic models
-    import instructor
-    from anthropic import Anthropic
-    import os
-
-    api_key = os.getenv("ANTHROPIC_API_KEY", client.api_key)
-    client_anthropic = instructor.from_anthropic(client=Anthropic(api_key=api_key))
-    response = client_anthropic.messages.create(
-        model=model_checkpoint,
-        messages=messages,
-        top_p=DEFAULT_TOP_P_COMMENTS,
-        max_tokens=max_tokens,
-        response_model=pydantic_model,
-    )
+    client_anthropic = get_anthropic_client(client)
+    with LLM_REQUEST_LIMITER:
+        response = client_anthropic.messages.create(
+            model=model_checkpoint,
+            messages=messages,
+            top_p=DEFAULT_TOP_P_COMMENTS,
+            max_tokens=max_tokens,
+            response_model=pydantic_model,
+        )
     comments_data = response.dict()
 
     if not comments_data:
         # If we couldn't parse the JSON, yield the original code
-        yield code
+        yield mutable_vars["code"]
         return
 
-    id_line_in_splitlines = -1
-
+    if pydantic_model is SparseCodeCommentsModel:
+        events = [
+            JSONEvent(("comments", i), item)
+            for i, item in enumerate(comments_data["comments"])
+        ] + [JSONEvent((), comments_data)]
+        comments = _iter_sparse_comments(events, keys_map, {"next_index": 0})
+    else:
+        comments = (
+            (keys_map[key], value)
+            for key, value in comments_data.items()
+            if key in keys_map
+        )
     # Process all comments at once
-    for key, value in comments_data.items():
-        if key not in lines_dict:
-            continue
-
-        # Get the line to add the comment to
-        line = lines_dict[key]
-
-        if value or ("default" in schema[key] and modify_existing_documentation):
-            # Find the location of comments for this line
-            ids_comment_lines, line_has_inline_comment, id_line_in_splitlines = (
-                _find_ids_comments_for_line(
-                    line=line,
-                    splitlines=splitlines,
-                    next_line_index_in_code=id_line_in_splitlines + 1,
-                )
-            )
-
-            # If existing comments should not be modified, continue
-            if (
-                len(ids_comment_lines) > 0 or line_has_inline_comment
-            ) and not modify_existing_documentation:
-                continue
-
-            # Insert comment to the code
-            splitlines, id_line_in_splitlines = _update_line_comment_in_code(
-                new_value=value,
-                line=line,
-                splitlines=splitlines,
-                id_line_in_splitlines=id_line_in_splitlines,
-                ids_comment_lines=ids_comment_lines,
-                line_has_inline_comment=line_has_inline_comment,
-            )
-        else:
-            id_line_in_splitlines = splitlines.index(line, id_line_in_splitlines + 1)
+    for key, value in comments:
+        mutable_vars["generated_comments"][key] = value
+        _apply_cached_comments(before_key=key, **apply_kwargs)
+        _apply_comment(key=key, value=value, **apply_kwargs)
 
     # Generate the final code with all comments
-    code = _restore_code_from_numerated_lines(splitlines)
+    mutable_vars["code"] = "\n".join(mutable_vars["splitlines"])
 
     # Create response data from the usage info
     response_data = {"model": model_checkpoint, "output": response.model_dump_json()}
@@ -244,109 +663,195 @@ def _process_non_streaming_comments(
     import time
 
     time.sleep(60)
-    # Yield the final code with all comments added
-    yield code, response_data
+    return response_data
+
 
+def _apply_comment(
+    key: str,
+    value: str,
+    line_index: LineIndex,
+    schema: dict,
+    mutable_vars: dict,
+    modify_existing_documentation: bool,
+) -> bool:
+    """
+    Inserts the comment for the line `key` into `mutable_vars["splitlines"]`.
+
+    Args:
+        key (`str`):
+            The key of the line in the pydantic model, e.g. `line3`.
+        value (`str`):
+            The generated comment.
+        line_index (`LineIndex`):
+            The index of the lines of the original code.
+        schema (`dict`):
+            The reduced JSON schema of the comments model, used to check for existing comments.
+        mutable_vars (`dict`):
+            The state shared between the calls: the lines of the code, the number of the lines
+            added so far and the index of the last processed line.
+        modify_existing_documentation (`bool`):
+            Whether the existing comments can be replaced.
+
+    Returns:
+        `bool`:
+            Whether the lines were modified.
+    """
+    line_id = line_index.code_lines[_get_line_number(key) - 1]
+    # The edits are located by the number of the lines added before, so they must go in order
+    if line_id <= mutable_vars["last_line_id"]:
+        return False
+    mutable_vars["last_line_id"] = line_id
+    if not (value or ("default" in schema[key] and modify_existing_documentation)):
+        return False
+    ids_comment_lines = line_index.comment_lines_above[line_id]
+    inline_comment_start = line_index.inline_comments.get(line_id)
+    # TODO: maybe remove already commented lines from schema if not `modify_existing_documentation`
+    # If existing comments should not be modified, continue
+    if (
+        ids_comment_lines or inline_comment_start is not None
+    ) and not modify_existing_documentation:
+        return False
+    # Insert comment to the code
+    shift = mutable_vars["num_added_lines"]
+    mutable_vars["num_added_lines"] += _update_line_comment_in_code(
+        new_value=value,
+        splitlines=mutable_vars["splitlines"],
+        id_line_in_splitlines=line_id + shift,
+        ids_comment_lines=[i + shift for i in ids_comment_lines],
+        inline_comment_start=inline_comment_start,
+    )
+    return True
+
+
+def _apply_cached_comments(before_key: str | None, **apply_kwargs) -> bool:
+    """
+    Applies the cached comments of the lines located before the line `before_key` (or all
+    the remaining ones if it is None) and returns whether the lines were modified.
+    """
+    cached_comments = apply_kwargs["mutable_vars"]["cached_comments"]
+    code_changed = False
+    while cached_comments:
+        key = next(iter(cached_comments))
+        if before_key is not None and _get_line_number(key) > _get_line_number(
+            before_key
+        ):
+            break
+        code_changed |= _apply_comment(
+            key=key, value=cached_comments.pop(key), **apply_kwargs
+        )
+    return code_changed
 
-def _get_lined_code_and_lines(code: str) -> tuple[list[str], dict[str, str], list[str]]:
+
+def _get_cached_comments(
+    line_index: LineIndex,
+    scope_spans: list[tuple[int, int]],
+    cache: ResultsCache,
+    model_checkpoint: str,
+    modify_existing_documentation: bool,
+) -> tuple[dict[str, list[str]], dict[str, str]]:
     """
-    Processes the input code to add line numbers to valid lines and identify docstrings.
+    Splits the code lines by the top-level functions and classes and looks them up in the cache.
+    The lines outside of them (imports, module-level code) are cached together.
 
     Args:
-        code (`str`):
-            The input code as a string.
+        line_index (`LineIndex`):
+            The index of the lines of the code.
+        scope_spans (`list[tuple[int, int]]`):
+            The 1-based first and last lines of the top-level functions and classes.
+        cache (`ResultsCache`):
+            The cache of the generated comments.
+        model_checkpoint (`str`):
+            The model used to generate the comments.
+        modify_existing_documentation (`bool`):
+            Whether the existing comments can be replaced.
 
     Returns:
-        `tuple[list[str], dict[str, str], list[str]]`:
-            A tuple containing the modified lines with line numbers, a dictionary mapping line numbers to lines, and a list of valid code lines with line numbers.
+        `tuple[dict[str, list[str]], dict[str, str]]`:
+            The mapping from the cache keys of the scopes to the keys of their lines, and the cached comments of the lines in order.
     """
-    # Split the input code into individual lines
-    lines = code.splitlines()
-    # Initialize a list to store valid code lines
-    valid_code_lines = []
-    # Initialize a counter for line numbers
-    counter = 1
-    # Flag to check if a docstring is currently open
-    docstring_is_open = False
-    # Variable to store the type of docstring (triple quotes)
-    docstring_type = None
-    # Iterate over each line in the code with line numbers
-    for i, line in enumerate(lines, 1):
-        # Check if the line is not empty, not a comment, not a docstring, and not inside a docstring
-        if (
-            # Strip whitespace from the line
-            len(line_stripped := line.strip())
-            # Check if the line does not start with a comment symbol
-            and (line_stripped[0] != "#")
-            # Check if the line is not a docstring
-            and (not line_stripped in ['"""', "'''"])
-            # Check if a docstring is not currently open
-            and (not docstring_is_open)
+    original_lines = line_index.lines
+    keys_by_index = _get_keys_by_index(line_index)
+    # Each top-level function and class is a scope, the rest of the module is one more scope
+    scopes = []
+    module_level_ids = set(range(len(original_lines)))
+    for first_lineno, end_lineno in scope_spans:
+        node_ids = range(first_lineno - 1, end_lineno)
+        module_level_ids.difference_update(node_ids)
+        scopes.append(
+            ("\n".join(original_lines[first_lineno - 1 : end_lineno]), node_ids)
+        )
+    module_level_ids = sorted(module_level_ids)
+    scopes.append(
+        ("\n".join(original_lines[i] for i in module_level_ids), module_level_ids)
+    )
+
+    scopes_keys = {}
+    cached_comments = {}
+    for source, ids in scopes:
+        keys = [keys_by_index[i] for i in ids if i in keys_by_index]
+        if not keys:
+            continue
+        cache_key = make_cache_key(
+            source=source,
+            stage="comments",
+            model_checkpoint=model_checkpoint,
+            modify_existing_documentation=modify_existing_documentation,
+        )
+        scopes_keys[cache_key] = keys
+        if (comments := cache.get(cache_key)) is not None and len(comments) == len(
+            keys
         ):
-            # Add line number to the line
-            lined_line = f"{counter}. {line}"
-            # Add the line with line number to the list of valid code lines
-            valid_code_lines.append(lined_line)
-            # Update the original lines list with the line number
-            lines[i - 1] = lined_line
-            # Increment the line number counter
-            counter += 1
-        # Check if the line is a docstring
-        elif line_stripped in ['"""', "'''"]:
-            # Set the type of docstring if it's not already set
-            if docstring_type is None:
-                docstring_type = line_stripped
-            # Check if the current line matches the type of docstring that was opened
-            if docstring_type == line_stripped:
-                # Toggle the docstring_is_open flag
-                docstring_is_open = bool(1 - docstring_is_open)
-            # Handle nested docstrings
-            else:
-                # Then it is a docstring inside a docstring
-                pass
-    # Create a dictionary mapping line numbers to lines
-    lines_dict = {f"line{i}": line for i, line in enumerate(valid_code_lines, 1)}
-    return lines, lines_dict, valid_code_lines
+            cached_comments.update(zip(keys, comments))
+    return scopes_keys, dict(
+        sorted(cached_comments.items(), key=lambda x: _get_line_number(x[0]))
+    )
+
+
+def _get_keys_by_index(line_index: LineIndex) -> dict[int, str]:
+    # Only the code lines are numerated
+    return {i: f"line{n}" for n, i in enumerate(line_index.code_lines, 1)}
+
+
+def _cache_generated_comments(
+    scopes_keys: dict[str, list[str]],
+    generated_comments: dict[str, str],
+    cache: ResultsCache,
+) -> None:
+    # Only the scopes whose comments were all generated are stored
+    for cache_key, keys in scopes_keys.items():
+        if keys and all(key in generated_comments for key in keys):
+            cache.set(cache_key, [generated_comments[key] for key in keys])
+
+
+def _get_line_number(key: str) -> int:
+    return int(key[len("line") :])
 
 
 def _create_kwargs_for_pydantic_model(
-    lines: list[str], valid_lines: list[str]
+    line_index: LineIndex,
 ) -> dict[str, tuple[type, Any]]:
     """
-    Creates keyword arguments for a Pydantic model based on the lines of code and valid lines.
+    Creates keyword arguments for a Pydantic model based on the code lines.
 
     Args:
-        lines (`list[str]`):
-            The lines of code with line numbers.
-        valid_lines (`list[str]`):
-            The valid lines of code with line numbers.
+        line_index (`LineIndex`):
+            The index of the lines of the code.
 
     Returns:
         `dict[str, tuple[type, Any]]`:
             A dictionary of keyword arguments for the Pydantic model.
     """
-    # Join the lines back into a single string
-    lined_code = "\n".join(lines)
     # Initialize a dictionary to store keyword arguments for the Pydantic model
     model_kwargs = {}
-    # Split the lined code back into individual lines
-    code_lines = lined_code.splitlines()
-    # Initialize the index for the next line in the code
-    next_line_index_in_code = 0
-    # Iterate over each valid line with line numbers
-    for i, line in enumerate(valid_lines, 1):
-        # Find comments associated with the line
-        comment, next_line_index_in_code = _find_comments_for_line(
-            line, code_lines, next_line_index_in_code
-        )
+    # Iterate over each code line
+    for i, line_id in enumerate(line_index.code_lines, 1):
         # Create keyword arguments for the line
         # Changed from `Comment for the line n. X` to `Comment for line X`
         # to reduce the number of tokens in prompt (~ by 1000)
-        line = ". ".join(line.split(". ")[1:])
-        line = line.split("#")[0].rstrip()
+        line = line_index.code_without_comment(line_id)
         line_kwargs = {"description": f"Comment for line {i}: {line}"}
         # Check if there is a comment for the line
-        if comment:
+        if comment := _get_existing_comment(line_index, line_id):
             # Add the comment as a default value in the keyword arguments
             line_kwargs["default"] = comment
         # Add the keyword arguments to the model_kwargs dictionary
@@ -354,279 +859,91 @@ def _create_kwargs_for_pydantic_model(
     return model_kwargs
 
 
+def _get_existing_comment(line_index: LineIndex, line_id: int) -> str:
+    # The comment lines above are joined with the escaped line breaks, then the inline comment
+    comment = "".join(
+        line_index.comment_text(i) + "\\n"
+        for i in line_index.comment_lines_above[line_id]
+    )
+    if line_id in line_index.inline_comments:
+        comment += line_index.comment_text(line_id)
+    comment = comment.strip()
+    if comment.endswith("\\n"):
+        comment = comment[:-2]
+    return comment
+
+
 def _create_pydantic_model(
     code: str,
-) -> tuple[Any, dict[str, str], list[str], dict[str, tuple[type, Any]]]:
+) -> tuple[Any, LineIndex, dict[str, tuple[type, Any]]]:
     """
-    Creates a Pydantic model for the given code, along with additional information about the lines.
+    Creates a Pydantic model for the given code, along with the index of its lines.
 
     Args:
         code (`str`):
             The input code as a string.
 
     Returns:
-        `tuple[Any, dict[str, str], list[str], dict[str, tuple[type, Any]]]`:
-            A tuple containing the Pydantic model, a dictionary mapping line numbers to lines, the modified lines with line numbers, and the keyword arguments for the Pydantic model.
+        `tuple[Any, LineIndex, dict[str, tuple[type, Any]]]`:
+            A tuple containing the Pydantic model, the index of the lines of the code, and the keyword arguments for the Pydantic model.
     """
-    # Get the lined code and valid lines from the input code
-    lines, lines_dict, valid_lines = _get_lined_code_and_lines(code)
+    # Classify the lines of the code in one pass
+    line_index = LineIndex(code)
     # Create keyword arguments for the Pydantic model
-    model_kwargs = _create_kwargs_for_pydantic_model(lines, valid_lines)
+    model_kwargs = _create_kwargs_for_pydantic_model(line_index)
     return (
         # Create the Pydantic model with the keyword arguments
         create_model("CodeCommentsModel", **model_kwargs),
-        lines_dict,
-        lines,
+        line_index,
         model_kwargs,
     )
 
 
-def _find_comments_for_line(
-    line: str, splitlines: list[str], next_line_index_in_code: int = 0
-) -> tuple[str, int]:
-    """
-    Finds comments associated with a specific line of code.
-
-    Args:
-        line (`str`):
-            The line of code to find comments for.
-        splitlines (`list[str]`):
-            The lines of code split into a list.
-        next_line_index_in_code (`int`, *optional*):
-            The index to start searching for comments from. Defaults to 0.
-
-    Returns:
-        `tuple[str, int]`:
-            A tuple containing the comment text and the index of the line after the last comment.
-    """
-    # Initialize an empty string to store the comment
-    comment = ""
-    # Find the index of the line in the splitlines list
-    id_line_in_splitlines = splitlines.index(line, next_line_index_in_code)
-    # Check for comments above the string
-    for code_line in splitlines[next_line_index_in_code:id_line_in_splitlines]:
-        # Check if the line is a comment
-        if code_line.strip().startswith("#"):
-            # Add the comment to the comment string
-            comment += code_line[code_line.find("#") + 1 :].strip() + "\\n"
-    # Check if there is an inline comment in the line
-    if "#" in line and (comment_start_idx := _find_inline_comment(line)) is not None:
-        # Make sure it is a comment and not part of the string (e.g. prev. line `if "#" in line`)
-        comment += line[comment_start_idx + 1 :].strip()
-    # Strip whitespace from the comment
-    comment = comment.strip()
-    # Check if the comment ends with a newline character
-    if comment.endswith("\\n"):
-        # Remove the newline character from the comment
-        comment = comment[:-2]
-    return comment, id_line_in_splitlines + 1
-
-
-def _find_ids_comments_for_line(
-    line: str, splitlines: list[str], next_line_index_in_code: int = 0
-) -> tuple[list[int], bool, int]:
-    """
-    Finds the indices of lines that contain comments for a specific line of code.
-
-    Args:
-        line (`str`):
-            The line of code to find comments for.
-        splitlines (`list[str]`):
-            The lines of code split into a list.
-        next_line_index_in_code (`int`, *optional*):
-            The index to start searching for comments from. Defaults to 0.
-
-    Returns:
-        `tuple[list[int], bool, int]`:
-            A tuple containing the list of indices of comment lines, a boolean indicating if the line has an inline comment, and the index of the line in splitlines.
-    """
-    # Initialize a list to store the indices of comment lines
-    ids_comment_lines = []
-    # Find the index of the line in the splitlines list
-    id_line_in_splitlines = splitlines.index(line, next_line_index_in_code)
-    # Find previous valid line
-    id_prev_line = next_line_index_in_code
-    for i, prev_line in enumerate(
-        splitlines[next_line_index_in_code:id_line_in_splitlines][::-1], start=1
-    ):
-        if prev_line.split(". ")[0].isdigit() or prev_line.strip() == '"""':
-            id_prev_line = id_line_in_splitlines - i
-            break
-    # Check for comments above the string
-    for i, code_line in enumerate(splitlines[id_prev_line:id_line_in_splitlines]):
-        # Check if the line is a comment
-        if code_line.strip().startswith("#"):
-            # Add the index of the comment line to the list
-            ids_comment_lines.append(i + id_prev_line)
-    # Flag to check if the line has an inline comment
-    line_has_inline_comment = False
-    # Check if there is an inline comment in the line
-    if "#" in line and _find_inline_comment(line) is not None:
-        line_has_inline_comment = True
-    return ids_comment_lines, line_has_inline_comment, id_line_in_splitlines
-
-
 def _update_line_comment_in_code(
     new_value: str,
-    line: str,
     splitlines: list[str],
     id_line_in_splitlines: int,
     ids_comment_lines: list[int],
-    line_has_inline_comment: bool,
-) -> tuple[list[str], int]:
+    inline_comment_start: int | None,
+) -> int:
     """
-    Updates the comment for a specific line of code in the list of lines.
+    Updates the comment for a specific line of code in the list of lines in place.
 
     Args:
         new_value (`str`):
             The new comment text.
-        line (`str`):
-            The line of code to update the comment for.
         splitlines (`list[str]`):
             The lines of code split into a list.
         id_line_in_splitlines (`int`):
             The index of the line in splitlines.
         ids_comment_lines (`list[int]`):
-            The list of indices of comment lines.
-        line_has_inline_comment (`bool`):
-            A boolean indicating if the line has an inline comment.
+            The list of indices of comment lines above the line.
+        inline_comment_start (`int | None`):
+            The column of the inline comment of the line, if any.
 
     Returns:
-        `tuple[list[str], int]`:
-            A tuple containing the updated list of lines and the index of the line after the last comment.
+        `int`:
+            The number of the lines added, negative if more comment lines were removed.
     """
-    # Remove the line number from the line
-    line_without_number = ". ".join(line.split(". ")[1:])
+    line = splitlines[id_line_in_splitlines]
     # Check if the line starts with a space
-    if line_without_number.startswith(" "):
+    if line.startswith(" "):
         # Determine the indentation of the line
-        indent = " " * (len(line_without_number) - len(line_without_number.lstrip()))
+        indent = " " * (len(line) - len(line.lstrip()))
     # Check if the line starts with a tab
-    elif line_without_number.startswith("\t"):
+    elif line.startswith("\t"):
         # Determine the indentation of the line
-        indent = "\t" * (len(line_without_number) - len(line_without_number.lstrip()))
+        indent = "\t" * (len(line) - len(line.lstrip()))
     # Handle lines with no indentation
     else:
         indent = ""
     # Add the new comment to the line with the appropriate indentation
-    if new_value:
-        new_value = [indent + "# " + x for x in new_value.split("\n")]
-    # Check if there are multiple comment lines
-    if len(ids_comment_lines) > 1:
-        # Iterate over the comment lines
-        for subline in splitlines[ids_comment_lines[0] : ids_comment_lines[-1]]:
-            # Strip whitespace from the line
-            stripped_line = subline.strip()
-            # Assert that the line is either empty or a comment and does not start with a digit
-            assert (not len(stripped_line) or stripped_line.startswith("#")) and not (
-                subline and subline[0].isdigit()
-            )
-    # Check if there are any comment lines
-    if ids_comment_lines:
-        # Assert that the last comment line is before the current line
-        assert ids_comment_lines[-1] < id_line_in_splitlines
+    new_lines = [indent + "# " + x for x in new_value.split("\n")] if new_value else []
     # Check if the line has an inline comment
-    if line_has_inline_comment:
-        # Find the starting index of the inline comment
-        comment_start_idx = _find_inline_comment(line)
+    if inline_comment_start is not None:
         # Remove the inline comment from the line
-        splitlines[id_line_in_splitlines] = line[:comment_start_idx].rstrip()
-    # Check if there are any comment lines
-    if ids_comment_lines:
-        # Get the code before the comment lines
-        previous_code = splitlines[: ids_comment_lines[0]]
-    # Handle lines with no comment lines
-    else:
-        # Get the code before the current line
-        previous_code = splitlines[:id_line_in_splitlines]
-    # Create the new splitlines list with the updated comment
-    if new_value:
-        new_splitlines = previous_code + new_value + splitlines[id_line_in_splitlines:]
-    else:
-        new_splitlines = previous_code + splitlines[id_line_in_splitlines:]
-    return new_splitlines, len(previous_code) + len(new_value)
-
-
-def _restore_code_from_numerated_lines(splitlines: list[str]) -> str:
-    """
-    Restores the original code from the numerated lines.
-
-    Args:
-        splitlines (`list[str]`):
-            The lines of code split into a list with line numbers.
-
-    Returns:
-        `str`:
-            The original code as a string.
-    """
-    # Initialize a list to store the original lines
-    original_lines = []
-    # Iterate over each line in the splitlines list
-    for line in splitlines:
-        # Split the line into two parts at the first '. '
-        splitted_line = line.split(". ", 1)
-        # Check if the line has a line number
-        if len(splitted_line) > 1 and splitted_line[0].isdigit():
-            # Remove the line number from the line
-            original_lines.append(". ".join(splitted_line[1:]))
-        # Handle lines with no line number
-        else:
-            original_lines.append(line)
-    return "\n".join(original_lines)
-
-
-def _find_inline_comment(line: str) -> int | None:
-    """
-    Finds the starting index of an inline comment if it exists.
-
-    Args:
-        line (`str`):
-            The line of code to check.
-
-    Returns:
-        `int | None`:
-            Index where the comment starts, or None if no comment exists.
-    """
-    # Flag to check if inside a single quote
-    in_single_quote = False
-    # Flag to check if inside a double quote
-    in_double_quote = False
-    # Flag to check if the previous character was an escape character
-    escaped = False
-
-    # Iterate over each character in the line with its index
-    for i, char in enumerate(line):
-        # Handle escape sequences
-        if char == "\\":
-            # Toggle the escaped flag
-            escaped = not escaped
-            continue
-
-        # Check if the current character is an escape character
-        if escaped:
-            # Toggle the escaped flag
-            escaped = False
-            continue
-
-        # Handle quotes
-        if char == '"' and not in_single_quote:
-            # Toggle the double quote flag
-            in_double_quote = not in_double_quote
-        # Check if the current character is a single quote
-        elif char == "'" and not in_double_quote:
-            # Toggle the single quote flag
-            in_single_quote = not in_single_quote
-        # Check for comment symbol outside of quotes
-        elif char == "#" and not in_single_quote and not in_double_quote:
-            # Make sure it's not part of a string that starts later
-            rest_of_line = line[i + 1 :]
-            # Check if the current character is a comment symbol and not inside quotes
-            if not (
-                rest_of_line.strip().startswith("'")
-                or
-                # Check if the rest of the line does not start with a single or double quote
-                rest_of_line.strip().startswith('"')
-            ):
-                return i
-
-    return None
+        splitlines[id_line_in_splitlines] = line[:inline_comment_start].rstrip()
+    # The comment lines above and the blank lines between them are replaced
+    start = ids_comment_lines[0] if ids_comment_lines else id_line_in_splitlines
+    splitlines[start:id_line_in_splitlines] = new_lines
+    return len(new_lines) - (id_line_in_splitlines - start)
@@ -1,11 +1,16 @@
+from __future__ import annotations
+
 import ast
-from typing import Union, Literal
+import asyncio
+import io
+import tokenize
+from typing import TYPE_CHECKING, Union, Literal
 from pydantic import create_model, Field, BaseModel
 import warnings
-import numpy as np
-from transformers import PreTrainedTokenizer
 
-from openai import Client
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizer
+    from openai import AsyncClient, Client
 
 from ..utils.prompts import (
     MESSAGES_DOCSTRING,
@@ -13,10 +18,14 @@ from ..utils.prompts import (
     USER_PROMPT,
 )
 from ..utils.utils import (
-    get_valid_json_if_possible,
     get_model_checkpoint_and_params,
     extract_llm_response_data,
+    get_anthropic_client,
 )
+from ..utils.streaming_json import JSONEvent, StreamingJSONParser
+from ..utils.cache import ResultsCache, get_node_source, make_cache_key
+from ..utils.edit_buffer import EditBuffer
+from ..utils.concurrency import LLM_REQUEST_LIMITER
 from ..utils.constants import DEFAULT_TOP_P_DOCSTRINGS, DEFAULT_MODEL_CHECKPOINT
 
 
@@ -30,7 +39,109 @@ def write_docstrings(
     modify_existing_documentation: bool = False,
     model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
     use_streaming: bool = True,
+    cache: ResultsCache | None = None,
+):
+    prepared = _prepare_docstrings(
+        target_nodes_dict=target_nodes_dict,
+        code=code,
+        tokenizer=tokenizer,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+    )
+    if prepared is None:
+        return code
+    target_nodes_dict, mutable_vars, cache_keys, request_kwargs = prepared
+    # The edits are independent of each other, so the cached docstrings go first
+    yield from _apply_cached_docstrings(
+        target_nodes_dict=target_nodes_dict, mutable_vars=mutable_vars
+    )
+
+    response_data = {}
+    if request_kwargs is not None:
+        # Choose between streaming and non-streaming based on user preference
+        if use_streaming:
+            generation_function = _process_streaming_docstrings
+        else:
+            generation_function = _process_non_streaming_docstrings
+        response_data = yield from generation_function(
+            client=client,
+            **request_kwargs,
+            target_nodes_dict=target_nodes_dict,
+            mutable_vars=mutable_vars,
+            cache=cache,
+            cache_keys=cache_keys,
+        )
+    yield mutable_vars["buffer"].code, response_data
+
+
+async def awrite_docstrings(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    client: AsyncClient,
+    tokenizer: PreTrainedTokenizer,
+    modify_existing_documentation: bool = False,
+    model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
+    cache: ResultsCache | None = None,
 ):
+    """Async version of `write_docstrings`. Only the streaming mode is supported."""
+    # Tokenization of the prompt is CPU-bound
+    prepared = await asyncio.to_thread(
+        _prepare_docstrings,
+        target_nodes_dict=target_nodes_dict,
+        code=code,
+        tokenizer=tokenizer,
+        modify_existing_documentation=modify_existing_documentation,
+        model_checkpoint=model_checkpoint,
+        cache=cache,
+    )
+    if prepared is None:
+        return
+    target_nodes_dict, mutable_vars, cache_keys, request_kwargs = prepared
+    # The edits are independent of each other, so the cached docstrings go first
+    for output in _apply_cached_docstrings(
+        target_nodes_dict=target_nodes_dict, mutable_vars=mutable_vars
+    ):
+        yield output
+
+    response_data = {}
+    if request_kwargs is not None:
+        async for output in _aprocess_streaming_docstrings(
+            client=client,
+            **request_kwargs,
+            target_nodes_dict=target_nodes_dict,
+            mutable_vars=mutable_vars,
+            cache=cache,
+            cache_keys=cache_keys,
+        ):
+            if isinstance(output, str):
+                yield output
+            else:
+                response_data = output
+    yield mutable_vars["buffer"].code, response_data
+
+
+def _prepare_docstrings(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    tokenizer: PreTrainedTokenizer,
+    modify_existing_documentation: bool,
+    model_checkpoint: str,
+    cache: ResultsCache | None,
+) -> tuple[dict, dict, dict[str, str], dict | None] | None:
+    """
+    Selects the nodes to document and creates the request for those missing in the cache.
+
+    Returns:
+        `tuple[dict, dict, dict[str, str], dict | None] | None`:
+            The nodes to document, the state shared by the edits, the cache keys of the nodes
+            and the kwargs of the LLM request (None if all the docstrings are cached).
+            None if there is nothing to document.
+    """
     if not modify_existing_documentation:
         existing_docstrings = [
             _extract_docstring(node)
@@ -42,9 +153,31 @@ def write_docstrings(
             if docstring is None
         }
         if len(target_nodes_dict) == 0:
-            return code
+            return
+
+    # Nodes that have not changed since they were documented last time are taken from the cache
+    cache_keys, cached_docstrings = _get_cached_docstrings(
+        target_nodes_dict=target_nodes_dict,
+        code=code,
+        cache=cache,
+        model_checkpoint=model_checkpoint,
+        modify_existing_documentation=modify_existing_documentation,
+    )
+    mutable_vars = {
+        # The edits are made in the coordinates of `code`, which the nodes were parsed from
+        "buffer": EditBuffer(code),
+        "cached_docstrings": cached_docstrings,
+    }
+    pydantic_model = _create_pydantic_model(
+        {
+            node_name: (node, node_type)
+            for node_name, (node, node_type) in target_nodes_dict.items()
+            if _get_key_by_node_name(node_name, node_type) not in cached_docstrings
+        }
+    )
+    if len(pydantic_model.model_fields) == 0:
+        return target_nodes_dict, mutable_vars, cache_keys, None
 
-    pydantic_model = _create_pydantic_model(target_nodes_dict)
     user_prompt = str(USER_PROMPT).format(
         code=code, json_schema=pydantic_model.model_json_schema()
     )
@@ -57,28 +190,13 @@ def write_docstrings(
     )
     messages = _create_messages(use_extended_prompt)
     messages += [{"role": "user", "content": user_prompt}]
-
-    # Choose between streaming and non-streaming based on user preference
-    if use_streaming:
-        yield from _process_streaming_docstrings(
-            client=client,
-            model_checkpoint=model_checkpoint,
-            messages=messages,
-            max_tokens=max_tokens,
-            pydantic_model=pydantic_model,
-            code=code,
-            target_nodes_dict=target_nodes_dict,
-        )
-    else:
-        yield from _process_non_streaming_docstrings(
-            client=client,
-            model_checkpoint=model_checkpoint,
-            messages=messages,
-            max_tokens=max_tokens,
-            pydantic_model=pydantic_model,
-            code=code,
-            target_nodes_dict=target_nodes_dict,
-        )
+    request_kwargs = {
+        "model_checkpoint": model_checkpoint,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "pydantic_model": pydantic_model,
+    }
+    return target_nodes_dict, mutable_vars, cache_keys, request_kwargs
 
 
 def _process_streaming_docstrings(
@@ -87,11 +205,13 @@ def _process_streaming_docstrings(
     messages: list,
     max_tokens: int,
     pydantic_model: BaseModel,
-    code: str,
     target_nodes_dict: dict,
+    mutable_vars: dict,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
 ):
     """Process the docstrings completion request using streaming."""
-    with client.beta.chat.completions.stream(
+    with LLM_REQUEST_LIMITER, client.beta.chat.completions.stream(
         model=model_checkpoint,
         messages=messages,
         top_p=DEFAULT_TOP_P_DOCSTRINGS,
@@ -100,56 +220,91 @@ def _process_streaming_docstrings(
         response_format=pydantic_model,
         stream_options={"include_usage": True},
     ) as stream:
-        output = ""
-        output_length = 0
-        boundary = 1
+        parser = StreamingJSONParser()
         finished_keys = set()
-        lines_shift = 0
         for i, chunk in enumerate(stream):
-            if hasattr(chunk, "delta"):
-                output += chunk.delta
-                output_length += len(chunk.delta)
-            # Check that a new key has been processed
-            for end_pos in range(output_length, boundary, -1):
-                if valid_dict := get_valid_json_if_possible(output[:end_pos] + "}"):
-                    for key, value in valid_dict.items():
-                        if not key in finished_keys and value:
-                            # The outputted keys will be function_{func_name} or class_{class_name}
-                            # We need to remove the prefix when querying the key
-                            func = _get_function_by_key(key, target_nodes_dict)
-                            # Replace the generated \t / \n symbols and add tabulation to all lines
-                            value = (
-                                value.replace("\\\\n", "\n")
-                                .replace("\\\\t", "\t")
-                                .replace("\\n", "\n")
-                                .replace("\\t", "\t")
-                            )
-                            num_tabs_to_use = (
-                                code.splitlines()[func.lineno + lines_shift - 1]
-                                .replace(" " * 4, "\t")
-                                .count("\t")
-                                + 1
-                            )
-                            joiner = "\n" + "\t" * num_tabs_to_use
-                            value = "".join(joiner + x for x in value.split("\n"))
-                            old_code = code
-                            # Insert docstring to the code
-                            code = _update_code_with_node_docstring(
-                                generated_docstring=value,
-                                function=func,
-                                code=code,
-                                lines_shift=lines_shift,
-                                num_tabs_to_use=num_tabs_to_use,
-                            )
-                            yield code
-                            # Need to adjust since we are adding new lines to parsed code
-                            lines_shift += len(code.splitlines()) - len(
-                                old_code.splitlines()
-                            )
-                            finished_keys.add(key)
-            boundary = output_length
-        response_data = extract_llm_response_data(chunk)
-        yield code, response_data
+            if not hasattr(chunk, "delta"):
+                continue
+            yield from _handle_streamed_docstrings(
+                events=parser.feed(chunk.delta),
+                finished_keys=finished_keys,
+                target_nodes_dict=target_nodes_dict,
+                mutable_vars=mutable_vars,
+                cache=cache,
+                cache_keys=cache_keys,
+            )
+        return extract_llm_response_data(chunk)
+
+
+async def _aprocess_streaming_docstrings(
+    client: AsyncClient,
+    model_checkpoint: str,
+    messages: list,
+    max_tokens: int,
+    pydantic_model: BaseModel,
+    target_nodes_dict: dict,
+    mutable_vars: dict,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
+):
+    """
+    Async version of `_process_streaming_docstrings`. Yields the code snapshots and then
+    the response data, since async generators cannot return a value.
+    """
+    async with client.beta.chat.completions.stream(
+        model=model_checkpoint,
+        messages=messages,
+        top_p=DEFAULT_TOP_P_DOCSTRINGS,
+        temperature=0.7,
+        max_tokens=max_tokens,
+        response_format=pydantic_model,
+        stream_options={"include_usage": True},
+    ) as stream:
+        parser = StreamingJSONParser()
+        finished_keys = set()
+        async for chunk in stream:
+            if not hasattr(chunk, "delta"):
+                continue
+            for output in _handle_streamed_docstrings(
+                events=parser.feed(chunk.delta),
+                finished_keys=finished_keys,
+                target_nodes_dict=target_nodes_dict,
+                mutable_vars=mutable_vars,
+                cache=cache,
+                cache_keys=cache_keys,
+            ):
+                yield output
+        yield extract_llm_response_data(chunk)
+
+
+def _handle_streamed_docstrings(
+    events: list[JSONEvent],
+    finished_keys: set[str],
+    target_nodes_dict: dict,
+    mutable_vars: dict,
+    cache: ResultsCache | None,
+    cache_keys: dict[str, str] | None,
+):
+    """Inserts the docstrings completed by the streamed events and yields the new code."""
+    for event in events:
+        # Only the top-level keys hold the docstrings
+        if len(event.path) != 1:
+            continue
+        (key,), value = event
+        if key in finished_keys:
+            continue
+        if cache is not None and key in cache_keys:
+            cache.set(cache_keys[key], value)
+        if not value:
+            continue
+        # Insert docstring to the code
+        yield _apply_docstring(
+            key=key,
+            value=value,
+            target_nodes_dict=target_nodes_dict,
+            mutable_vars=mutable_vars,
+        )
+        finished_keys.add(key)
 
 
 def _process_non_streaming_docstrings(
@@ -158,77 +313,46 @@ def _process_non_streaming_docstrings(
     messages: list,
     max_tokens: int,
     pydantic_model: BaseModel,
-    code: str,
     target_nodes_dict: dict,
+    mutable_vars: dict,
+    cache: ResultsCache | None = None,
+    cache_keys: dict[str, str] | None = None,
 ):
     """
     Process the docstrings completion request without streaming.
     NB! Currently only supported for Anthropic with Instructor syntax
     """
     # Work-around for Anthropic models
-    import instructor
-    from anthropic import Anthropic
-    import os
-
-    api_key = os.getenv("ANTHROPIC_API_KEY", client.api_key)
-    client_anthropic = instructor.from_anthropic(client=Anthropic(api_key=api_key))
-    response = client_anthropic.messages.create(
-        model=model_checkpoint,
-        messages=messages,
-        top_p=DEFAULT_TOP_P_DOCSTRINGS,
-        max_tokens=max_tokens,
-        response_model=pydantic_model,
-    )
+    client_anthropic = get_anthropic_client(client)
+    with LLM_REQUEST_LIMITER:
+        response = client_anthropic.messages.create(
+            model=model_checkpoint,
+            messages=messages,
+            top_p=DEFAULT_TOP_P_DOCSTRINGS,
+            max_tokens=max_tokens,
+            response_model=pydantic_model,
+        )
     docstrings_data = response.dict()
 
     if not docstrings_data:
         # If we couldn't parse the JSON, yield the original code
-        yield code
-        return
-
-    lines_shift = 0
+        yield mutable_vars["buffer"].code
+        return {}
 
     # Process all docstrings at once
     for key, value in docstrings_data.items():
+        if cache is not None and key in cache_keys:
+            cache.set(cache_keys[key], value)
         if not value:
             continue
-
-        # Get the function or class to add the docstring to
-        func = _get_function_by_key(key, target_nodes_dict)
-
-        # Format the docstring with proper line breaks and tabs
-        value = (
-            value.replace("\\\\n", "\n")
-            .replace("\\\\t", "\t")
-            .replace("\\n", "\n")
-            .replace("\\t", "\t")
-        )
-
-        num_tabs_to_use = (
-            code.splitlines()[func.lineno + lines_shift - 1]
-            .replace(" " * 4, "\t")
-            .count("\t")
-            + 1
-        )
-
-        joiner = "\n" + "\t" * num_tabs_to_use
-        value = "".join(joiner + x for x in value.split("\n"))
-
-        # Store the old code to calculate the line difference
-        old_code = code
-
         # Update the code with the new docstring
-        code = _update_code_with_node_docstring(
-            generated_docstring=value,
-            function=func,
-            code=code,
-            lines_shift=lines_shift,
-            num_tabs_to_use=num_tabs_to_use,
+        _apply_docstring(
+            key=key,
+            value=value,
+            target_nodes_dict=target_nodes_dict,
+            mutable_vars=mutable_vars,
         )
 
-        # Update the line shift for the next docstring
-        lines_shift += len(code.splitlines()) - len(old_code.splitlines())
-
     # Create response data from the usage info
     response_data = {"model": model_checkpoint, "output": response.model_dump_json()}
 
@@ -236,95 +360,156 @@ def _process_non_streaming_docstrings(
     import time
 
     time.sleep(60)
-    # Yield the final code with all docstrings added
-    yield code, response_data
+    return response_data
+
+
+def _apply_docstring(
+    key: str,
+    value: str,
+    target_nodes_dict: dict,
+    mutable_vars: dict,
+) -> str:
+    """Inserts the generated docstring into `mutable_vars["buffer"]` and returns the new code."""
+    buffer = mutable_vars["buffer"]
+    # The outputted keys will be function_{func_name} or class_{class_name}
+    # We need to remove the prefix when querying the key
+    func = _get_function_by_key(key, target_nodes_dict)
+    # Replace the generated \t / \n symbols and add tabulation to all lines
+    value = (
+        value.replace("\\\\n", "\n")
+        .replace("\\\\t", "\t")
+        .replace("\\n", "\n")
+        .replace("\\t", "\t")
+    )
+    indent = _get_docstring_indent(func, buffer)
+    joiner = "\n" + indent
+    value = "".join(joiner + x for x in value.split("\n"))
+    _update_code_with_node_docstring(
+        generated_docstring=value,
+        function=func,
+        buffer=buffer,
+        indent=indent,
+    )
+    return buffer.code
+
+
+def _apply_cached_docstrings(target_nodes_dict: dict, mutable_vars: dict):
+    """Applies the cached docstrings, yielding the code after each of them."""
+    cached_docstrings = mutable_vars["cached_docstrings"]
+    for key in list(cached_docstrings):
+        if value := cached_docstrings.pop(key):
+            yield _apply_docstring(
+                key=key,
+                value=value,
+                target_nodes_dict=target_nodes_dict,
+                mutable_vars=mutable_vars,
+            )
+
+
+def _get_cached_docstrings(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    cache: ResultsCache | None,
+    model_checkpoint: str,
+    modify_existing_documentation: bool,
+) -> tuple[dict[str, str], dict[str, str]]:
+    cache_keys = {}
+    cached_docstrings = {}
+    lines = code.splitlines()
+    for node_name, (node, node_type) in target_nodes_dict.items():
+        key = _get_key_by_node_name(node_name, node_type)
+        # `__init__` methods are not documented
+        if key is None:
+            continue
+        cache_keys[key] = make_cache_key(
+            source=get_node_source(lines, node),
+            stage="docstrings",
+            model_checkpoint=model_checkpoint,
+            modify_existing_documentation=modify_existing_documentation,
+        )
+        if cache is not None and (docstring := cache.get(cache_keys[key])) is not None:
+            cached_docstrings[key] = docstring
+    return cache_keys, cached_docstrings
 
 
 def _update_code_with_node_docstring(
     generated_docstring: str,
     function: ast.FunctionDef | ast.AsyncFunctionDef,
-    code: str,
-    lines_shift: int = 0,
-    num_tabs_to_use: int = 1,
-) -> str:
-    positions = _get_docstring_position(function, code, lines_shift)
-    tab = "\t" * num_tabs_to_use
-    docstring_to_add = f'\n{tab}"""' + generated_docstring + f'\n{tab}"""\n'
-    ending = code[positions[1] :]
-    if ending.startswith("\n"):
-        ending = ending[1:]
-    # For one-line functions, need to add a tabulation
+    buffer: EditBuffer,
+    indent: str = "\t",
+) -> None:
+    start, end = _get_docstring_position(function, buffer)
+    code = buffer.original
+    docstring_to_add = f'\n{indent}"""' + generated_docstring + f'\n{indent}"""\n'
+    # The whitespace before the docstring and the line break after it are replaced
+    while start > 0 and code[start - 1].isspace():
+        start -= 1
+    if code.startswith("\n", end):
+        end += 1
+    # For one-line functions, the body is moved below the docstring
     if function.lineno == function.end_lineno:
-        function_def_line = code.splitlines()[function.lineno - 1 + lines_shift]
-        if function_def_line.startswith(" "):
-            tab = (len(function_def_line) - len(function_def_line.lstrip()) + 4) * " "
-        elif function_def_line.startswith("\t"):
-            tab = (len(function_def_line) - len(function_def_line.lstrip()) + 1) * "\t"
-        else:
-            tab = "\t"
-        ending = tab + ending.lstrip()
-    return code[: positions[0]].strip() + docstring_to_add + ending
+        while end < len(code) and code[end].isspace():
+            end += 1
+        docstring_to_add += indent
+    buffer.replace(start, end, docstring_to_add)
+
+
+def _get_docstring_indent(
+    function: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
+    buffer: EditBuffer,
+) -> str:
+    # The docstring is indented as the body, so the code stays valid before the indentation
+    # of the whole module is aligned
+    first_statement = function.body[0]
+    if first_statement.lineno > function.lineno:
+        body_line = buffer.line(first_statement.lineno)
+        body_indent = body_line[: len(body_line) - len(body_line.lstrip())]
+        if len(body_indent) == first_statement.col_offset:
+            return body_indent
+    # The body starts on the line of the signature
+    function_def_line = buffer.line(function.lineno)
+    def_indent = function_def_line[
+        : len(function_def_line) - len(function_def_line.lstrip())
+    ]
+    if def_indent.startswith(" "):
+        return def_indent + " " * 4
+    return def_indent + "\t"
 
 
 def get_docstring_position_for_node_with_no_docstring(
     node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
-    code: str,
-    prev_arg_lineno: int = 0,
-    shift_inside_line: int = 0,
-    lines_shift: int = 0,
+    buffer: EditBuffer,
 ) -> int:
-    line_start_function_core_id = node.body[0].lineno - 1 + lines_shift
-    border = node.body[0].col_offset
-    if prev_arg_lineno == line_start_function_core_id + 1:
-        border += shift_inside_line
-        # Case 1: single-line function
-        if node.body[0].lineno == node.lineno:
-            if (lineno := node.lineno) != 0:
-                splitlines = code.splitlines()
-                len_previous_code = len("\n".join(splitlines[: lineno - 1]))
-                border += len_previous_code
-            return code[:border].rindex(":") + 1
-    # Case 2: multi-line function
-    lines = code.splitlines()
-    # Lines that pertain to the given node
-    lines_cum_length = np.cumsum(
-        [len(line) + 1 for line in lines[:line_start_function_core_id]]
-    )
-    if len(lines_cum_length) >= 1:
-        # We take not from the last line because it already points at the function core line
-        for i, line in enumerate(
-            lines[:line_start_function_core_id][::-1][: len(lines_cum_length)]
-        ):
-            if not line.strip().startswith("#"):
-                break
-        border += lines_cum_length[-1 - i]
-    index_is_found = False
-    while not index_is_found:
-        candidate_index = code[:border].rindex(":")
-        rev_line_id_candidate = 0
-        # Find the line to which this colon (`:`) pertains
-        for rev_line_id_candidate, cumsum in enumerate(lines_cum_length[::-1]):
-            if cumsum < candidate_index:
-                break
-        line_id_candidate = line_start_function_core_id - rev_line_id_candidate
-        line = lines[line_id_candidate]
-        # Make sure this bracket is not inside a comment
-        if "#" in line:
-            index_of_comment_start = line.find("#")
-            if rev_line_id_candidate != 0:
-                index_of_comment_start += lines_cum_length[::-1][rev_line_id_candidate]
-            if index_of_comment_start < candidate_index:
-                border = index_of_comment_start
-                continue
-        candidate_index += 1
-        index_is_found = True
-    return candidate_index
+    """
+    Returns the original offset right after the colon that ends the header of the node.
+    The header is tokenized, so the colons inside brackets, strings or comments are skipped.
+    """
+    header_start = buffer.offset(node.lineno, 0)
+    body_start = buffer.offset(node.body[0].lineno, node.body[0].col_offset)
+    # Only the code before the body is tokenized, since a multi-line string at the start of
+    # the body would not be complete
+    header = buffer.original[header_start:body_start] + "\n"
+    line_starts = [0]
+    for line in header.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+    colon_end = None
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(header).readline):
+            if token.type == tokenize.OP and token.string == ":":
+                # Tokenize columns are in characters, unlike the ones of the AST
+                lineno, col_offset = token.start
+                colon_end = header_start + line_starts[lineno - 1] + col_offset + 1
+    except tokenize.TokenError:
+        # e.g. a line continuation right before the body, the colon is already found
+        pass
+    return colon_end
 
 
 def _get_docstring_position(
     node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
-    code: str,
-    lines_shift: int,
+    buffer: EditBuffer,
 ) -> Union[tuple[int, int], None]:
     if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
         return
@@ -336,40 +521,12 @@ def _get_docstring_position(
         and isinstance(node.body[0].value, (ast.Str, ast.Constant))
     ):
         doc_node = node.body[0]
-        lines = code.splitlines()
-
-        # Get start position
-        start = sum(
-            len(line) + 1 for line in lines[: doc_node.lineno - 1 + lines_shift]
-        )
-        start += doc_node.col_offset
-
-        # Find the actual end by looking at the source
-        if doc_node.lineno == doc_node.end_lineno:
-            # Single line docstring
-            line = lines[doc_node.lineno - 1 + lines_shift]
-            # Find the closing quote
-            quote_type = line[doc_node.col_offset : doc_node.col_offset + 3]
-            if quote_type in ('"""', "'''"):
-                end = line.find(quote_type, doc_node.col_offset + 3) + 3
-            else:
-                quote_type = line[doc_node.col_offset]
-                end = line.find(quote_type, doc_node.col_offset + 1) + 1
-            end = start + (end - doc_node.col_offset)
-        else:
-            # Multi-line docstring
-            last_line = lines[doc_node.end_lineno - 1 + lines_shift].rstrip()
-            end = sum(
-                len(line) + 1 for line in lines[: doc_node.end_lineno - 1 + lines_shift]
-            )
-            end += len(last_line)
-
+        start = buffer.offset(doc_node.lineno, doc_node.col_offset)
+        end = buffer.offset(doc_node.end_lineno, doc_node.end_col_offset)
         return start, end
 
     # If no docstring, return position where it should be
-    pos = get_docstring_position_for_node_with_no_docstring(
-        node=node, code=code, lines_shift=lines_shift
-    )
+    pos = get_docstring_position_for_node_with_no_docstring(node=node, buffer=buffer)
     return pos, pos
 
 
@@ -459,3 +616,16 @@ def _get_function_by_key(
     else:
         raise ValueError("Unexpected key:", key)
     return target_nodes_dict[key][0]
+
+
+def _get_key_by_node_name(node_name: str, node_type: str) -> str | None:
+    """Inverse of `_get_function_by_key`: returns the key of the node in the pydantic model."""
+    if node_type == "class":
+        return "class_" + node_name
+    elif node_type == "method":
+        class_name, method_name = node_name.split("-")
+        # The `__init__` methods are not documented
+        if method_name == "__init__":
+            return
+        return f"class_{class_name}_method_{method_name}"
+    return "function_" + node_name
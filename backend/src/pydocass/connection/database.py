@@ -1,5 +1,6 @@
 import os
 from contextlib import contextmanager
+from functools import lru_cache
 import json
 import logging
 from sqlalchemy import (
@@ -15,20 +16,24 @@ from sqlalchemy import (
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-db_connection = str(os.getenv("DB_CONNECTION", None))
-if db_connection is not None and db_connection != "None":
-    engine = create_engine(db_connection, pool_pre_ping=True, pool_recycle=3600)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-else:
-    SessionLocal = None
-
 Base = declarative_base()
 
 log = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_session_factory() -> sessionmaker | None:
+    # The engine is created on the first use rather than on import
+    db_connection = str(os.getenv("DB_CONNECTION", None))
+    if db_connection is not None and db_connection != "None":
+        engine = create_engine(db_connection, pool_pre_ping=True, pool_recycle=3600)
+        return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return None
+
+
 @contextmanager
 def get_db():
+    SessionLocal = get_session_factory()
     if SessionLocal is None:
         log.error("Database connection not configured")
         yield
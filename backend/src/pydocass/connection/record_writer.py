@@ -0,0 +1,303 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any
+
+from ..utils.constants import (
+    RECORD_WRITER_BATCH_SIZE,
+    RECORD_WRITER_FLUSH_INTERVAL_SECONDS,
+    RECORD_WRITER_MAX_QUEUE_SIZE,
+    RECORD_WRITER_MAX_SPILLED_PER_BATCH,
+)
+
+log = logging.getLogger(__name__)
+
+
+class RecordWriter:
+    """
+    Writes the records to the database from a background thread, so that the requests never
+    wait for the database. The records are collected in a bounded queue and inserted in
+    batches (one bulk insert per table) when `batch_size` records are collected or
+    `flush_interval` seconds have passed.
+
+    If the database is unavailable or the queue is full, the records are appended to the
+    `spill_path` file as JSON lines and inserted with the next batches, at most
+    `max_spilled_per_batch` of them at a time. If a batch fails for another reason, its
+    records are inserted one by one and the ones that still fail are moved to the
+    `dead_letter_path` file, so that they do not block the others.
+    """
+
+    def __init__(
+        self,
+        spill_path: str | None = None,
+        batch_size: int = RECORD_WRITER_BATCH_SIZE,
+        flush_interval: float = RECORD_WRITER_FLUSH_INTERVAL_SECONDS,
+        max_queue_size: int = RECORD_WRITER_MAX_QUEUE_SIZE,
+        max_spilled_per_batch: int = RECORD_WRITER_MAX_SPILLED_PER_BATCH,
+        dead_letter_path: str | None = None,
+    ):
+        self.spill_path = spill_path or os.path.join(
+            os.path.expanduser("~"), ".pydocass", "unsaved_records.jsonl"
+        )
+        self.dead_letter_path = (
+            dead_letter_path or os.path.splitext(self.spill_path)[0] + ".failed.jsonl"
+        )
+        self.batch_size = batch_size
+        self.max_spilled_per_batch = max_spilled_per_batch
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._spill_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        self.written = 0
+        self.spilled = 0
+        self.dead_lettered = 0
+        self.batches = 0
+
+    def submit(self, table: str, **kwargs) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((table, kwargs))
+        except queue.Full:
+            log.warning(
+                "The record queue is full, saving the record to %s", self.spill_path
+            )
+            self._spill([(table, kwargs)])
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Waits until all the queued records are processed. Returns `False` on timeout."""
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # `Queue.join` has no timeout, so the unfinished tasks are polled
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_size": self._queue.maxsize,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dead_lettered": self.dead_lettered,
+            "batches": self.batches,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="pydocass-record-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush, self.flush_interval * 2)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                log.error("Error submitting records (non-critical): %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: list[tuple[str, dict[str, Any]]]) -> None:
+        # SQLAlchemy is imported here, in the writer thread, to keep it off the import path
+        from sqlalchemy.exc import OperationalError
+
+        # The records that could not be written before are retried first. They stay in the
+        # spill file until they are committed
+        spilled_records, spilled_size = self._read_spilled(self.max_spilled_per_batch)
+        records = spilled_records + batch
+        try:
+            with _get_db() as db:
+                if db is None:
+                    log.error("Database connection not configured")
+                    return
+                try:
+                    _insert(db, records)
+                    written = len(records)
+                except OperationalError:
+                    raise
+                except Exception as e:
+                    log.error(
+                        "Error writing the records, retrying them one by one: %s", e
+                    )
+                    written = self._write_one_by_one(db, records, spilled_size)
+                    if written is None:
+                        return
+        except OperationalError as e:
+            log.error(
+                "Database unavailable, saving the records to %s: %s",
+                self.spill_path,
+                e,
+            )
+            # The spilled records are still in the file, only the new ones are added
+            self._spill(batch)
+            return
+        except Exception as e:
+            log.error(
+                "Error connecting to the database, saving the records to %s: %s",
+                self.spill_path,
+                e,
+            )
+            self._spill(batch)
+            return
+        self._drop_spilled(spilled_size)
+        self.written += written
+        self.batches += 1
+
+    def _write_one_by_one(
+        self, db, records: list[tuple[str, dict[str, Any]]], spilled_size: int
+    ) -> int | None:
+        """
+        Inserts the records one by one and moves the ones that fail to the dead-letter file.
+
+        Returns:
+            `int | None`:
+                The number of written records, or None if the database became unavailable,
+                in which case the records that are left are spilled.
+        """
+        from sqlalchemy.exc import OperationalError
+
+        written = 0
+        for i, record in enumerate(records):
+            try:
+                _insert(db, [record])
+            except OperationalError as e:
+                log.error(
+                    "Database unavailable, saving the records to %s: %s",
+                    self.spill_path,
+                    e,
+                )
+                # The records handled so far must not be retried
+                self._drop_spilled(spilled_size)
+                self._spill(records[i:])
+                self.written += written
+                return None
+            except Exception as e:
+                log.error(
+                    "Could not write a record to %s, saving it to %s: %s",
+                    record[0],
+                    self.dead_letter_path,
+                    e,
+                )
+                self._append(self.dead_letter_path, [record])
+                self.dead_lettered += 1
+            else:
+                written += 1
+        return written
+
+    def _spill(self, records: list[tuple[str, dict[str, Any]]]) -> None:
+        self._append(self.spill_path, records)
+        self.spilled += len(records)
+
+    def _append(self, path: str, records: list[tuple[str, dict[str, Any]]]) -> None:
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a") as f:
+                for table, kwargs in records:
+                    f.write(
+                        json.dumps({"table": table, "record": kwargs}, default=_encode)
+                    )
+                    f.write("\n")
+
+    def _read_spilled(
+        self, max_records: int
+    ) -> tuple[list[tuple[str, dict[str, Any]]], int]:
+        """
+        Returns the first `max_records` spilled records and the number of bytes they take at
+        the start of the spill file.
+        """
+        lines = []
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return [], 0
+            with open(self.spill_path, "rb") as f:
+                for line in f:
+                    if len(lines) == max_records:
+                        break
+                    lines.append(line)
+        records = []
+        for line in lines:
+            record = json.loads(line, object_hook=_decode)
+            records.append((record["table"], record["record"]))
+        return records, sum(len(line) for line in lines)
+
+    def _drop_spilled(self, size: int) -> None:
+        """Removes the first `size` bytes of the spill file, keeping the records spilled since."""
+        if not size:
+            return
+        with self._spill_lock:
+            with open(self.spill_path, "rb") as f:
+                f.seek(size)
+                remaining = f.read()
+            if remaining:
+                with open(self.spill_path, "wb") as f:
+                    f.write(remaining)
+            else:
+                os.remove(self.spill_path)
+
+
+def _insert(db, records: list[tuple[str, dict[str, Any]]]) -> None:
+    from sqlalchemy import insert
+
+    from .database import structures
+
+    rows_by_table = defaultdict(list)
+    for table, kwargs in records:
+        rows_by_table[table].append(kwargs)
+    try:
+        for table, rows in rows_by_table.items():
+            db.execute(insert(structures[table]), rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _get_db():
+    from .database import get_db
+
+    return get_db()
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": sorted(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(value: dict) -> Any:
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__set__" in value:
+        return set(value["__set__"])
+    return value
+
+
+RECORD_WRITER = RecordWriter(os.getenv("PYDOCASS_RECORDS_SPILL_PATH"))
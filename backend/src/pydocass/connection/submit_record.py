@@ -1,31 +1,10 @@
 from typing import Literal
-from sqlalchemy.exc import OperationalError
-import time
 import logging
-from .database import structures, get_db
+from .record_writer import RECORD_WRITER
 
 log = logging.getLogger(__name__)
 
 
-def submit_record(
-    table: Literal["responses", "feedback", "inputs"],
-    retries: int = 3,
-    delay: int = 2,
-    **kwargs
-):
-    for attempt in range(retries):
-        try:
-            record = structures[table](**kwargs)
-            with get_db() as db:
-                if db is None:
-                    log.error("Database connection not configured")
-                    return
-                db.add(record)
-                db.commit()
-                db.refresh(record)
-                return
-        except OperationalError:
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                raise
+def submit_record(table: Literal["responses", "feedback", "inputs"], **kwargs):
+    # The record is written by the background writer, so this never waits for the database
+    RECORD_WRITER.submit(table, **kwargs)
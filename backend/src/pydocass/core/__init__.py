@@ -1,3 +1,3 @@
-from .document_python_code import document_python_code
+from .document_python_code import document_python_code, adocument_python_code
 
-__all__ = ["document_python_code"]
+__all__ = ["document_python_code", "adocument_python_code"]
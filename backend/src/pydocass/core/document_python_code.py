@@ -1,27 +1,46 @@
+from __future__ import annotations
+
 import ast
+import asyncio
 import logging
 from datetime import datetime
-from typing import Generator
-
+from typing import TYPE_CHECKING, AsyncGenerator, Generator, Union
 
-from openai import Client
-from transformers import PreTrainedTokenizerFast
+if TYPE_CHECKING:
+    from openai import AsyncClient, Client
+    from transformers import PreTrainedTokenizerFast
 
 from ..components import (
     write_docstrings,
     write_arguments_annotations,
     write_comments,
-    maybe_add_class_to_typing_import,
+    awrite_docstrings,
+    awrite_arguments_annotations,
+    awrite_comments,
+    maybe_add_classes_to_typing_import,
 )
 from ..connection import submit_record
-from ..utils.utils import (
-    get_nodes_dict_with_functions_classes_methods,
-    check_no_duplicating_methods,
-    load_tokenizer,
-)
+from ..utils.utils import load_tokenizer
+from ..utils.git_diff import get_changed_node_names, get_node_lines
+from ..utils.line_merge import merge_line_edits
+from ..utils.module_index import ModuleIndex
 from ..utils.indentation import detect_indentation, align_indentation
 from ..utils.align_argument_defaults import align_argument_defaults
-from ..utils.constants import DEFAULT_MODEL_CHECKPOINT
+from ..utils.cache import ResultsCache
+from ..utils.concurrency import aiterate_concurrently, iterate_concurrently
+from ..utils.constants import (
+    COMMENTS_FORMAT_LINES,
+    DEFAULT_MODEL_CHECKPOINT,
+    SEGMENT_MAX_CONCURRENT,
+    SEGMENT_MAX_TOKENS,
+)
+from ..utils.segmenter import (
+    extract_segment,
+    get_segment_body_lines,
+    join_segments,
+    make_segment_code,
+    split_module,
+)
 
 
 log = logging.getLogger(__name__)
@@ -40,6 +59,15 @@ def document_python_code(
     model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
     tokenizer: PreTrainedTokenizerFast | None = None,
     in_time: datetime | None = None,
+    cache: ResultsCache | None = None,
+    response_data: dict | None = None,
+    changed_lines: set[int] | None = None,
+    segment_max_tokens: int | None = SEGMENT_MAX_TOKENS,
+    concurrent_docstrings_and_comments: bool = False,
+    pipeline_group_size: int | None = None,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
+    submit_response_record: bool = True,
 ) -> Generator[str, None, None]:
     # Save the initial time for recording purposes
     if in_time is None:
@@ -48,20 +76,88 @@ def document_python_code(
     code = rf"{code}"
     # Make copy of the initial code
     in_code = str(code)
-    # Get current indentation. It will be one of ["2-space", "4-space", "tab", "inconsistent"]
-    indent_type = detect_indentation(code)
-    # Parse the code into an AST
-    tree = ast.parse(code)
-
-    # Check that there are no duplicate methods, classes, or functions
-    check_no_duplicating_methods(tree.body)
-    # Get a dictionary of nodes that need to be annotated or documented
-    target_nodes_dict = get_nodes_dict_with_functions_classes_methods(tree.body)
+    indent_type, module_index = _parse_code(code)
+    target_nodes_dict = module_index.target_nodes
+    # With `changed_lines`, only the functions, classes and methods containing them are documented
+    changed_node_names = None
+    if changed_lines is not None:
+        changed_node_names = get_changed_node_names(target_nodes_dict, changed_lines)
+        if not changed_node_names:
+            _update_response_data(response_data, {}, {}, {})
+            yield code
+            return
+        target_nodes_dict = _select_nodes(target_nodes_dict, changed_node_names)
 
     # Load tokenizer to track the number of input tokens
     if tokenizer is None:
         tokenizer = load_tokenizer(model_checkpoint)
 
+    if pipeline_group_size is not None or (
+        segment_max_tokens is not None
+        and len(tokenizer.tokenize(code)) > segment_max_tokens
+    ):
+        # Large modules are documented in parallel segments that fit the default model.
+        # In the pipelined mode, the segments have at most `pipeline_group_size` functions
+        # and classes, so that the first ones are fully documented early
+        segments = _split_into_segments(
+            code=code,
+            tree=module_index.tree,
+            tokenizer=tokenizer,
+            max_tokens=segment_max_tokens,
+            max_definitions=pipeline_group_size,
+            changed_lines=changed_lines,
+        )
+        segments_response_data = [{} for _ in segments]
+
+        def make_generator_function(i: int):
+            def generate():
+                for output in document_python_code(
+                    code=segments[i][0],
+                    client=client,
+                    modify_existing_documentation=modify_existing_documentation,
+                    do_write_arguments_annotation=do_write_arguments_annotation,
+                    do_write_docstrings=do_write_docstrings,
+                    do_write_comments=do_write_comments,
+                    use_streaming=use_streaming,
+                    annotate_with_any=annotate_with_any,
+                    do_align_argument_defaults=do_align_argument_defaults,
+                    model_checkpoint=model_checkpoint,
+                    tokenizer=tokenizer,
+                    in_time=in_time,
+                    cache=cache,
+                    response_data=segments_response_data[i],
+                    changed_lines=segments[i][1],
+                    segment_max_tokens=None,
+                    concurrent_docstrings_and_comments=concurrent_docstrings_and_comments,
+                    comments_format=comments_format,
+                    comments_budget=comments_budget,
+                    # The record of the whole module is submitted once all segments are done
+                    submit_response_record=False,
+                ):
+                    yield extract_segment(output)
+
+            return generate
+
+        documented_segments = [extract_segment(x) for x, _ in segments]
+        # The snapshots of the segments are interleaved to show the progress of all of them
+        for i, segment in iterate_concurrently(
+            [make_generator_function(i) for i in range(len(segments))],
+            max_workers=SEGMENT_MAX_CONCURRENT,
+        ):
+            documented_segments[i] = segment
+            yield join_segments(documented_segments)
+        code = _finalize_segments(
+            segments=documented_segments,
+            segments_response_data=segments_response_data,
+            indent_type=indent_type,
+            response_data=response_data,
+            in_code=in_code,
+            in_time=in_time,
+            submit_response_record=submit_response_record,
+        )
+        yield code
+        return
+
     output = None
     # Set default values
     annotations_response_data = {}
@@ -78,6 +174,8 @@ def document_python_code(
             model_checkpoint=model_checkpoint,
             use_streaming=use_streaming,
             annotate_with_any=annotate_with_any,
+            cache=cache,
+            module_index=module_index,
         ):
             if isinstance(output, str):
                 yield output
@@ -85,21 +183,46 @@ def document_python_code(
         if output is not None:
             code, required_typing_imports, annotations_response_data = output
             annotations_response_data["required_imports"] = required_typing_imports
+            # The lines have changed, the index follows the next edits without parsing again
+            module_index = ModuleIndex(code)
             # If there are classes from the `typing` package that were used for annotation but not imported,
-            # add them to the imports
-            for typing_class in required_typing_imports:
-                code = maybe_add_class_to_typing_import(code, typing_class)
+            # add them to the imports with one edit
+            if required_typing_imports:
+                code = maybe_add_classes_to_typing_import(
+                    code, required_typing_imports, module_index=module_index
+                )
                 yield code
-            code = align_indentation(code=code, indent_type=indent_type)
-            if do_align_argument_defaults:
-                code = align_argument_defaults(code=code)
-            # Lines may have changed, so it's easier to rerun `ast.parse` which takes < 1ms than track
-            # this throughout the code
-            tree = ast.parse(code)
-            # Get dictionary with target nodes with the updated AST code
-            target_nodes_dict = get_nodes_dict_with_functions_classes_methods(tree.body)
-
-    if do_write_docstrings:
+            code, module_index = _finalize_annotations(
+                module_index=module_index,
+                do_align_argument_defaults=do_align_argument_defaults,
+            )
+            target_nodes_dict = _select_nodes(
+                module_index.target_nodes, changed_node_names
+            )
+
+    comments_written = False
+    if concurrent_docstrings_and_comments and do_write_docstrings and do_write_comments:
+        # Both stages start from the same code and their edits are merged
+        for output in _write_docstrings_and_comments_concurrently(
+            target_nodes_dict=target_nodes_dict,
+            code=code,
+            module_index=module_index,
+            changed_node_names=changed_node_names,
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            client=client,
+            tokenizer=tokenizer,
+            modify_existing_documentation=modify_existing_documentation,
+            model_checkpoint=model_checkpoint,
+            use_streaming=use_streaming,
+            cache=cache,
+        ):
+            if isinstance(output, str):
+                yield output
+        code, docstrings_response_data, comments_response_data = output
+        comments_written = comments_response_data is not None
+        comments_response_data = comments_response_data or {}
+    elif do_write_docstrings:
         output = None
         # Add docstrings to functions, classes, and methods
         for output in write_docstrings(
@@ -110,14 +233,15 @@ def document_python_code(
             modify_existing_documentation=modify_existing_documentation,
             model_checkpoint=model_checkpoint,
             use_streaming=use_streaming,
+            cache=cache,
         ):
             if isinstance(output, str):
                 yield output
         if output is not None:
             code, docstrings_response_data = output
-        code = align_indentation(code=code, indent_type=indent_type)
 
-    if do_write_comments:
+    if do_write_comments and not comments_written:
+        module_index = _get_module_index(module_index, code)
         # Add comments to the code where necessary
         for output in write_comments(
             code=code,
@@ -126,19 +250,545 @@ def document_python_code(
             modify_existing_documentation=modify_existing_documentation,
             model_checkpoint=model_checkpoint,
             use_streaming=use_streaming,
+            cache=cache,
+            line_numbers=_get_comment_lines(module_index, changed_node_names),
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            module_index=module_index,
+        ):
+            if isinstance(output, str):
+                yield output
+        code, comments_response_data = output
+    code = _finalize_code(code=code, indent_type=indent_type)
+    if submit_response_record:
+        _submit_response_record(
+            in_code=in_code,
+            out_code=code,
+            in_time=in_time,
+            annotations_response_data=annotations_response_data,
+            docstrings_response_data=docstrings_response_data,
+            comments_response_data=comments_response_data,
+        )
+    _update_response_data(
+        response_data,
+        annotations_response_data,
+        docstrings_response_data,
+        comments_response_data,
+    )
+    yield code
+
+
+async def adocument_python_code(
+    code: str,
+    client: AsyncClient,
+    modify_existing_documentation: bool = False,
+    do_write_arguments_annotation: bool = True,
+    do_write_docstrings: bool = True,
+    do_write_comments: bool = True,
+    annotate_with_any: bool = False,
+    do_align_argument_defaults: bool = False,
+    model_checkpoint: str = DEFAULT_MODEL_CHECKPOINT,
+    tokenizer: PreTrainedTokenizerFast | None = None,
+    in_time: datetime | None = None,
+    cache: ResultsCache | None = None,
+    response_data: dict | None = None,
+    changed_lines: set[int] | None = None,
+    segment_max_tokens: int | None = SEGMENT_MAX_TOKENS,
+    concurrent_docstrings_and_comments: bool = False,
+    pipeline_group_size: int | None = None,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
+    submit_response_record: bool = True,
+) -> AsyncGenerator[str, None]:
+    """
+    Async version of `document_python_code` built on `openai.AsyncClient`. It yields the same
+    code snapshots, while the CPU-bound steps (parsing, tokenization, the database record)
+    are run in the default executor so that one event loop can serve many sessions.
+    Only the streaming mode is supported.
+    """
+    # Save the initial time for recording purposes
+    if in_time is None:
+        in_time = datetime.now()
+    # Read the code as a raw string to avoid AST parsing errors
+    code = rf"{code}"
+    # Make copy of the initial code
+    in_code = str(code)
+    indent_type, module_index = await asyncio.to_thread(_parse_code, code)
+    target_nodes_dict = module_index.target_nodes
+    # With `changed_lines`, only the functions, classes and methods containing them are documented
+    changed_node_names = None
+    if changed_lines is not None:
+        changed_node_names = get_changed_node_names(target_nodes_dict, changed_lines)
+        if not changed_node_names:
+            _update_response_data(response_data, {}, {}, {})
+            yield code
+            return
+        target_nodes_dict = _select_nodes(target_nodes_dict, changed_node_names)
+
+    # Load tokenizer to track the number of input tokens
+    if tokenizer is None:
+        tokenizer = await asyncio.to_thread(load_tokenizer, model_checkpoint)
+
+    if pipeline_group_size is not None or (
+        segment_max_tokens is not None
+        and len(tokenizer.tokenize(code)) > segment_max_tokens
+    ):
+        # Large modules are documented in parallel segments that fit the default model.
+        # In the pipelined mode, the segments have at most `pipeline_group_size` functions
+        # and classes, so that the first ones are fully documented early
+        segments = await asyncio.to_thread(
+            _split_into_segments,
+            code=code,
+            tree=module_index.tree,
+            tokenizer=tokenizer,
+            max_tokens=segment_max_tokens,
+            max_definitions=pipeline_group_size,
+            changed_lines=changed_lines,
+        )
+        segments_response_data = [{} for _ in segments]
+
+        def make_generator_function(i: int):
+            async def generate():
+                async for output in adocument_python_code(
+                    code=segments[i][0],
+                    client=client,
+                    modify_existing_documentation=modify_existing_documentation,
+                    do_write_arguments_annotation=do_write_arguments_annotation,
+                    do_write_docstrings=do_write_docstrings,
+                    do_write_comments=do_write_comments,
+                    annotate_with_any=annotate_with_any,
+                    do_align_argument_defaults=do_align_argument_defaults,
+                    model_checkpoint=model_checkpoint,
+                    tokenizer=tokenizer,
+                    in_time=in_time,
+                    cache=cache,
+                    response_data=segments_response_data[i],
+                    changed_lines=segments[i][1],
+                    segment_max_tokens=None,
+                    concurrent_docstrings_and_comments=concurrent_docstrings_and_comments,
+                    comments_format=comments_format,
+                    comments_budget=comments_budget,
+                    # The record of the whole module is submitted once all segments are done
+                    submit_response_record=False,
+                ):
+                    yield extract_segment(output)
+
+            return generate
+
+        documented_segments = [extract_segment(x) for x, _ in segments]
+        # The snapshots of the segments are interleaved to show the progress of all of them
+        async for i, segment in aiterate_concurrently(
+            [make_generator_function(i) for i in range(len(segments))],
+            max_concurrency=SEGMENT_MAX_CONCURRENT,
+        ):
+            documented_segments[i] = segment
+            yield join_segments(documented_segments)
+        code = await asyncio.to_thread(
+            _finalize_segments,
+            segments=documented_segments,
+            segments_response_data=segments_response_data,
+            indent_type=indent_type,
+            response_data=response_data,
+            in_code=in_code,
+            in_time=in_time,
+            submit_response_record=submit_response_record,
+        )
+        yield code
+        return
+
+    output = None
+    # Set default values
+    annotations_response_data = {}
+    docstrings_response_data = {}
+    comments_response_data = {}
+    if do_write_arguments_annotation:
+        # Annotate the arguments and returns of functions, classes, and methods
+        async for output in awrite_arguments_annotations(
+            target_nodes_dict=target_nodes_dict,
+            code=code,
+            client=client,
+            tokenizer=tokenizer,
+            modify_existing_documentation=modify_existing_documentation,
+            model_checkpoint=model_checkpoint,
+            annotate_with_any=annotate_with_any,
+            cache=cache,
+            module_index=module_index,
+        ):
+            if isinstance(output, str):
+                yield output
+        # Get the required imports from the `typing` package that will need to be added in the end
+        if output is not None:
+            code, required_typing_imports, annotations_response_data = output
+            annotations_response_data["required_imports"] = required_typing_imports
+            # The lines have changed, the index follows the next edits without parsing again
+            module_index = await asyncio.to_thread(ModuleIndex, code)
+            # If there are classes from the `typing` package that were used for annotation but not imported,
+            # add them to the imports with one edit
+            if required_typing_imports:
+                code = maybe_add_classes_to_typing_import(
+                    code, required_typing_imports, module_index=module_index
+                )
+                yield code
+            code, module_index = await asyncio.to_thread(
+                _finalize_annotations,
+                module_index=module_index,
+                do_align_argument_defaults=do_align_argument_defaults,
+            )
+            target_nodes_dict = _select_nodes(
+                module_index.target_nodes, changed_node_names
+            )
+
+    comments_written = False
+    if concurrent_docstrings_and_comments and do_write_docstrings and do_write_comments:
+        # Both stages start from the same code and their edits are merged
+        async for output in _awrite_docstrings_and_comments_concurrently(
+            target_nodes_dict=target_nodes_dict,
+            code=code,
+            module_index=module_index,
+            changed_node_names=changed_node_names,
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            client=client,
+            tokenizer=tokenizer,
+            modify_existing_documentation=modify_existing_documentation,
+            model_checkpoint=model_checkpoint,
+            cache=cache,
+        ):
+            if isinstance(output, str):
+                yield output
+        code, docstrings_response_data, comments_response_data = output
+        comments_written = comments_response_data is not None
+        comments_response_data = comments_response_data or {}
+    elif do_write_docstrings:
+        output = None
+        # Add docstrings to functions, classes, and methods
+        async for output in awrite_docstrings(
+            target_nodes_dict=target_nodes_dict,
+            code=code,
+            client=client,
+            tokenizer=tokenizer,
+            modify_existing_documentation=modify_existing_documentation,
+            model_checkpoint=model_checkpoint,
+            cache=cache,
+        ):
+            if isinstance(output, str):
+                yield output
+        if output is not None:
+            code, docstrings_response_data = output
+
+    if do_write_comments and not comments_written:
+        module_index = await asyncio.to_thread(_get_module_index, module_index, code)
+        # Add comments to the code where necessary
+        async for output in awrite_comments(
+            code=code,
+            client=client,
+            tokenizer=tokenizer,
+            modify_existing_documentation=modify_existing_documentation,
+            model_checkpoint=model_checkpoint,
+            cache=cache,
+            line_numbers=_get_comment_lines(module_index, changed_node_names),
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            module_index=module_index,
         ):
             if isinstance(output, str):
                 yield output
         code, comments_response_data = output
+    code = await asyncio.to_thread(_finalize_code, code=code, indent_type=indent_type)
+    if submit_response_record:
+        await asyncio.to_thread(
+            _submit_response_record,
+            in_code=in_code,
+            out_code=code,
+            in_time=in_time,
+            annotations_response_data=annotations_response_data,
+            docstrings_response_data=docstrings_response_data,
+            comments_response_data=comments_response_data,
+        )
+    _update_response_data(
+        response_data,
+        annotations_response_data,
+        docstrings_response_data,
+        comments_response_data,
+    )
+    yield code
+
+
+def _write_docstrings_and_comments_concurrently(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    module_index: ModuleIndex,
+    changed_node_names: set[str] | None,
+    comments_format: str,
+    comments_budget: float | None,
+    **stage_kwargs,
+):
+    """
+    Runs the docstrings and the comments stages at the same time on the same code and merges
+    their edits, which are on different lines: the docstrings go under the headers of the
+    functions and classes, the comments go above the lines of their bodies. Yields the merged
+    code snapshots and finally the code with the response data of both stages. If the edits
+    conflict, the code with the docstrings only is returned with `None` comments data.
+    """
+    outputs = [(code, {}), (code, {})]
+    snapshots = [code, code]
+    generator_functions = [
+        lambda: write_docstrings(
+            target_nodes_dict=target_nodes_dict, code=code, **stage_kwargs
+        ),
+        lambda: write_comments(
+            code=code,
+            line_numbers=_get_comment_lines(module_index, changed_node_names),
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            module_index=module_index,
+            **stage_kwargs,
+        ),
+    ]
+    for index, output in iterate_concurrently(generator_functions, max_workers=2):
+        if isinstance(output, str):
+            snapshots[index] = output
+            # Snapshots caught in the middle of conflicting edits are skipped
+            if (merged := merge_line_edits(code, *snapshots)) is not None:
+                yield merged
+        else:
+            outputs[index] = output
+    yield _merge_stages_outputs(code, *outputs)
+
+
+async def _awrite_docstrings_and_comments_concurrently(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    code: str,
+    module_index: ModuleIndex,
+    changed_node_names: set[str] | None,
+    comments_format: str,
+    comments_budget: float | None,
+    **stage_kwargs,
+):
+    """Async version of `_write_docstrings_and_comments_concurrently`."""
+    outputs = [(code, {}), (code, {})]
+    snapshots = [code, code]
+    generator_functions = [
+        lambda: awrite_docstrings(
+            target_nodes_dict=target_nodes_dict, code=code, **stage_kwargs
+        ),
+        lambda: awrite_comments(
+            code=code,
+            line_numbers=_get_comment_lines(module_index, changed_node_names),
+            comments_format=comments_format,
+            comments_budget=comments_budget,
+            module_index=module_index,
+            **stage_kwargs,
+        ),
+    ]
+    async for index, output in aiterate_concurrently(
+        generator_functions, max_concurrency=2
+    ):
+        if isinstance(output, str):
+            snapshots[index] = output
+            # Snapshots caught in the middle of conflicting edits are skipped
+            if (merged := merge_line_edits(code, *snapshots)) is not None:
+                yield merged
+        else:
+            outputs[index] = output
+    yield await asyncio.to_thread(_merge_stages_outputs, code, *outputs)
+
+
+def _merge_stages_outputs(
+    code: str,
+    docstrings_output: tuple[str, dict],
+    comments_output: tuple[str, dict],
+) -> tuple[str, dict, dict | None]:
+    docstrings_code, docstrings_response_data = docstrings_output
+    comments_code, comments_response_data = comments_output
+    merged = merge_line_edits(code, docstrings_code, comments_code)
+    if merged is None:
+        log.warning("The docstrings and the comments conflict, rewriting the comments")
+        return docstrings_code, docstrings_response_data, None
+    return merged, docstrings_response_data, comments_response_data
+
+
+def _parse_code(code: str) -> tuple[str, ModuleIndex]:
+    # Get current indentation. It will be one of ["2-space", "4-space", "tab", "inconsistent"]
+    indent_type = detect_indentation(code)
+    # Parse the code and collect the nodes that need to be annotated or documented
+    module_index = ModuleIndex(code)
+    # Check that there are no duplicate methods, classes, or functions
+    module_index.check_no_duplicates()
+    return indent_type, module_index
+
+
+def _finalize_annotations(
+    module_index: ModuleIndex, do_align_argument_defaults: bool
+) -> tuple[str, ModuleIndex]:
+    code = module_index.code
+    if do_align_argument_defaults:
+        code = align_argument_defaults(code=code, tree=module_index.tree)
+        # The signatures have changed, which is easier to parse again than to track
+        module_index = ModuleIndex(code)
+    return code, module_index
+
+
+def _get_module_index(module_index: ModuleIndex, code: str) -> ModuleIndex:
+    # The index is built again only if the code has changed since, e.g. with the docstrings
+    return module_index if module_index.code == code else ModuleIndex(code)
+
+
+def _select_nodes(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    node_names: set[str] | None,
+) -> dict[str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]]:
+    if node_names is None:
+        return target_nodes_dict
+    return {k: v for k, v in target_nodes_dict.items() if k in node_names}
+
+
+def _get_node_lines(
+    module_index: ModuleIndex, node_names: set[str] | None
+) -> set[int] | None:
+    if node_names is None:
+        return None
+    # The lines of the nodes have moved after the annotations and the docstrings were added
+    return get_node_lines(module_index.target_nodes, node_names)
+
+
+def _get_comment_lines(
+    module_index: ModuleIndex, node_names: set[str] | None
+) -> set[int] | None:
+    line_numbers = _get_node_lines(module_index, node_names)
+    # The header of a segment is only context, and its comments would be discarded
+    body_lines = get_segment_body_lines(module_index.code)
+    if body_lines is None:
+        return line_numbers
+    return body_lines if line_numbers is None else line_numbers & body_lines
+
+
+def _split_into_segments(
+    code: str,
+    tree: ast.Module,
+    tokenizer: PreTrainedTokenizerFast,
+    max_tokens: int | None,
+    max_definitions: int | None,
+    changed_lines: set[int] | None,
+) -> list[tuple[str, set[int] | None]]:
+    """
+    Splits the module into the codes of the segments to document separately. Each segment but
+    the first one (which has the imports) is preceded by the header of the module.
+
+    Returns:
+        `list[tuple[str, set[int] | None]]`:
+            The code of each segment and its changed lines, renumbered within the segment code.
+    """
+    header, ranges = split_module(
+        code,
+        tree=tree,
+        tokenizer=tokenizer,
+        max_tokens=max_tokens,
+        max_definitions=max_definitions,
+    )
+    lines = code.splitlines(keepends=True)
+    segments = []
+    for i, (start, end) in enumerate(ranges):
+        segment_code = "".join(lines[start:end])
+        offset = 0
+        if i > 0:
+            segment_code = make_segment_code(header, segment_code)
+            # The header lines and the line separating it from the segment
+            offset = header.count("\n") + 1
+        segment_changed_lines = None
+        if changed_lines is not None:
+            segment_changed_lines = {
+                line - start + offset for line in changed_lines if start < line <= end
+            }
+        segments.append((segment_code, segment_changed_lines))
+    return segments
+
+
+def _finalize_segments(
+    segments: list[str],
+    segments_response_data: list[dict],
+    indent_type: str,
+    response_data: dict | None,
+    in_code: str,
+    in_time: datetime,
+    submit_response_record: bool,
+) -> str:
+    code = join_segments(segments)
+    # The `typing` imports added to the headers of the segments are lost, so add them again
+    required_typing_imports = set().union(
+        *(
+            data.get("annotations", {}).get("required_imports", set())
+            for data in segments_response_data
+        )
+    )
+    if required_typing_imports:
+        code = maybe_add_classes_to_typing_import(code, required_typing_imports)
+    code = _finalize_code(code=code, indent_type=indent_type)
+    # The token usage of the stages is summed over the segments
+    stages_response_data = []
+    for stage in ("annotations", "docstrings", "comments"):
+        stage_response_data = {}
+        for data in segments_response_data:
+            if not data.get(stage):
+                continue
+            stage_response_data.setdefault("model", data[stage].get("model"))
+            for key in ("prompt_tokens", "completion_tokens"):
+                stage_response_data[key] = stage_response_data.get(key, 0) + (
+                    data[stage].get(key) or 0
+                )
+        stages_response_data.append(stage_response_data)
+    if required_typing_imports:
+        stages_response_data[0]["required_imports"] = required_typing_imports
+    if submit_response_record:
+        # One record for the whole module, not for each segment with its header
+        _submit_response_record(in_code, code, in_time, *stages_response_data)
+    _update_response_data(response_data, *stages_response_data)
+    return code
+
+
+def _finalize_code(code: str, indent_type: str) -> str:
+    # The stages keep the indentation of the lines they edit, so it is aligned once in the end
     code = align_indentation(code=code, indent_type=indent_type)
     # Make sure the generated code has valid Python syntax
     ast.parse(code)
+    return code
+
+
+def _update_response_data(
+    response_data: dict | None,
+    annotations_response_data: dict,
+    docstrings_response_data: dict,
+    comments_response_data: dict,
+) -> None:
+    if response_data is not None:
+        # Let the caller see the models and token usage of each stage
+        response_data.update(
+            annotations=annotations_response_data,
+            docstrings=docstrings_response_data,
+            comments=comments_response_data,
+        )
+
+
+def _submit_response_record(
+    in_code: str,
+    out_code: str,
+    in_time: datetime,
+    annotations_response_data: dict,
+    docstrings_response_data: dict,
+    comments_response_data: dict,
+) -> None:
     # Save to database
     try:
         submit_record(
             table="responses",
             in_code=in_code,
-            out_code=code,
+            out_code=out_code,
             in_time=in_time,
             out_time=datetime.now(),
             **{"annotations_" + k: v for k, v in annotations_response_data.items()},
@@ -147,4 +797,3 @@ def document_python_code(
         )
     except Exception as e:
         log.error("Error submitting record (non-critical): %s", e)
-    yield code
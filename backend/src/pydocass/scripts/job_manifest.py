@@ -0,0 +1,123 @@
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+STAGES = ("annotations", "docstrings", "comments")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    input_hash TEXT,
+    output_hash TEXT,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    error TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    path TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    model TEXT,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    PRIMARY KEY (path, stage)
+);
+"""
+
+
+class JobManifest:
+    """
+    SQLite record of a batch documentation run: the status, the input and output hashes and
+    the token usage of each file and of each of its stages. It lets a restarted run skip the
+    files that were already documented and have not changed since.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def is_done(self, path: str, input_hash: str) -> bool:
+        """
+        Whether the file was documented and is unchanged since: its hash is either the hash of
+        the input that was documented, or the hash of the output written in its place.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, input_hash, output_hash FROM files WHERE path = ?",
+                (path,),
+            ).fetchone()
+        return (
+            row is not None and row[0] == STATUS_DONE and input_hash in (row[1], row[2])
+        )
+
+    def start(self, path: str, input_hash: str) -> None:
+        self._set_file(path, STATUS_RUNNING, input_hash=input_hash)
+
+    def finish(self, path: str, output_hash: str, response_data: dict) -> None:
+        stage_rows = [
+            (
+                path,
+                stage,
+                STATUS_DONE,
+                response_data[stage].get("model"),
+                response_data[stage].get("prompt_tokens", 0),
+                response_data[stage].get("completion_tokens", 0),
+            )
+            for stage in STAGES
+            if response_data.get(stage)
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)", stage_rows
+            )
+        self._set_file(
+            path,
+            STATUS_DONE,
+            output_hash=output_hash,
+            prompt_tokens=sum(row[4] or 0 for row in stage_rows),
+            completion_tokens=sum(row[5] or 0 for row in stage_rows),
+        )
+
+    def fail(self, path: str, error: str) -> None:
+        self._set_file(path, STATUS_FAILED, error=error)
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM files GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _set_file(self, path: str, status: str, **values) -> None:
+        values = {"status": status, "updated_at": datetime.now().isoformat(), **values}
+        if status == STATUS_RUNNING:
+            # A new attempt starts from scratch
+            values.update(output_hash=None, error=None)
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        with self._lock, self._connection:
+            if status == STATUS_RUNNING:
+                self._connection.execute("DELETE FROM stages WHERE path = ?", (path,))
+            self._connection.execute(
+                f"INSERT INTO files (path, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT (path) DO UPDATE SET {updates}",
+                (path, *values.values()),
+            )
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
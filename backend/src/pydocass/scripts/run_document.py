@@ -2,13 +2,21 @@
 import os
 import sys
 import argparse
+import shutil
+import time
 from datetime import datetime
 import tempfile
 
-from pydocass.core.document_python_code import document_python_code
-from pydocass.connection import submit_record
-from pydocass.utils.utils import format_code_with_black, get_client
-from pydocass.utils.constants import DEFAULT_MODEL_CHECKPOINT
+from pydocass.utils.constants import (
+    COMMENTS_FORMAT_LINES,
+    COMMENTS_FORMAT_SPARSE,
+    DEFAULT_MODEL_CHECKPOINT,
+)
+
+DEFAULT_NUM_JOBS = 4
+# Directories that are not searched for the Python files in the recursive mode
+SKIPPED_DIRECTORIES = {"__pycache__", "venv", "node_modules", "build", "dist"}
+DEFAULT_MANIFEST_FILE_NAME = ".pydocass_manifest.sqlite"
 
 
 def document_file(
@@ -26,6 +34,16 @@ def document_file(
     model_checkpoint: str | None = None,
     api_key: str | None = None,
     verbose: bool = False,
+    cache_dir: str | None = None,
+    client=None,
+    tokenizer=None,
+    cache=None,
+    response_data: dict | None = None,
+    git_base: str | None = None,
+    concurrent_docstrings_and_comments: bool = False,
+    pipeline_group_size: int | None = None,
+    comments_format: str = COMMENTS_FORMAT_LINES,
+    comments_budget: float | None = None,
 ):
     """
     Document a Python file or code string and return the documented code.
@@ -45,6 +63,16 @@ def document_file(
         model_checkpoint: Model checkpoint to use. If None, uses the default.
         api_key: API key for Nebius AI Studio or OpenAI. If None, uses environment variables.
         verbose: Whether to show progress updates during the documentation process.
+        cache_dir: Directory of the results cache. Unchanged functions and classes are taken from it instead of the LLM.
+        client: Client to use instead of creating one from api_key, e.g. shared by several files.
+        tokenizer: Tokenizer to use instead of loading the one of model_checkpoint.
+        cache: Results cache to use instead of creating one in cache_dir.
+        response_data: If given, filled with the models and token usage of each stage.
+        git_base: Git revision to compare input_file with. If given, only the functions, classes and methods changed since it are documented, the rest of the file is left as is (including the Black formatting).
+        concurrent_docstrings_and_comments: Whether to write the docstrings and the comments at the same time and merge them.
+        pipeline_group_size: If given, the functions and classes are documented in groups of this size, each group going through all the stages independently of the others. The prompts of a group only have the imports, the module-level assignments and the names of the other functions and classes as context, not their code.
+        comments_format: Output format of the comments: "lines" (a field for each line) or "sparse" (the list of the commented lines only).
+        comments_budget: If given, only this share (from 0 to 1) of the statements, the least obvious ones according to a local static scorer, is sent to the LLM for comments.
 
     Returns:
         The documented code as a string.
@@ -53,6 +81,13 @@ def document_file(
         FileNotFoundError: If the input file is not found.
         Exception: If there's an error during the documentation process.
     """
+    # Imported here so that `--help` and argument errors do not wait for the heavy dependencies
+    from pydocass.core.document_python_code import document_python_code
+    from pydocass.connection import submit_record
+    from pydocass.utils.utils import format_code_with_black, get_client
+    from pydocass.utils.cache import create_results_cache
+    from pydocass.utils.git_diff import get_changed_lines
+
     # Read the input code if not provided directly
     if code is None:
         if input_file is None:
@@ -65,63 +100,242 @@ def document_file(
         except Exception as e:
             raise Exception(f"Error reading input file: {str(e)}")
 
-    try:
-        # Record input for tracking
-        in_time = datetime.now()
-        submit_record(table="inputs", in_time=in_time, in_code=code)
+    changed_lines = None
+    if git_base is not None:
+        if input_file is None:
+            raise ValueError("git_base requires input_file.")
+        changed_lines = get_changed_lines(input_file, git_base)
+        # Formatting the whole file would touch the unchanged code
+        do_black_format = False
+
+    # Record input for tracking
+    in_time = datetime.now()
+    submit_record(table="inputs", in_time=in_time, in_code=code)
 
-        # Get the OpenAI/Nebius client
+    # Get the OpenAI/Nebius client
+    if client is None:
         client = get_client({"api_key": api_key})
+    if cache is None and cache_dir:
+        cache = create_results_cache(cache_dir)
+
+    # Process the code
+    documented_code = None
+
+    if verbose:
+        print("Starting documentation process...", file=sys.stderr)
+
+    for chunk in document_python_code(
+        code=code,
+        client=client,
+        modify_existing_documentation=modify_existing_documentation,
+        do_write_arguments_annotation=do_write_arguments_annotations,
+        do_write_docstrings=do_write_docstrings,
+        do_write_comments=do_write_comments,
+        use_streaming=use_streaming,
+        annotate_with_any=annotate_with_any,
+        do_align_argument_defaults=do_align_argument_defaults,
+        in_time=in_time,
+        model_checkpoint=model_checkpoint,
+        tokenizer=tokenizer,
+        cache=cache,
+        response_data=response_data,
+        changed_lines=changed_lines,
+        concurrent_docstrings_and_comments=concurrent_docstrings_and_comments,
+        pipeline_group_size=pipeline_group_size,
+        comments_format=comments_format,
+        comments_budget=comments_budget,
+    ):
+        documented_code = chunk
+        if verbose:
+            print(".", end="", file=sys.stderr, flush=True)
 
-        # Process the code
-        documented_code = None
+    if verbose:
+        print("\nFormatting code with Black...", file=sys.stderr)
 
+    # Format the final code with Black
+    if do_black_format:
+        documented_code = format_code_with_black(documented_code)
+
+    # Output the documented code if output_file is specified
+    if len(documented_code) > 0 and output_file:
+        write_file_atomically(output_file, documented_code)
         if verbose:
-            print("Starting documentation process...", file=sys.stderr)
+            print(f"Documented code written to {output_file}", file=sys.stderr)
 
-        for chunk in document_python_code(
-            code=code,
-            client=client,
-            modify_existing_documentation=modify_existing_documentation,
-            do_write_arguments_annotation=do_write_arguments_annotations,
-            do_write_docstrings=do_write_docstrings,
-            do_write_comments=do_write_comments,
-            use_streaming=use_streaming,
-            annotate_with_any=annotate_with_any,
-            do_align_argument_defaults=do_align_argument_defaults,
-            in_time=in_time,
-            model_checkpoint=model_checkpoint,
-        ):
-            documented_code = chunk
-            if verbose:
-                print(".", end="", file=sys.stderr, flush=True)
+    return documented_code
 
-        if verbose:
-            print("\nFormatting code with Black...", file=sys.stderr)
 
-        # Format the final code with Black
-        if do_black_format:
-            documented_code = format_code_with_black(documented_code)
+def write_file_atomically(path: str, text: str) -> None:
+    """Writes the file through a temporary file so that it is never left half-written."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def find_python_files(directory: str) -> list[str]:
+    """Returns the paths of the Python files in `directory`, skipping hidden and build directories."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(
+            name
+            for name in dirs
+            if not name.startswith(".") and name not in SKIPPED_DIRECTORIES
+        )
+        paths.extend(
+            os.path.join(root, name) for name in sorted(files) if name.endswith(".py")
+        )
+    return paths
+
 
-        # Output the documented code if output_file is specified
-        if len(documented_code) > 0 and output_file:
-            with open(output_file, "w") as f:
-                f.write(documented_code)
-            if verbose:
-                print(f"Documented code written to {output_file}", file=sys.stderr)
+def document_directory(
+    directory: str,
+    output_directory: str | None = None,
+    jobs: int = DEFAULT_NUM_JOBS,
+    max_inflight_requests: int | None = None,
+    model_checkpoint: str | None = None,
+    api_key: str | None = None,
+    cache_dir: str | None = None,
+    verbose: bool = False,
+    manifest_path: str | None = None,
+    resume: bool = False,
+    **document_kwargs,
+) -> dict:
+    """
+    Documents all the Python files in a directory with a pool of worker threads. The files
+    share one client, one tokenizer and one results cache, and at most `max_inflight_requests`
+    LLM requests are sent at the same time. A file that fails is recorded and skipped.
+    The status of each file is kept in a job manifest, so that a restarted run can skip
+    the files that were already documented.
 
-        return documented_code
+    Args:
+        directory: Directory to search for the Python files recursively.
+        output_directory: Directory to write the documented files to, keeping their relative paths. If None, the files are overwritten.
+        jobs: Number of files documented at the same time.
+        max_inflight_requests: Maximum number of LLM requests in flight. If None, equals `jobs`.
+        model_checkpoint: Model checkpoint to use. If None, uses the default.
+        api_key: API key for Nebius AI Studio or OpenAI. If None, uses environment variables.
+        cache_dir: Directory of the results cache.
+        verbose: Whether to print a line for each documented file.
+        manifest_path: Path of the SQLite job manifest. If None, `.pydocass_manifest.sqlite` in the output directory.
+        resume: Whether to skip the files documented by a previous run that have not changed since.
+        **document_kwargs: Other arguments of `document_file`.
 
-    except Exception as e:
-        print(f"Error: {str(e)}\nFile: {input_file}", file=sys.stderr)
-        # if output_file:
-        #     with open(output_file, 'w') as f:
-        #         pass
-        import pdb
+    Returns:
+        The summary of the batch: the numbers of documented, failed and skipped files, the failures,
+        the elapsed time, the throughput in files per minute and in tokens per second.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
 
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        pdb.post_mortem(exc_traceback)
-        return
+    from pydocass.utils.concurrency import LLM_REQUEST_LIMITER
+    from pydocass.utils.utils import get_client, load_tokenizer
+    from pydocass.utils.cache import create_results_cache
+    from pydocass.scripts.job_manifest import JobManifest, hash_text
+
+    paths = find_python_files(directory)
+    if manifest_path is None:
+        manifest_path = os.path.join(
+            output_directory or directory, DEFAULT_MANIFEST_FILE_NAME
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    manifest = JobManifest(manifest_path)
+    model_checkpoint = model_checkpoint or DEFAULT_MODEL_CHECKPOINT
+    shared_kwargs = dict(
+        client=get_client({"api_key": api_key}),
+        tokenizer=load_tokenizer(model_checkpoint),
+        cache=create_results_cache(cache_dir) if cache_dir else None,
+        model_checkpoint=model_checkpoint,
+        **document_kwargs,
+    )
+
+    def document_path(path: str) -> dict | None:
+        # The manifest is keyed by the relative path, so the run can be resumed from anywhere
+        relative_path = os.path.relpath(path, directory)
+        output_file = path
+        if output_directory is not None:
+            output_file = os.path.join(output_directory, relative_path)
+        with open(path) as f:
+            code = f.read()
+        input_hash = hash_text(code)
+        if resume and manifest.is_done(relative_path, input_hash):
+            return None
+        manifest.start(relative_path, input_hash)
+        response_data = {}
+        try:
+            documented_code = document_file(
+                input_file=path,
+                code=code,
+                output_file=output_file,
+                response_data=response_data,
+                **shared_kwargs,
+            )
+        except Exception as e:
+            manifest.fail(relative_path, f"{type(e).__name__}: {e}")
+            raise
+        manifest.finish(relative_path, hash_text(documented_code), response_data)
+        return response_data
+
+    summary = {"documented": 0, "failed": 0, "skipped": 0, "failures": [], "tokens": 0}
+    LLM_REQUEST_LIMITER.set_limit(max_inflight_requests or jobs)
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(document_path, path): path for path in paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    response_data = future.result()
+                except Exception as e:
+                    summary["failed"] += 1
+                    summary["failures"].append(
+                        {"file": path, "error": type(e).__name__, "message": str(e)}
+                    )
+                    print(f"Failed: {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+                if response_data is None:
+                    summary["skipped"] += 1
+                    continue
+                summary["documented"] += 1
+                summary["tokens"] += sum(
+                    stage_data.get("prompt_tokens", 0)
+                    + stage_data.get("completion_tokens", 0)
+                    for stage_data in response_data.values()
+                )
+                if verbose:
+                    print(f"Documented: {path}", file=sys.stderr)
+    finally:
+        LLM_REQUEST_LIMITER.set_limit(None)
+        manifest.close()
+    elapsed = time.perf_counter() - start_time
+    summary["failures"].sort(key=lambda failure: failure["file"])
+    summary["seconds"] = elapsed
+    num_processed = summary["documented"] + summary["failed"]
+    summary["files_per_minute"] = num_processed / elapsed * 60 if elapsed else 0.0
+    summary["tokens_per_second"] = summary["tokens"] / elapsed if elapsed else 0.0
+    return summary
+
+
+def print_batch_summary(summary: dict) -> None:
+    print(
+        f"Documented {summary['documented']} files, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped as already documented "
+        f"in {summary['seconds']:.1f}s: {summary['files_per_minute']:.1f} files/min, "
+        f"{summary['tokens_per_second']:.1f} tokens/s",
+        file=sys.stderr,
+    )
+    for failure in summary["failures"]:
+        print(
+            f"  {failure['file']}: {failure['error']}: {failure['message']}",
+            file=sys.stderr,
+        )
 
 
 def main():
@@ -212,14 +426,121 @@ def main():
         help="API key for Nebius AI Studio or OpenAI. Can also be set via NEBIUS_API_KEY or OPENAI_API_KEY environment variables.",
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Directory to cache the results in. Unchanged functions and classes are not sent to the LLM again.",
+    )
+
     parser.add_argument(
         "--verbose",
         action="store_true",
         help="Show progress updates during documentation process.",
     )
 
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        metavar="DIR",
+        default=None,
+        help="Document all the Python files in DIR. The files are overwritten unless --output-file gives the output directory.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_NUM_JOBS,
+        help=f"Number of files documented at the same time in the recursive mode. Default: {DEFAULT_NUM_JOBS}",
+    )
+
+    parser.add_argument(
+        "--max-inflight-requests",
+        type=int,
+        default=None,
+        help="Maximum number of LLM requests sent at the same time in the recursive mode. Default: the number of jobs.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help=f"Path of the job manifest of the recursive mode. Default: {DEFAULT_MANIFEST_FILE_NAME} in the output directory.",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the files documented by a previous recursive run that have not changed since.",
+    )
+
+    parser.add_argument(
+        "--git-base",
+        metavar="REF",
+        default=None,
+        help="Only document the functions, classes and methods changed since the git revision REF, e.g. origin/main. The rest of the files is left as is.",
+    )
+
+    parser.add_argument(
+        "--concurrent-stages",
+        action="store_true",
+        dest="concurrent_docstrings_and_comments",
+        help="Write the docstrings and the comments at the same time and merge them.",
+    )
+
+    parser.add_argument(
+        "--pipeline-group-size",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Document the top-level functions and classes in groups of N that go through all the stages in parallel. The first functions are documented sooner, at the cost of more requests. Each group only sees the imports, the module-level assignments and the names of the other functions and classes, not their code, which may lower the quality of the documentation.",
+    )
+
+    parser.add_argument(
+        "--comments-format",
+        choices=[COMMENTS_FORMAT_LINES, COMMENTS_FORMAT_SPARSE],
+        default=COMMENTS_FORMAT_LINES,
+        help=f"Output format of the comments: a field for each line ({COMMENTS_FORMAT_LINES}) or the list of the commented lines only ({COMMENTS_FORMAT_SPARSE}), which takes fewer tokens. Default: {COMMENTS_FORMAT_LINES}",
+    )
+
+    parser.add_argument(
+        "--comments-budget",
+        type=float,
+        default=None,
+        metavar="FRACTION",
+        help="Only send the least obvious statements to the LLM for comments, at most this share of them (from 0 to 1), as picked by a local static scorer. Default: all the lines",
+    )
+
     args = parser.parse_args()
 
+    if args.recursive is not None:
+        summary = document_directory(
+            directory=args.recursive,
+            output_directory=args.output_file,
+            jobs=args.jobs,
+            max_inflight_requests=args.max_inflight_requests,
+            model_checkpoint=args.model_checkpoint,
+            api_key=args.api_key,
+            cache_dir=args.cache_dir,
+            verbose=args.verbose,
+            manifest_path=args.manifest,
+            resume=args.resume,
+            modify_existing_documentation=args.modify_existing_documentation,
+            do_write_arguments_annotations=args.do_write_arguments_annotations,
+            do_write_docstrings=args.do_write_docstrings,
+            do_write_comments=args.do_write_comments,
+            use_streaming=args.use_streaming,
+            annotate_with_any=args.annotate_with_any,
+            do_align_argument_defaults=args.do_align_argument_defaults,
+            do_black_format=args.do_black_format,
+            git_base=args.git_base,
+            concurrent_docstrings_and_comments=args.concurrent_docstrings_and_comments,
+            pipeline_group_size=args.pipeline_group_size,
+            comments_format=args.comments_format,
+            comments_budget=args.comments_budget,
+        )
+        print_batch_summary(summary)
+        sys.exit(1 if summary["failed"] else 0)
+
     # Handle stdin input
     code = None
     input_file = args.input_file
@@ -244,6 +565,12 @@ def main():
             model_checkpoint=args.model_checkpoint,
             api_key=args.api_key,
             verbose=args.verbose,
+            cache_dir=args.cache_dir,
+            git_base=args.git_base,
+            concurrent_docstrings_and_comments=args.concurrent_docstrings_and_comments,
+            pipeline_group_size=args.pipeline_group_size,
+            comments_format=args.comments_format,
+            comments_budget=args.comments_budget,
         )
 
         # If no output file was specified, print to stdout
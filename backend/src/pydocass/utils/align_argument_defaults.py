@@ -1,11 +1,15 @@
+from __future__ import annotations
+
 import ast
 import re
 
-def align_argument_defaults(code: str) -> str:
+def align_argument_defaults(code: str, tree: ast.Module | None = None) -> str:
    """
    Aligns default values in function definitions after type annotations are added.
+   The parsed `tree` of the code is used if given.
    """
-   tree = ast.parse(code)
+   if tree is None:
+       tree = ast.parse(code)
    
    class FunctionAligner(ast.NodeVisitor):
        def __init__(self, source_lines):
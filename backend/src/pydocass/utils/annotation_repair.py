@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import ast
+from functools import cache
+
+_CLOSING_BRACKETS = {"[": "]", "(": ")", "{": "}"}
+_OPENING_BRACKETS = {value: key for key, value in _CLOSING_BRACKETS.items()}
+# Characters that can't come right before a closing bracket, e.g. in `dict[str, ` or `int | `
+_DANGLING_CHARS = " \t\n,|"
+
+
+def is_valid_annotation(value: str) -> bool:
+    """Checks that the annotation is a single Python expression."""
+    try:
+        ast.parse(value, mode="eval")
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+@cache
+def repair_annotation(value: str) -> str | None:
+    """
+    Makes the annotation a valid Python expression without the LLM: closes the unclosed
+    brackets and quotes in the order they were opened and drops the closing brackets that
+    have no opening one.
+
+    Args:
+        value (`str`):
+            The annotation written by the LLM.
+
+    Returns:
+        `str | None`:
+            The annotation itself if it is valid, the repaired annotation, or None if it
+            can't be repaired, e.g. `Optional[` or `integer number`.
+    """
+    value = value.strip()
+    if is_valid_annotation(value):
+        return value
+    repaired = _balance_brackets(value)
+    return repaired if is_valid_annotation(repaired) else None
+
+
+def _balance_brackets(value: str) -> str:
+    chars = []
+    # The opening brackets that are not closed yet
+    stack = []
+    quote = None
+    escaped = False
+    for char in value:
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in _CLOSING_BRACKETS:
+            stack.append(char)
+        elif char in _OPENING_BRACKETS:
+            opening_bracket = _OPENING_BRACKETS[char]
+            if opening_bracket not in stack:
+                continue
+            # The brackets opened inside this one are closed first
+            while stack[-1] != opening_bracket:
+                _close_bracket(chars, stack.pop())
+            stack.pop()
+        chars.append(char)
+    if quote is not None:
+        chars.append(quote)
+    while stack:
+        _close_bracket(chars, stack.pop())
+    return "".join(chars).rstrip(_DANGLING_CHARS)
+
+
+def _close_bracket(chars: list[str], opening_bracket: str) -> None:
+    while chars and chars[-1] in _DANGLING_CHARS:
+        chars.pop()
+    chars.append(_CLOSING_BRACKETS[opening_bracket])
@@ -0,0 +1,216 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Literal, Union
+
+from .prompts import (
+    MESSAGES_ARGUMENTS_ANNOTATION,
+    MESSAGES_DOCSTRING,
+    MESSAGES_DOCSTRING_ADDITION,
+    MESSAGES_COMMENTS,
+    USER_PROMPT,
+)
+from .constants import CACHE_MAX_ENTRIES, CACHE_MAX_DISK_BYTES
+
+_LEADING_WHITESPACE = re.compile(r"^[ \t]+", re.MULTILINE)
+
+_STAGE_PROMPTS = {
+    "annotations": MESSAGES_ARGUMENTS_ANNOTATION,
+    "docstrings": MESSAGES_DOCSTRING + MESSAGES_DOCSTRING_ADDITION,
+    "comments": MESSAGES_COMMENTS,
+}
+
+
+class ResultsCache:
+    """
+    Base class for the caches of per-node LLM results. Subclasses implement `_get`,
+    `_set` and `__len__`; the base class keeps the hit / miss counters.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._set(key, value)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+    def _get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryLRUCache(ResultsCache):
+    """In-process cache that evicts the least recently used entries above `max_entries`."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, Any] = OrderedDict()
+
+    def _get(self, key: str) -> Any | None:
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def _set(self, key: str, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache(ResultsCache):
+    """
+    Cache stored as one JSON file per entry in `directory`. When the total size of the
+    entries exceeds `max_size_bytes`, the least recently used entries are deleted.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int = CACHE_MAX_DISK_BYTES):
+        super().__init__()
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Sizes of the entries, from the least to the most recently used
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[: -len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+        self.size_bytes = sum(self._sizes.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def _get(self, key: str) -> Any | None:
+        if key not in self._sizes:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                value = json.load(f)
+            # Mark the entry as recently used, also for other processes sharing the directory
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            self._forget(key)
+            return None
+        self._sizes.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: Any) -> None:
+        data = json.dumps(value)
+        # Write to a temporary file first so that readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self._forget(key)
+        self._sizes[key] = len(data)
+        self.size_bytes += len(data)
+        while self.size_bytes > self.max_size_bytes and len(self._sizes) > 1:
+            oldest_key = next(iter(self._sizes))
+            self._forget(oldest_key)
+            try:
+                os.remove(self._path(oldest_key))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        self.size_bytes -= self._sizes.pop(key, 0)
+
+    def stats(self) -> dict[str, int]:
+        return {**super().stats(), "size_bytes": self.size_bytes}
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+
+def create_results_cache(cache_dir: str | None = None) -> ResultsCache:
+    """Creates the on-disk cache if `cache_dir` is provided and the in-memory one otherwise."""
+    if cache_dir:
+        return DiskCache(cache_dir)
+    return InMemoryLRUCache()
+
+
+def get_node_source(
+    lines: list[str], node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
+) -> str:
+    # Decorators are part of the node (e.g. `staticmethod` changes the arguments)
+    first_lineno = min([node.lineno] + [x.lineno for x in node.decorator_list])
+    return "\n".join(lines[first_lineno - 1 : node.end_lineno])
+
+
+def normalize_source(source: str) -> str:
+    """Makes the source independent of its indentation style, nesting level and trailing spaces."""
+    lines = [line.rstrip() for line in source.splitlines()]
+    lines = [
+        _LEADING_WHITESPACE.sub(lambda x: x.group().replace("\t", "    "), line)
+        for line in lines
+    ]
+    non_empty_lines = [line for line in lines if line]
+    if not non_empty_lines:
+        return ""
+    common_indent = min(len(line) - len(line.lstrip(" ")) for line in non_empty_lines)
+    return "\n".join(line[common_indent:] for line in lines).strip("\n")
+
+
+@lru_cache(maxsize=None)
+def get_prompt_version(stage: Literal["annotations", "docstrings", "comments"]) -> str:
+    prompts = json.dumps([_STAGE_PROMPTS[stage], USER_PROMPT])
+    return hashlib.sha256(prompts.encode()).hexdigest()[:16]
+
+
+def make_cache_key(
+    source: str,
+    stage: Literal["annotations", "docstrings", "comments"],
+    model_checkpoint: str,
+    modify_existing_documentation: bool = False,
+) -> str:
+    key_data = json.dumps(
+        [
+            normalize_source(source),
+            stage,
+            model_checkpoint,
+            get_prompt_version(stage),
+            modify_existing_documentation,
+        ]
+    )
+    return hashlib.sha256(key_data.encode()).hexdigest()
@@ -0,0 +1,137 @@
+import hashlib
+import importlib.util
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from .constants import (
+    BASE_URL,
+    CLIENT_KEEPALIVE_EXPIRY_SECONDS,
+    CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+    CLIENT_POOL_IDLE_SECONDS,
+    CLIENT_POOL_MAX_CLIENTS,
+)
+
+log = logging.getLogger(__name__)
+
+# HTTP/2 is only available in `httpx` with the `h2` package installed
+HTTP2_SUPPORTED = importlib.util.find_spec("h2") is not None
+
+
+class ClientPool:
+    """
+    Bounded pool of LLM clients keyed by the hash of the API key and the base URL, so that the
+    requests with the same credentials reuse the keep-alive connections (and the TLS sessions)
+    of one client. The least recently used clients are dropped when the pool is full, and the
+    clients that were not used for `idle_seconds` are dropped on the next access.
+
+    The dropped clients are not closed explicitly because a request may still be using them;
+    their connections are closed when they are garbage-collected.
+    """
+
+    def __init__(
+        self,
+        create_client: Callable[[str, str | None], tuple[Any, Any]],
+        max_clients: int = CLIENT_POOL_MAX_CLIENTS,
+        idle_seconds: float = CLIENT_POOL_IDLE_SECONDS,
+    ):
+        # `create_client` returns the client and its `httpx` client used for pre-warming
+        self._create_client = create_client
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        # (API key hash, base URL) -> (client, HTTP client, last access time)
+        self._clients: OrderedDict[tuple[str, str | None], list] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, api_key: str, base_url: str | None = None) -> Any:
+        return self._get_entry(api_key, base_url)[0]
+
+    def prewarm(self, api_key: str, base_url: str | None = None) -> None:
+        """Creates the client and opens its connection to the server in advance."""
+        _, http_client, _ = self._get_entry(api_key, base_url)
+        url = base_url or str(getattr(http_client, "base_url", "") or "")
+        if not url:
+            return
+        try:
+            # Any response will do, the point is to establish the keep-alive connection
+            http_client.head(url)
+        except Exception as e:
+            log.warning("Could not pre-warm the connection to %s: %s", url, e)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "clients": len(self._clients),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _get_entry(self, api_key: str, base_url: str | None) -> list:
+        key = (hashlib.sha256(api_key.encode()).hexdigest(), base_url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._clients.move_to_end(key)
+                entry[2] = now
+                return entry
+            self.misses += 1
+            client, http_client = self._create_client(api_key, base_url)
+            entry = [client, http_client, now]
+            self._clients[key] = entry
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def _evict_idle(self, now: float) -> None:
+        # The clients are ordered by the last access time
+        while self._clients:
+            key, entry = next(iter(self._clients.items()))
+            if now - entry[2] < self.idle_seconds:
+                break
+            del self._clients[key]
+            self.evictions += 1
+
+
+def _get_http_client_kwargs() -> dict[str, Any]:
+    import httpx
+
+    return {
+        "http2": HTTP2_SUPPORTED,
+        "limits": httpx.Limits(
+            max_keepalive_connections=CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=CLIENT_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    }
+
+
+def _create_openai_client(api_key: str, base_url: str | None) -> tuple[Any, Any]:
+    from openai import Client, DefaultHttpxClient
+
+    http_client = DefaultHttpxClient(**_get_http_client_kwargs())
+    return (
+        Client(api_key=api_key, base_url=base_url or BASE_URL, http_client=http_client),
+        http_client,
+    )
+
+
+def _create_anthropic_client(api_key: str, base_url: str | None) -> tuple[Any, Any]:
+    import instructor
+    from anthropic import Anthropic, DefaultHttpxClient
+
+    http_client = DefaultHttpxClient(**_get_http_client_kwargs())
+    client = Anthropic(api_key=api_key, base_url=base_url, http_client=http_client)
+    return instructor.from_anthropic(client=client), http_client
+
+
+OPENAI_CLIENT_POOL = ClientPool(_create_openai_client)
+# Clients wrapped with `instructor`, used for the non-streaming requests
+ANTHROPIC_CLIENT_POOL = ClientPool(_create_anthropic_client)
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import ast
+import re
+
+# Numbers that are obvious without a comment
+_PLAIN_NUMBERS = frozenset({0, 1, -1, 2, 10, 100, 0.5, 1.0, 0.0})
+_BIT_OPERATORS = (ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift, ast.RShift, ast.Invert)
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+# `match` statements appeared in Python 3.10
+_NESTED_BLOCKS = (ast.stmt, ast.excepthandler, getattr(ast, "match_case", ()))
+_REGEX_FUNCTIONS = frozenset(
+    {
+        "compile",
+        "match",
+        "search",
+        "fullmatch",
+        "findall",
+        "finditer",
+        "sub",
+        "subn",
+        "split",
+    }
+)
+# Characters that make a string look like a regular expression
+_REGEX_CHARS = re.compile(r"\\[dswbDSWB]|\(\?|\[\^|[+*?]\)|\{\d+(,\d*)?\}")
+# Statements whose meaning is clear from the code itself
+_TRIVIAL_STATEMENTS = (
+    ast.Pass,
+    ast.Break,
+    ast.Continue,
+    ast.Import,
+    ast.ImportFrom,
+    ast.Global,
+    ast.Nonlocal,
+    ast.FunctionDef,
+    ast.AsyncFunctionDef,
+    ast.ClassDef,
+)
+# The lines with lower scores are not worth a comment
+MIN_COMMENT_SCORE = 2.0
+
+
+def score_lines(code: str, tree: ast.Module | None = None) -> dict[int, float]:
+    """
+    Estimates how much each statement of the code would benefit from a comment, from the
+    features of its AST: the size of its expressions, comprehensions, lambdas, bit and boolean
+    operations, magic numbers, regular expressions and the nesting depth.
+
+    Args:
+        code (`str`):
+            The code to score.
+        tree (`ast.Module | None`, *optional*):
+            The parsed code, if it is already available.
+
+    Returns:
+        `dict[int, float]`:
+            The scores of the first lines (1-based) of the statements. Trivial statements,
+            e.g. `pass`, `return x` or `a = 1`, and the headers of functions and classes
+            score 0.
+    """
+    scores = {}
+
+    def visit(statements: list[ast.stmt], depth: int) -> None:
+        for node in statements:
+            score = _score_statement(node, depth)
+            scores[node.lineno] = max(scores.get(node.lineno, 0.0), score)
+            # The nesting is counted from the bodies of the functions and classes
+            body_depth = (
+                0
+                if isinstance(
+                    node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+                )
+                else depth + 1
+            )
+            visit(getattr(node, "body", []), body_depth)
+            orelse = getattr(node, "orelse", [])
+            # An `elif` is on the same level as its `if`
+            is_elif = (
+                isinstance(node, ast.If)
+                and len(orelse) == 1
+                and isinstance(orelse[0], ast.If)
+            )
+            visit(orelse, depth if is_elif else body_depth)
+            visit(getattr(node, "finalbody", []), body_depth)
+            for handler in getattr(node, "handlers", []):
+                visit(handler.body, body_depth)
+            for case in getattr(node, "cases", []):
+                visit(case.body, body_depth)
+
+    visit((tree or ast.parse(code)).body, 0)
+    return scores
+
+
+def select_comment_candidates(
+    code: str, budget: float, tree: ast.Module | None = None
+) -> set[int]:
+    """
+    Picks the lines worth commenting: the highest-scored statements, at most `budget` of the
+    statements of the code, and only those scoring at least `MIN_COMMENT_SCORE`.
+
+    Args:
+        code (`str`):
+            The code to pick the lines from.
+        budget (`float`):
+            The maximum share of the statements to pick, from 0 to 1.
+        tree (`ast.Module | None`, *optional*):
+            The parsed code, if it is already available.
+
+    Returns:
+        `set[int]`:
+            The numbers (1-based) of the picked lines.
+    """
+    scores = score_lines(code, tree=tree)
+    max_candidates = int(len(scores) * budget)
+    ranked = sorted(
+        (line for line, score in scores.items() if score >= MIN_COMMENT_SCORE),
+        key=lambda line: -scores[line],
+    )
+    return set(ranked[:max_candidates])
+
+
+def _score_statement(node: ast.stmt, depth: int) -> float:
+    if isinstance(node, _TRIVIAL_STATEMENTS) or _is_trivial(node):
+        return 0.0
+    expressions = _get_own_expressions(node)
+    score = 0.5 * depth
+    if isinstance(node, ast.AugAssign) and isinstance(node.op, _BIT_OPERATORS):
+        score += 1.5
+    for expression in expressions:
+        for child in ast.walk(expression):
+            score += _score_expression(child)
+    # Large expressions are harder to read
+    num_nodes = sum(1 for expression in expressions for _ in ast.walk(expression))
+    return score + num_nodes / 10
+
+
+def _score_expression(node: ast.AST) -> float:
+    if isinstance(node, _COMPREHENSIONS):
+        return 2.0
+    if isinstance(node, ast.Lambda):
+        return 1.0
+    if isinstance(node, ast.BoolOp):
+        return 0.5 * (len(node.values) - 1)
+    if isinstance(node, (ast.BinOp, ast.UnaryOp)) and isinstance(
+        node.op, _BIT_OPERATORS
+    ):
+        return 1.5
+    if isinstance(node, ast.Slice) and node.step is not None:
+        return 1.0
+    if isinstance(node, ast.Call):
+        return _score_call(node)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return 0.0 if node.value in _PLAIN_NUMBERS else 1.5
+        if isinstance(node.value, str) and _REGEX_CHARS.search(node.value):
+            return 2.0
+    return 0.0
+
+
+def _score_call(node: ast.Call) -> float:
+    function = node.func
+    # `re.sub(...)` and the like
+    if (
+        isinstance(function, ast.Attribute)
+        and isinstance(function.value, ast.Name)
+        and function.value.id == "re"
+        and function.attr in _REGEX_FUNCTIONS
+    ):
+        return 2.0
+    # Chained calls, e.g. `a.b().c()`
+    if isinstance(function, ast.Attribute) and isinstance(function.value, ast.Call):
+        return 0.5
+    return 0.0
+
+
+def _is_trivial(node: ast.stmt) -> bool:
+    # `return x`, `return None`, `a = b`, `self.a = 1` and docstrings
+    if isinstance(node, ast.Return):
+        return node.value is None or _is_simple(node.value)
+    if isinstance(node, ast.Assign):
+        return _is_simple(node.value)
+    if isinstance(node, ast.AnnAssign):
+        return node.value is None or _is_simple(node.value)
+    if isinstance(node, ast.Expr):
+        return isinstance(node.value, ast.Constant)
+    return False
+
+
+def _is_simple(node: ast.expr) -> bool:
+    if isinstance(node, ast.Constant):
+        return not isinstance(node.value, (int, float)) or node.value in _PLAIN_NUMBERS
+    if isinstance(node, ast.Attribute):
+        return _is_simple(node.value)
+    return isinstance(node, ast.Name)
+
+
+def _get_own_expressions(node: ast.stmt) -> list[ast.AST]:
+    """Returns the expressions of the statement without the statements nested in it."""
+    return [
+        child
+        for child in ast.iter_child_nodes(node)
+        if not isinstance(child, _NESTED_BLOCKS)
+    ]
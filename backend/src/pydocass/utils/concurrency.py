@@ -0,0 +1,225 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
+
+
+class _OrderedMerge:
+    """
+    Orders the items produced concurrently by several sources as if the sources were chained:
+    the items of the first unfinished source are released as they arrive, while the items of
+    the following sources are buffered until all the sources before them are finished.
+    """
+
+    def __init__(self, num_sources: int):
+        self.num_sources = num_sources
+        self.current = 0
+        self._buffers = [[] for _ in range(num_sources)]
+        self._finished = [False] * num_sources
+
+    @property
+    def done(self) -> bool:
+        return self.current >= self.num_sources
+
+    def add(self, index: int, item: Any) -> list:
+        if index == self.current:
+            return [item]
+        self._buffers[index].append(item)
+        return []
+
+    def finish(self, index: int) -> list:
+        self._finished[index] = True
+        released = []
+        while not self.done and self._finished[self.current]:
+            self.current += 1
+            if not self.done:
+                released += self._buffers[self.current]
+                self._buffers[self.current] = []
+        return released
+
+
+def iterate_concurrently_in_order(
+    generator_functions: list[Callable[[], Iterator]], max_workers: int
+) -> Iterator:
+    """
+    Runs the generators in a thread pool and yields their items in the same order as
+    `itertools.chain` would. The exceptions raised by the generators are re-raised.
+
+    Args:
+        generator_functions (`list[Callable[[], Iterator]]`):
+            Functions without arguments that create the generators.
+        max_workers (`int`):
+            The maximum number of generators that run at the same time.
+
+    Returns:
+        `Iterator`:
+            The items of all the generators.
+    """
+    if len(generator_functions) <= 1 or max_workers <= 1:
+        for generator_function in generator_functions:
+            yield from generator_function()
+        return
+
+    merge = _OrderedMerge(len(generator_functions))
+    for index, is_finished, item in _run_in_threads(generator_functions, max_workers):
+        if not is_finished:
+            yield from merge.add(index, item)
+        else:
+            yield from merge.finish(index)
+
+
+def iterate_concurrently(
+    generator_functions: list[Callable[[], Iterator]], max_workers: int
+) -> Iterator[tuple[int, Any]]:
+    """
+    Runs the generators in a thread pool and yields their items as soon as they are produced,
+    together with the index of the generator. The exceptions raised by the generators are
+    re-raised.
+    """
+    if len(generator_functions) <= 1 or max_workers <= 1:
+        for index, generator_function in enumerate(generator_functions):
+            for item in generator_function():
+                yield index, item
+        return
+
+    for index, is_finished, item in _run_in_threads(generator_functions, max_workers):
+        if not is_finished:
+            yield index, item
+
+
+def _run_in_threads(
+    generator_functions: list[Callable[[], Iterator]], max_workers: int
+) -> Iterator[tuple[int, bool, Any]]:
+    """Yields `(index, False, item)` for the items and `(index, True, None)` when a generator ends."""
+    items = queue.Queue()
+    # Set when the consumer stops early, so that the remaining generators are closed
+    stop = threading.Event()
+
+    def run(index: int, generator_function: Callable[[], Iterator]) -> None:
+        try:
+            for item in generator_function():
+                if stop.is_set():
+                    break
+                items.put((index, False, item))
+        except Exception as e:
+            items.put((index, True, e))
+            return
+        items.put((index, True, None))
+
+    num_running = len(generator_functions)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for index, generator_function in enumerate(generator_functions):
+            executor.submit(run, index, generator_function)
+        while num_running:
+            index, is_finished, item = items.get()
+            if is_finished:
+                if item is not None:
+                    raise item
+                num_running -= 1
+            yield index, is_finished, item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiterate_concurrently_in_order(
+    generator_functions: list[Callable[[], AsyncIterator]], max_concurrency: int
+) -> AsyncIterator:
+    """Async version of `iterate_concurrently_in_order` running the generators as tasks."""
+    if len(generator_functions) <= 1 or max_concurrency <= 1:
+        for generator_function in generator_functions:
+            async for item in generator_function():
+                yield item
+        return
+
+    merge = _OrderedMerge(len(generator_functions))
+    async for index, is_finished, item in _run_as_tasks(
+        generator_functions, max_concurrency
+    ):
+        released_items = merge.finish(index) if is_finished else merge.add(index, item)
+        for released_item in released_items:
+            yield released_item
+
+
+async def aiterate_concurrently(
+    generator_functions: list[Callable[[], AsyncIterator]], max_concurrency: int
+) -> AsyncIterator[tuple[int, Any]]:
+    """Async version of `iterate_concurrently` running the generators as tasks."""
+    if len(generator_functions) <= 1 or max_concurrency <= 1:
+        for index, generator_function in enumerate(generator_functions):
+            async for item in generator_function():
+                yield index, item
+        return
+
+    async for index, is_finished, item in _run_as_tasks(
+        generator_functions, max_concurrency
+    ):
+        if not is_finished:
+            yield index, item
+
+
+async def _run_as_tasks(
+    generator_functions: list[Callable[[], AsyncIterator]], max_concurrency: int
+) -> AsyncIterator[tuple[int, bool, Any]]:
+    """Async version of `_run_in_threads`."""
+    items = asyncio.Queue()
+    # The semaphore is fair, so the generators are started in order
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(index: int, generator_function: Callable[[], AsyncIterator]) -> None:
+        try:
+            async with semaphore:
+                async for item in generator_function():
+                    items.put_nowait((index, False, item))
+        except Exception as e:
+            items.put_nowait((index, True, e))
+            return
+        items.put_nowait((index, True, None))
+
+    num_running = len(generator_functions)
+    tasks = [
+        asyncio.create_task(run(index, generator_function))
+        for index, generator_function in enumerate(generator_functions)
+    ]
+    try:
+        while num_running:
+            index, is_finished, item = await items.get()
+            if is_finished:
+                if item is not None:
+                    raise item
+                num_running -= 1
+            yield index, is_finished, item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class RequestLimiter:
+    """
+    Context manager limiting the number of LLM requests in flight across all threads of the
+    process. Without a limit it does nothing.
+    """
+
+    def __init__(self, max_requests: int | None = None):
+        self.set_limit(max_requests)
+
+    def set_limit(self, max_requests: int | None) -> None:
+        # Must only be changed while no requests are in flight
+        self.max_requests = max_requests
+        self._semaphore = (
+            threading.BoundedSemaphore(max_requests) if max_requests else None
+        )
+
+    def __enter__(self) -> "RequestLimiter":
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+LLM_REQUEST_LIMITER = RequestLimiter()
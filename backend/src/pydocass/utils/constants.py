@@ -40,5 +40,41 @@ BASE_URL = (
 )
 
 ANNOTATION_MAX_NUM_NODES_PER_MODEL = 15
+# Maximum number of the batches of nodes annotated at the same time
+ANNOTATION_MAX_CONCURRENT_BATCHES = 4
+
+# Modules with more lines to comment are split by their top-level functions and classes
+# into several requests for the comments, generated at the same time
+COMMENTS_MAX_LINES_PER_REQUEST = 150
+COMMENTS_MAX_CONCURRENT_REQUESTS = 4
+# Output formats of the comments: a field for each line, or the list of the commented lines only
+COMMENTS_FORMAT_LINES = "lines"
+COMMENTS_FORMAT_SPARSE = "sparse"
 
 FORBIDDEN_ARG_NAMES_IN_ANNOTATION = ["self", "cls", "model_config"]
+
+CACHE_MAX_ENTRIES = 10_000
+CACHE_MAX_DISK_BYTES = 512 * 1024 * 1024
+
+# Formats of the stream returned by the `/document` endpoint
+STREAM_FORMAT_SNAPSHOTS = "snapshots"
+STREAM_FORMAT_DELTAS = "deltas"
+
+# Pool of the LLM clients reused across the requests
+CLIENT_POOL_MAX_CLIENTS = 64
+CLIENT_POOL_IDLE_SECONDS = 600
+CLIENT_MAX_KEEPALIVE_CONNECTIONS = 20
+CLIENT_KEEPALIVE_EXPIRY_SECONDS = 120
+
+# Background writer of the database records
+RECORD_WRITER_BATCH_SIZE = 100
+RECORD_WRITER_FLUSH_INTERVAL_SECONDS = 1.0
+RECORD_WRITER_MAX_QUEUE_SIZE = 10_000
+# Spilled records retried with each batch, so that a long outage is caught up gradually
+RECORD_WRITER_MAX_SPILLED_PER_BATCH = 1_000
+
+# Modules longer than this number of tokens are split into segments documented in parallel.
+# The prompts contain the code about twice (as is and in the schema), which leaves room for
+# the system prompts and the outputs within `MAX_TOTAL_TOKENS` of the default model
+SEGMENT_MAX_TOKENS = 8_000
+SEGMENT_MAX_CONCURRENT = 4
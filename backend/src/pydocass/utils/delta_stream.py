@@ -0,0 +1,110 @@
+import hashlib
+import time
+from typing import Iterable, Iterator
+
+# Size of the blocks compared at once when looking for the common prefix / suffix
+_BLOCK_SIZE = 4096
+
+
+def iterate_deltas(snapshots: Iterable[str], initial_code: str) -> Iterator[dict]:
+    """
+    Converts the stream of the full code snapshots into the stream of edits. Each edit replaces
+    `delete_len` characters starting at `offset` of the previous snapshot with `insert_text`
+    (the offsets are in Unicode code points). The last event contains the SHA-256 `checksum`
+    and the `length` of the final code so that the client can verify the result.
+
+    Args:
+        snapshots (`Iterable[str]`):
+            The snapshots of the code, e.g. the outputs of `document_python_code`.
+        initial_code (`str`):
+            The code the first snapshot is compared to, i.e. the code the client sent.
+
+    Returns:
+        `Iterator[dict]`:
+            The edits `{"offset", "delete_len", "insert_text"}`, then `{"checksum", "length"}`.
+    """
+    code = initial_code
+    for snapshot in snapshots:
+        delta = compute_delta(code, snapshot)
+        if delta is not None:
+            yield delta
+        code = snapshot
+    yield {"checksum": get_checksum(code), "length": len(code)}
+
+
+def compute_delta(old: str, new: str) -> dict | None:
+    """Returns the single edit turning `old` into `new`, or `None` if they are equal."""
+    if old == new:
+        return None
+    prefix = _common_prefix_length(old, new)
+    # The suffix must not overlap with the prefix in either of the strings
+    max_suffix = min(len(old), len(new)) - prefix
+    suffix = _common_suffix_length(old, new, max_suffix)
+    return {
+        "offset": prefix,
+        "delete_len": len(old) - prefix - suffix,
+        "insert_text": new[prefix : len(new) - suffix],
+    }
+
+
+def apply_delta(code: str, delta: dict) -> str:
+    offset = delta["offset"]
+    return code[:offset] + delta["insert_text"] + code[offset + delta["delete_len"] :]
+
+
+def get_checksum(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def throttle_snapshots(snapshots: Iterable[str], min_interval: float) -> Iterator[str]:
+    """
+    Yields a snapshot only if at least `min_interval` seconds passed since the previous yielded
+    one. The last snapshot is always yielded.
+    """
+    if min_interval <= 0:
+        yield from snapshots
+        return
+
+    last_time = None
+    pending = None
+    for snapshot in snapshots:
+        now = time.monotonic()
+        if last_time is None or now - last_time >= min_interval:
+            yield snapshot
+            last_time = now
+            pending = None
+        else:
+            pending = snapshot
+    if pending is not None:
+        yield pending
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    start = 0
+    # Skip the equal blocks with the string comparison, which is much faster than a Python loop
+    while (
+        start < n and a[start : start + _BLOCK_SIZE] == b[start : start + _BLOCK_SIZE]
+    ):
+        start += _BLOCK_SIZE
+    end = min(start + _BLOCK_SIZE, n)
+    while start < end and a[start] == b[start]:
+        start += 1
+    return min(start, n)
+
+
+def _common_suffix_length(a: str, b: str, max_length: int) -> int:
+    length = 0
+    while length < max_length:
+        step = min(_BLOCK_SIZE, max_length - length)
+        if (
+            a[len(a) - length - step : len(a) - length]
+            != b[len(b) - length - step : len(b) - length]
+        ):
+            break
+        length += step
+    else:
+        return length
+    while length < max_length and a[len(a) - length - 1] == b[len(b) - length - 1]:
+        length += 1
+    return length
@@ -0,0 +1,101 @@
+from bisect import bisect_right, insort
+
+
+class EditBuffer:
+    """
+    Text buffer that records the edits against the coordinates of the original code.
+
+    The positions of the edits are given in the original code (e.g. from the AST parsed from
+    it), so the edits can be made in any order and never need to be adjusted for the
+    previous ones. The length changes of the edits are kept in a Fenwick tree indexed by the
+    original offsets where the edits end, which maps an original offset to the current one
+    in O(log n).
+    The current code is assembled lazily from the original code and the edits.
+
+    Several insertions at the same original offset are kept in the order they were made.
+    Replaced ranges must not overlap.
+    """
+
+    def __init__(self, code: str):
+        self.original = code
+        # Offset of the start of each line, 0-based
+        self._line_starts = [0]
+        for line in code.splitlines(keepends=True):
+            self._line_starts.append(self._line_starts[-1] + len(line))
+        # Sorted `(start, order, end, text)` with the original offsets of the replaced range
+        self._edits: list[tuple[int, int, int, str]] = []
+        # Fenwick tree of the length changes, indexed by the original end offsets + 1
+        self._tree = [0] * (len(code) + 2)
+        self._code: str | None = code
+
+    def offset(self, lineno: int, col_offset: int) -> int:
+        """
+        Converts the AST coordinates to an original offset. As in the AST, `lineno` is 1-based
+        and `col_offset` is the offset in the UTF-8 bytes of the line.
+        """
+        line = self.line(lineno)
+        if not line.isascii():
+            col_offset = len(line.encode()[:col_offset].decode())
+        return self._line_starts[lineno - 1] + col_offset
+
+    def line(self, lineno: int) -> str:
+        """Returns the original line `lineno` (1-based) without the line break."""
+        return self.original[
+            self._line_starts[lineno - 1] : self._line_starts[lineno]
+        ].rstrip("\r\n")
+
+    def insert(self, position: int, text: str) -> None:
+        self.replace(position, position, text)
+
+    def replace(self, start: int, end: int, text: str) -> None:
+        """Replaces `original[start:end]` with `text`."""
+        if not 0 <= start <= end <= len(self.original):
+            raise ValueError(f"Invalid range of the edit: ({start}, {end})")
+        index = bisect_right(self._edits, (start, len(self._edits) + 1))
+        previous_end = self._edits[index - 1][2] if index > 0 else 0
+        next_start = (
+            self._edits[index][0] if index < len(self._edits) else len(self.original)
+        )
+        if start < previous_end or (start < end and end > next_start):
+            raise ValueError(
+                f"The edit ({start}, {end}) overlaps with an edit that was already made"
+            )
+        insort(self._edits, (start, len(self._edits), end, text))
+        self._add_delta(end, len(text) - (end - start))
+        self._code = None
+
+    def current_offset(self, position: int) -> int:
+        """
+        Maps an original offset to the offset in the current code. The text inserted at
+        `position` is located before it, and the start of a replaced range is mapped to
+        the start of its replacement.
+        """
+        return position + self._prefix_delta(position)
+
+    @property
+    def code(self) -> str:
+        if self._code is None:
+            pieces = []
+            position = 0
+            for start, _, end, text in self._edits:
+                pieces.append(self.original[position:start])
+                pieces.append(text)
+                position = end
+            pieces.append(self.original[position:])
+            self._code = "".join(pieces)
+        return self._code
+
+    def _add_delta(self, position: int, delta: int) -> None:
+        index = position + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _prefix_delta(self, position: int) -> int:
+        # Sum of the deltas of the edits ending at the original offsets <= `position`
+        index = position + 1
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
@@ -0,0 +1,114 @@
+import ast
+import os
+import re
+import subprocess
+from typing import Union
+
+_HUNK_HEADER_PATTERN = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def get_changed_lines(path: str, base_ref: str) -> set[int] | None:
+    """
+    Finds the lines of the file that were added or modified since the git revision `base_ref`
+    (including the uncommitted changes).
+
+    Args:
+        path (`str`):
+            Path to the file inside a git repository.
+        base_ref (`str`):
+            The revision to compare with, e.g. `origin/main` or `HEAD~1`.
+
+    Returns:
+        `set[int] | None`:
+            The 1-based numbers of the changed lines in the current file, or `None` if the file
+            is not tracked in `base_ref` (then the whole file is new).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_name = os.path.basename(path)
+    if not _is_tracked_in(file_name, base_ref, directory):
+        return None
+    diff = subprocess.run(
+        ["git", "diff", "--unified=0", "--no-color", base_ref, "--", file_name],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return parse_changed_lines(diff)
+
+
+def parse_changed_lines(diff: str) -> set[int]:
+    """Collects the changed lines of the new file from the hunk headers of a unified diff."""
+    changed_lines = set()
+    for line in diff.splitlines():
+        if (match := _HUNK_HEADER_PATTERN.match(line)) is None:
+            continue
+        start = int(match.group(1))
+        length = 1 if match.group(2) is None else int(match.group(2))
+        if length == 0:
+            # Only removed lines: the hunk starts after line `start`, so mark the lines around
+            changed_lines.update((start, start + 1))
+        else:
+            changed_lines.update(range(start, start + length))
+    return changed_lines
+
+
+def get_changed_node_names(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    changed_lines: set[int],
+) -> set[str]:
+    """
+    Selects the functions, classes and methods that contain any of the changed lines. A class
+    is selected only if the changed lines are outside of its methods.
+    """
+    return {
+        node_name
+        for node_name, node_lines in _get_own_lines(target_nodes_dict).items()
+        if not node_lines.isdisjoint(changed_lines)
+    }
+
+
+def get_node_lines(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+    node_names: set[str],
+) -> set[int]:
+    """Returns the 1-based numbers of the lines that belong to the nodes `node_names`."""
+    own_lines = _get_own_lines(target_nodes_dict)
+    return set().union(*(own_lines[name] for name in node_names if name in own_lines))
+
+
+def _get_own_lines(
+    target_nodes_dict: dict[
+        str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+    ],
+) -> dict[str, set[int]]:
+    # The lines of a class without the lines of its methods, which are separate nodes
+    own_lines = {
+        node_name: _get_node_span(node)
+        for node_name, (node, _) in target_nodes_dict.items()
+    }
+    for node_name, (_, node_type) in target_nodes_dict.items():
+        if node_type == "method":
+            class_name = node_name.split("-")[0]
+            own_lines[class_name] -= own_lines[node_name]
+    return own_lines
+
+
+def _get_node_span(
+    node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
+) -> set[int]:
+    first_lineno = min([node.lineno] + [x.lineno for x in node.decorator_list])
+    return set(range(first_lineno, node.end_lineno + 1))
+
+
+def _is_tracked_in(file_name: str, base_ref: str, directory: str) -> bool:
+    result = subprocess.run(
+        ["git", "cat-file", "-e", f"{base_ref}:./{file_name}"],
+        cwd=directory,
+        capture_output=True,
+    )
+    return result.returncode == 0
@@ -1,11 +1,19 @@
+import functools
+import re
 from typing import Literal
 
-from ..constants import DEFAULT_INDENTATION_TYPE, INDENTATION_2_SPACE, INDENTATION_4_SPACE, INDENTATION_TAB, INDENTATION_INCONSISTENT, INDENTATION_MAP
+from ..constants import INDENTATION_2_SPACE, INDENTATION_TAB, INDENTATION_INCONSISTENT
+
+# The indentation of the lines that has a character other than the one of the target type
+_INDENT_WITH_TAB = re.compile(r"^ *\t[ \t]*", re.MULTILINE)
+_INDENT_WITH_SPACE = re.compile(r"^\t* [ \t]*", re.MULTILINE)
+_SPACES = re.compile(r" +")
 
 
 def align_indentation(code: str, indent_type: Literal["2-space", "4-space", "tab", "inconsistent"]) -> str:
    """
-   Aligns the indentation of source code to the specified type.
+   Aligns the indentation of source code to the specified type. Only the leading whitespace
+   of the lines is changed, and the code is returned as is if no line deviates from the type.
 
    Args:
        code: Source code string
@@ -17,70 +25,39 @@ def align_indentation(code: str, indent_type: Literal["2-space", "4-space", "tab
    if indent_type == INDENTATION_INCONSISTENT:
        indent_type = INDENTATION_TAB
 
-   lines = code.splitlines(keepends=True)
-   result = []
-   
-   target_indent = INDENTATION_MAP[indent_type]
-   
-   # Track if we're inside a multi-line string
-   in_triple_single = False
-   in_triple_double = False
-  
-   for line in lines:
-    # TODO: Maybe remove fixing within quotes
-    #    # Check for triple quotes
-    #    if '"""' in line:
-    #        in_triple_double ^= (line.count('"""') % 2 == 1)
-    #    elif "'''" in line:
-    #        in_triple_single ^= (line.count("'''") % 2 == 1)
-       
-    #    # Skip lines inside multi-line strings or single-line triple-quoted strings
-    #    if in_triple_single or in_triple_double:
-    #        result.append(line)
-    #        continue
-           
-    #    stripped = line.strip()
-    #    if (stripped.startswith(('"""', "'''")) and 
-    #        stripped.endswith(('"""', "'''")) and len(stripped) > 6):
-    #        result.append(line)
-    #        continue
-       
-       # Process indentation
-       if indent_type == INDENTATION_TAB:
-           # Replace all leading spaces with tabs
-           indent = ""
-           content = ""
-           space_count = 0
-           
-           for char in line:
-               if char == ' ':
-                   space_count += 1
-               elif char == '\t':
-                   # Convert accumulated spaces to tabs if any
-                   indent += '\t' * (space_count // 4)
-                   if space_count % 4 >= 2:
-                       indent += '\t'
-                   space_count = 0
-                   indent += '\t'
-               else:
-                   # Convert final spaces to tabs
-                   indent += '\t' * (space_count // 4)
-                   if space_count % 4 >= 2:
-                       indent += '\t'
-                   content = line[len(indent) + space_count:]
-                   break
-           
-           new_line = indent + content
-       else:
-           # Replace only tabs with spaces (2 or 4)
-           space_per_tab = 2 if indent_type == INDENTATION_2_SPACE else 4
-           new_line = ""
-           for char in line:
-               if char == '\t':
-                   new_line += ' ' * space_per_tab
-               else:
-                   new_line += char
-       
-       result.append(new_line)
-
-   return ''.join(result)
+   if indent_type == INDENTATION_TAB:
+       pattern, replace = _INDENT_WITH_SPACE, _indent_to_tabs
+   else:
+       pattern = _INDENT_WITH_TAB
+       replace = functools.partial(
+           _indent_to_spaces, num_spaces=2 if indent_type == INDENTATION_2_SPACE else 4
+       )
+
+   # Most of the time the components keep the indentation of the code, so nothing is rebuilt
+   if pattern.search(code) is None:
+       return code
+   return pattern.sub(replace, code)
+
+
+def _indent_to_tabs(match: re.Match) -> str:
+   return _convert_indent_to_tabs(match.group())
+
+
+@functools.cache
+def _convert_indent_to_tabs(indent: str) -> str:
+   # Each run of spaces becomes a tab per 4 spaces, rounding 2 or 3 spaces up
+   return _SPACES.sub(_spaces_to_tabs, indent)
+
+
+def _spaces_to_tabs(match: re.Match) -> str:
+   num_spaces = len(match.group())
+   return "\t" * (num_spaces // 4 + (num_spaces % 4 >= 2))
+
+
+def _indent_to_spaces(match: re.Match, num_spaces: int) -> str:
+   return _convert_indent_to_spaces(match.group(), num_spaces)
+
+
+@functools.cache
+def _convert_indent_to_spaces(indent: str, num_spaces: int) -> str:
+   return indent.replace("\t", " " * num_spaces)
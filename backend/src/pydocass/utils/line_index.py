@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import io
+import tokenize
+from typing import Callable
+
+# Tokens that carry no code
+_LAYOUT_TOKENS = frozenset(
+    {
+        tokenize.COMMENT,
+        tokenize.NL,
+        tokenize.NEWLINE,
+        tokenize.INDENT,
+        tokenize.DEDENT,
+        tokenize.ENDMARKER,
+        tokenize.ENCODING,
+    }
+)
+_BARE_DOCSTRING_QUOTES = ('"""', "'''")
+
+
+class LineIndex:
+    """
+    Classification of the lines of the code, made in one pass of `tokenize`.
+
+    The code lines are the lines that start with a token of code, i.e. not a comment, not
+    a blank line and not a line starting inside a multi-line string or after a backslash
+    continuation. Only they can get a comment: one inserted above any other line would end
+    up inside a string or break the statement. The lines with the bare quotes that open
+    docstrings are not code lines either.
+
+    All the line indices are 0-based and all the columns are character offsets. The code
+    that `tokenize` rejects, e.g. with inconsistent indentation, is classified line by line
+    with the quotes tracked heuristically.
+    """
+
+    def __init__(self, code: str):
+        self.lines = code.splitlines()
+        # Indices of the code lines in order
+        self.code_lines: list[int] = []
+        # Indices of the lines holding only a comment
+        self.comment_lines: list[int] = []
+        # Column of the `#` of the comment that follows the code of a line
+        self.inline_comments: dict[int, int] = {}
+        # The first and the last line of each multi-line string
+        self.string_spans: list[tuple[int, int]] = []
+        # The comment lines directly above each code line, possibly with blank lines between
+        self.comment_lines_above: dict[int, list[int]] = {}
+        try:
+            is_code_line = self._scan_tokens(code)
+        except (tokenize.TokenError, SyntaxError):
+            self.comment_lines, self.inline_comments, self.string_spans = [], {}, []
+            is_code_line = self._scan_lines()
+
+        comment_lines = set(self.comment_lines)
+        pending_comment_lines = []
+        for i, line in enumerate(self.lines):
+            if i in comment_lines:
+                pending_comment_lines.append(i)
+            elif is_code_line(i):
+                self.code_lines.append(i)
+                self.comment_lines_above[i] = pending_comment_lines
+                pending_comment_lines = []
+            elif line.strip():
+                # The comments above a string or a continued statement don't belong to
+                # the next code line
+                pending_comment_lines = []
+
+    def _scan_tokens(self, code: str) -> Callable[[int], bool]:
+        # Column of the first token of code starting on each line
+        first_token_columns = {}
+        # Lines whose line break ends a logical or a bracketed line, unlike a backslash
+        terminated_lines = set()
+        last_code_end_line = -1
+        tokens = tokenize.generate_tokens(io.StringIO(code).readline)
+        for token_type, _, (start_line, start_column), (end_line, _), _ in tokens:
+            start_line, end_line = start_line - 1, end_line - 1
+            if token_type in (tokenize.NEWLINE, tokenize.NL):
+                terminated_lines.add(start_line)
+            elif token_type == tokenize.COMMENT:
+                if last_code_end_line == start_line:
+                    self.inline_comments[start_line] = start_column
+                else:
+                    self.comment_lines.append(start_line)
+            elif token_type not in _LAYOUT_TOKENS:
+                first_token_columns.setdefault(start_line, start_column)
+                last_code_end_line = end_line
+                if token_type == tokenize.STRING and end_line > start_line:
+                    self.string_spans.append((start_line, end_line))
+
+        def is_code_line(i: int) -> bool:
+            line = self.lines[i]
+            stripped = line.strip()
+            return (
+                first_token_columns.get(i) == len(line) - len(line.lstrip())
+                and (i == 0 or i - 1 in terminated_lines)
+                and stripped not in _BARE_DOCSTRING_QUOTES
+            )
+
+        return is_code_line
+
+    def _scan_lines(self) -> Callable[[int], bool]:
+        # Only the docstrings opened and closed by bare quotes are recognized
+        code_lines = set()
+        docstring_quotes = None
+        for i, line in enumerate(self.lines):
+            stripped = line.strip()
+            if stripped in _BARE_DOCSTRING_QUOTES:
+                if docstring_quotes is None:
+                    docstring_quotes = stripped
+                elif docstring_quotes == stripped:
+                    docstring_quotes = None
+            elif docstring_quotes is not None or not stripped:
+                continue
+            elif stripped.startswith("#"):
+                self.comment_lines.append(i)
+            else:
+                code_lines.add(i)
+                if (column := _find_inline_comment(line)) is not None:
+                    self.inline_comments[i] = column
+        return code_lines.__contains__
+
+    def code_without_comment(self, i: int) -> str:
+        """Returns the line `i` without its inline comment."""
+        line = self.lines[i]
+        if i in self.inline_comments:
+            return line[: self.inline_comments[i]].rstrip()
+        return line.rstrip()
+
+    def comment_text(self, i: int) -> str:
+        """Returns the text of the comment of the line `i` after the `#`."""
+        line = self.lines[i]
+        if i in self.inline_comments:
+            return line[self.inline_comments[i] + 1 :].strip()
+        return line[line.find("#") + 1 :].strip()
+
+
+def _find_inline_comment(line: str) -> int | None:
+    # The column of the `#` outside of the quotes, if any
+    quote = None
+    escaped = False
+    for i, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "#":
+            return i
+    return None
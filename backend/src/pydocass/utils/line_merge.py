@@ -0,0 +1,109 @@
+# Number of equal lines after which two versions are considered in sync again
+_SYNC_LINES = 3
+
+
+def merge_line_edits(base: str, first: str, second: str) -> str | None:
+    """
+    Three-way merge of two edited versions of the code on the line level. The edits of
+    `first` and `second` relative to `base` are combined if they touch different lines.
+    Insertions at the same place are kept in order: those of `first` go first.
+
+    Args:
+        base (`str`):
+            The code both versions were edited from.
+        first (`str`):
+            The first edited version, e.g. with the docstrings added.
+        second (`str`):
+            The second edited version, e.g. with the comments added.
+
+    Returns:
+        `str | None`:
+            The code with the edits of both versions, or `None` if they conflict.
+    """
+    base_lines = base.splitlines()
+    # (start, end, side, new lines): the lines `start:end` of the base are replaced
+    hunks = []
+    for side, edited in enumerate((first, second)):
+        edited_lines = edited.splitlines()
+        for i1, i2, j1, j2 in _diff_lines(base_lines, edited_lines):
+            hunks.append((i1, i2, side, edited_lines[j1:j2]))
+    # At the same line, the insertions go before the replacements
+    hunks.sort(key=lambda hunk: (hunk[0], hunk[1] > hunk[0], hunk[2]))
+
+    merged_lines = []
+    position = 0
+    for start, end, _, new_lines in hunks:
+        if start < position:
+            return None
+        merged_lines.extend(base_lines[position:start])
+        merged_lines.extend(new_lines)
+        position = end
+    merged_lines.extend(base_lines[position:])
+    merged = "\n".join(merged_lines)
+    # The line break at the end of the file is kept as in the second version
+    if second.endswith("\n"):
+        merged += "\n"
+    return merged
+
+
+def _diff_lines(a: list[str], b: list[str]) -> list[tuple[int, int, int, int]]:
+    """
+    Finds the changed blocks `(i1, i2, j1, j2)`: the lines `a[i1:i2]` are replaced by `b[j1:j2]`.
+    The edits are expected to be few and small, so after each difference the closest point where
+    `_SYNC_LINES` lines are equal again is searched for. This takes linear time on such inputs,
+    unlike `difflib`, which is quadratic on the code with many repeated lines.
+    """
+    blocks = []
+    i, j = 0, 0
+    n, m = len(a), len(b)
+    while i < n or j < m:
+        if i < n and j < m and a[i] == b[j]:
+            i += 1
+            j += 1
+            continue
+        di, dj = _find_sync_point(a, b, i, j)
+        blocks.extend(_split_insertions(a, b, (i, i + di, j, j + dj)))
+        i, j = i + di, j + dj
+    return blocks
+
+
+def _split_insertions(
+    a: list[str], b: list[str], block: tuple[int, int, int, int]
+) -> list[tuple[int, int, int, int]]:
+    # The lines inserted close to each other, e.g. the comments above a function and above
+    # its first statement, make one block replacing the lines between them. If these lines
+    # are all kept in order, the block is split into the insertions around them, so that
+    # it does not overlap the edits of the other version in between, e.g. a docstring
+    i1, i2, j1, j2 = block
+    if i1 == i2 or j2 - j1 <= i2 - i1:
+        return [block]
+    matches = []
+    j = j1
+    for i in range(i1, i2):
+        while j < j2 and b[j] != a[i]:
+            j += 1
+        if j == j2:
+            return [block]
+        matches.append(j)
+        j += 1
+    blocks = []
+    j = j1
+    for i, match in zip(range(i1, i2), matches):
+        if match > j:
+            blocks.append((i, i, j, match))
+        j = match + 1
+    if j < j2:
+        blocks.append((i2, i2, j, j2))
+    return blocks
+
+
+def _find_sync_point(a: list[str], b: list[str], i: int, j: int) -> tuple[int, int]:
+    # The closest point by the total number of skipped lines, preferring the insertions.
+    # The ends of both lists always match, so the loop returns
+    n, m = len(a), len(b)
+    for distance in range(1, n - i + m - j + 1):
+        for di in range(max(0, distance - (m - j)), min(distance, n - i) + 1):
+            dj = distance - di
+            if a[i + di : i + di + _SYNC_LINES] == b[j + dj : j + dj + _SYNC_LINES]:
+                return di, dj
+    return n - i, m - j
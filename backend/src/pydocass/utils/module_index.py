@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import ast
+from typing import Union
+
+from .utils import find_duplicated_names
+
+_DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+class ModuleIndex:
+    """
+    The structure of a module, collected in one traversal of its top-level statements and the
+    bodies of its classes and shared by the stages of the pipeline instead of parsing the code
+    again.
+
+    All the spans are the 1-based first and last lines. The index follows the edits made with
+    `replace_lines`, which shift the nodes below the edit instead of parsing the code again.
+    The statements inserted this way are not added to the tree.
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.tree = ast.parse(code)
+        # Offset of the start of each line, 0-based, and of the end of the code
+        self.line_starts = [0]
+        for line in code.splitlines(keepends=True):
+            self.line_starts.append(self.line_starts[-1] + len(line))
+        # The functions, classes and methods to document, as in
+        # `get_nodes_dict_with_functions_classes_methods`
+        self.target_nodes: dict[
+            str, tuple[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef], str]
+        ] = {}
+        # The descriptions of the duplicated functions, classes and methods
+        self.duplicates: list[str] = []
+        # The names imported with `from typing import` and the span of the first such import
+        self.typing_imports: set[str] = set()
+        self.typing_import_span: tuple[int, int] | None = None
+        # The spans of the target nodes with their decorators, of their signatures (up to the
+        # line before the body) and of their existing docstrings
+        self.node_spans: dict[str, tuple[int, int]] = {}
+        self.signature_spans: dict[str, tuple[int, int]] = {}
+        self.docstring_spans: dict[str, tuple[int, int]] = {}
+        # The spans of the top-level functions and classes in order
+        self.scope_spans: list[tuple[int, int]] = []
+
+        functions_names, classes_names, classes_methods_names = [], [], []
+        for node in self.tree.body:
+            if isinstance(node, ast.ImportFrom) and node.module == "typing":
+                if self.typing_import_span is None:
+                    self.typing_import_span = (node.lineno, node.end_lineno)
+                self.typing_imports.update(name.name for name in node.names)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions_names.append(node.name)
+                self.target_nodes[node.name] = (node, "function")
+            elif isinstance(node, ast.ClassDef):
+                classes_names.append(node.name)
+                self.target_nodes[node.name] = (node, "class")
+                methods_names = []
+                for subnode in node.body:
+                    if isinstance(subnode, _DEFINITIONS):
+                        self.target_nodes[node.name + "-" + subnode.name] = (
+                            subnode,
+                            "method",
+                        )
+                    if isinstance(subnode, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        methods_names.append(subnode.name)
+                classes_methods_names.append((node.name, methods_names))
+        self.duplicates = find_duplicated_names(
+            functions_names, classes_names, classes_methods_names
+        )
+        self._index_spans()
+
+    def check_no_duplicates(self) -> None:
+        """Raises a `ValueError` describing the first duplicated name, if any."""
+        if self.duplicates:
+            raise ValueError(self.duplicates[0])
+
+    def replace_lines(self, start: int, end: int, new_lines: list[str]) -> str:
+        """
+        Replaces the lines `[start, end)` (0-based) of the code with `new_lines` and shifts the
+        statements located below them. The replaced lines must not be a part of a statement
+        that goes on after them.
+
+        Returns:
+            `str`: The new code.
+        """
+        offset_start, offset_end = self.line_starts[start], self.line_starts[end]
+        text = "".join(line + "\n" for line in new_lines)
+        if offset_end == len(self.code) and not self.code.endswith("\n"):
+            text = text[:-1]
+        self.code = self.code[:offset_start] + text + self.code[offset_end:]
+        # The offsets of the lines below the edit move by the length change
+        new_starts = [offset_start]
+        for line in text.splitlines(keepends=True):
+            new_starts.append(new_starts[-1] + len(line))
+        length_change = len(text) - (offset_end - offset_start)
+        self.line_starts = (
+            self.line_starts[:start]
+            + new_starts[:-1]
+            + [x + length_change for x in self.line_starts[end:]]
+        )
+
+        if num_added_lines := len(new_lines) - (end - start):
+            for node in self.tree.body:
+                if _get_first_lineno(node) > end:
+                    ast.increment_lineno(node, num_added_lines)
+            if self.typing_import_span is not None and self.typing_import_span[0] > end:
+                self.typing_import_span = tuple(
+                    x + num_added_lines for x in self.typing_import_span
+                )
+            self._index_spans()
+        return self.code
+
+    def _index_spans(self) -> None:
+        self.node_spans, self.signature_spans, self.docstring_spans = {}, {}, {}
+        self.scope_spans = []
+        for node_name, (node, node_type) in self.target_nodes.items():
+            self.node_spans[node_name] = (_get_first_lineno(node), node.end_lineno)
+            if node_type != "method":
+                self.scope_spans.append(self.node_spans[node_name])
+            first_statement = node.body[0]
+            self.signature_spans[node_name] = (
+                node.lineno,
+                max(node.lineno, first_statement.lineno - 1),
+            )
+            if (
+                isinstance(first_statement, ast.Expr)
+                and isinstance(first_statement.value, ast.Constant)
+                and isinstance(first_statement.value.value, str)
+            ):
+                self.docstring_spans[node_name] = (
+                    first_statement.lineno,
+                    first_statement.end_lineno,
+                )
+
+
+def _get_first_lineno(node: ast.stmt) -> int:
+    # The decorators are a part of the node
+    return min([node.lineno] + [x.lineno for x in getattr(node, "decorator_list", [])])
@@ -10,6 +10,21 @@ Json schema:
 ```
 """.strip()
 
+# Prompt of the sparse comments format: the lines to comment are numbered in the code
+USER_PROMPT_SPARSE_COMMENTS = """
+Input code:
+```
+{code}
+```
+""".strip()
+
+SPARSE_COMMENTS_INSTRUCTION = (
+    "\n\nOnly the lines numbered as `N. code` can be commented. Return the JSON object "
+    '`{"comments": [{"line": N, "comment": "..."}]}` listing only the lines that need a '
+    "comment, in the order of the lines. If a line already has a comment that is still "
+    "correct, list it with this comment to keep it."
+)
+
 MESSAGES_ARGUMENTS_ANNOTATION = [
     {
         "role": "system",
@@ -210,21 +225,17 @@ MESSAGES_COMMENTS = [
     },
 ]
 
-MESSAGES_FIX_ANNOTATION = [
+MESSAGES_FIX_ANNOTATIONS = [
     {
         "role": "system",
-        "content": 'Act as an experienced Python specialist.\n\nYou will be provided with a "broken" argument annotation in Python, which was written by our junior developer. Kindly fix this annotation. Output only the fixed annotation and nothing more. Your output will be directly inserted into the code and parsed with `ast`, so don\'t output anything else besides tha fixed annotation.',
+        "content": 'Act as an experienced Python specialist.\n\nYou will be provided with a JSON schema whose fields describe "broken" argument annotations in Python, which were written by our junior developer. Kindly fix these annotations: the value of each field must be the fixed annotation from its description. Output only the fixed annotations and nothing more. Your output will be directly inserted into the code and parsed with `ast`, so don\'t output anything else besides the fixed annotations.',
     },
-    {"role": "user", "content": "Union[str, List[Union[int, str, List[Any]]]"},
-    {"role": "assistant", "content": "Union[str, List[Union[int, str, List[Any]]]]"},
     {
         "role": "user",
-        "content": "tuple[ type[BaseModel], dict[ str, tuple[ Union[ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef], dict[ str, tuple[ Union[ast.arg, ast.AnnAssign, ast.Assign, ast.Constant, None], str | None, ] | tuple[Union[ast.arg, ast.AnnAssign, ast.Assign], str | None, str]",
+        "content": 'Json schema:\n```\n{"annotation1": {"description": "Broken annotation: Union[str, List[Union[int, str, List[Any]]]"}, "annotation2": {"description": "Broken annotation: Optional["}, "annotation3": {"description": "Broken annotation: integer number"}}\n```',
     },
     {
         "role": "assistant",
-        "content": "tuple[ type[BaseModel], dict[ str, tuple[ Union[ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef], dict[ str, tuple[ Union[ast.arg, ast.AnnAssign, ast.Assign, ast.Constant, None], str | None, ] | tuple[Union[ast.arg, ast.AnnAssign, ast.Assign], str | None, str]]]]]",
+        "content": '{"annotation1": "Union[str, List[Union[int, str, List[Any]]]]", "annotation2": "Optional[Any]", "annotation3": "int"}',
     },
-    {"role": "user", "content": "integer"},
-    {"role": "assistant", "content": "int"},
 ]
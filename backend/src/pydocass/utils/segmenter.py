@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import ast
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
+
+# Separates the shared header from the segment in the code sent to the LLM
+SEGMENT_SENTINEL = "__pydocass_segment__ = None"
+# Assignments longer than this are shortened to `name = ...` in the header
+_MAX_HEADER_LINE_LENGTH = 120
+
+
+def split_module(
+    code: str,
+    tokenizer: PreTrainedTokenizerFast,
+    max_tokens: int | None,
+    max_definitions: int | None = None,
+    tree: ast.Module | None = None,
+) -> tuple[str, list[tuple[int, int]]]:
+    """
+    Cuts the module at the boundaries of its top-level statements into segments of at most
+    `max_tokens` tokens (together with the header) and at most `max_definitions` top-level
+    functions and classes. A statement larger than that, e.g. a huge class, makes a segment
+    of its own.
+
+    Args:
+        code (`str`):
+            The code of the module.
+        tokenizer (`PreTrainedTokenizerFast`):
+            The tokenizer used to count the tokens.
+        max_tokens (`int | None`):
+            The maximum number of tokens of a segment with the header, None for no limit.
+        max_definitions (`int | None`, *optional*):
+            The maximum number of functions and classes in a segment, None for no limit.
+        tree (`ast.Module | None`, *optional*):
+            The parsed code, if it is already available.
+
+    Returns:
+        `tuple[str, list[tuple[int, int]]]`:
+            The header shared by the segments and the 0-based ranges `[start, end)` of the lines
+            of each segment. The ranges cover all the lines of the module.
+    """
+    if tree is None:
+        tree = ast.parse(code)
+    lines = code.splitlines(keepends=True)
+    header = get_module_header(tree, lines)
+    budget = None
+    if max_tokens is not None:
+        budget = max_tokens - len(tokenizer.tokenize(header))
+
+    ranges = []
+    segment_start, segment_tokens, segment_definitions = 0, 0, 0
+    unit_start = 0
+    for i, node in enumerate(tree.body):
+        # The comments and decorators before a statement stay with it
+        unit_end = len(lines) if i == len(tree.body) - 1 else node.end_lineno
+        unit_tokens = 0
+        if budget is not None:
+            unit_tokens = len(tokenizer.tokenize("".join(lines[unit_start:unit_end])))
+        is_definition = isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+        )
+        if (
+            budget is not None
+            and segment_tokens
+            and segment_tokens + unit_tokens > budget
+        ) or (
+            max_definitions is not None
+            and is_definition
+            and segment_definitions == max_definitions
+        ):
+            ranges.append((segment_start, unit_start))
+            segment_start, segment_tokens, segment_definitions = unit_start, 0, 0
+        segment_tokens += unit_tokens
+        segment_definitions += is_definition
+        unit_start = unit_end
+    ranges.append((segment_start, len(lines)))
+    return header, ranges
+
+
+def get_module_header(tree: ast.Module, lines: list[str]) -> str:
+    """
+    Builds a compact context shared by the segments: the imports and the module-level
+    assignments of the module, and the names of its functions and classes.
+    """
+    header_lines = []
+    definitions = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions.append(node.name)
+            continue
+        if not isinstance(
+            node, (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign)
+        ):
+            continue
+        source = "".join(lines[node.lineno - 1 : node.end_lineno]).strip()
+        if isinstance(node, (ast.Assign, ast.AnnAssign)) and (
+            "\n" in source or len(source) > _MAX_HEADER_LINE_LENGTH
+        ):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            source = " = ".join(ast.unparse(target) for target in targets) + " = ..."
+        header_lines.append(source)
+    if definitions:
+        header_lines.append(
+            "# Defined in the other parts of the module: " + ", ".join(definitions)
+        )
+    return "".join(line + "\n" for line in header_lines)
+
+
+def make_segment_code(header: str, segment: str) -> str:
+    return header + SEGMENT_SENTINEL + "\n" + segment
+
+
+def extract_segment(segment_code: str) -> str:
+    """Returns the part of the code made by `make_segment_code` that follows the header."""
+    lines = segment_code.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith(SEGMENT_SENTINEL):
+            return "".join(lines[i + 1 :])
+    return segment_code
+
+
+def get_segment_body_lines(segment_code: str) -> set[int] | None:
+    """
+    Returns the 1-based numbers of the lines of the code made by `make_segment_code` that
+    follow the header, or None if the code has no header.
+    """
+    lines = segment_code.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith(SEGMENT_SENTINEL):
+            return set(range(i + 2, len(lines) + 1))
+    return None
+
+
+def join_segments(segments: list[str]) -> str:
+    # The documented segments may have lost their trailing line breaks
+    return "".join(
+        segment if segment.endswith("\n") or i == len(segments) - 1 else segment + "\n"
+        for i, segment in enumerate(segments)
+    )
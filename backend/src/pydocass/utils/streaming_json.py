@@ -0,0 +1,223 @@
+import json
+import logging
+import re
+from typing import Any, NamedTuple
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = frozenset(" \t\n\r")
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_LITERALS = {"true": True, "false": False, "null": None}
+# Characters that need attention inside a JSON string: the closing quote and escapes
+_STRING_SPECIAL_CHARS = re.compile(r'[\\"]')
+
+# Parser states
+_EXPECT_ROOT = 0
+_EXPECT_KEY_OR_END = 1
+_EXPECT_COLON = 2
+_EXPECT_VALUE = 3
+_EXPECT_COMMA_OR_END = 4
+_IN_STRING = 5
+_IN_NUMBER = 6
+_IN_LITERAL = 7
+_DONE = 8
+
+
+class JSONEvent(NamedTuple):
+    # Keys (for objects) and indices (for arrays) leading to the value, e.g.
+    # `("FunctionFoo", "arg1")` for `{"FunctionFoo": {"arg1": "int"}}`
+    path: tuple[str | int, ...]
+    value: Any
+
+
+class StreamingJSONParser:
+    """
+    Incremental JSON parser for the structured outputs streamed by the LLM.
+
+    The generated text is pushed chunk by chunk with `feed`, and every value that got
+    completed by the chunk is reported as a `JSONEvent`, including the objects and
+    arrays once they are closed. The parser keeps its state between the calls, so the
+    cost of each call is proportional to the size of the chunk, not to the size of the
+    output generated so far.
+
+    Any text before the root object (e.g. a markdown fence) is skipped. If the output
+    turns out to be malformed, the parser stops reporting events and sets `failed`.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.failed = False
+        self._state = _EXPECT_ROOT
+        # Each frame is `[container, current key or index, is_object]`
+        self._stack: list[list] = []
+        # Raw pieces of a string / number / literal that spans several chunks
+        self._pending: list[str] = []
+        self._string_is_key = False
+        self._escape_pending = False
+
+    def feed(self, delta: str) -> list[JSONEvent]:
+        events = []
+        if self.done or self.failed or not delta:
+            return events
+        try:
+            self._parse(delta, events)
+        except ValueError as e:
+            log.warning("Stopped parsing the streamed JSON output: %s", e)
+            self.failed = True
+        return events
+
+    def _parse(self, text: str, events: list[JSONEvent]) -> None:
+        pos = 0
+        length = len(text)
+        while pos < length:
+            state = self._state
+            if state == _IN_STRING:
+                end = self._find_string_end(text, pos)
+                if end is None:
+                    self._pending.append(text[pos:])
+                    return
+                self._pending.append(text[pos:end])
+                value = json.loads("".join(self._pending))
+                self._pending = []
+                pos = end
+                if self._string_is_key:
+                    self._stack[-1][1] = value
+                    self._state = _EXPECT_COLON
+                else:
+                    self._add_value(value, events)
+                continue
+            if state == _IN_NUMBER:
+                start = pos
+                while pos < length and text[pos] in _NUMBER_CHARS:
+                    pos += 1
+                self._pending.append(text[start:pos])
+                if pos == length:
+                    # The number may continue in the next chunk
+                    return
+                self._add_value(json.loads("".join(self._pending)), events)
+                self._pending = []
+                continue
+            if state == _IN_LITERAL:
+                start = pos
+                while pos < length and text[pos].isalpha():
+                    pos += 1
+                self._pending.append(text[start:pos])
+                literal = "".join(self._pending)
+                if pos == length and any(x.startswith(literal) for x in _LITERALS):
+                    return
+                if literal not in _LITERALS:
+                    raise ValueError(f"Unexpected literal `{literal}`")
+                self._pending = []
+                self._add_value(_LITERALS[literal], events)
+                continue
+
+            char = text[pos]
+            pos += 1
+            if char in _WHITESPACE:
+                continue
+            if state == _EXPECT_ROOT:
+                # Skip anything preceding the JSON itself
+                if char in "{[":
+                    self._open_container(char)
+            elif state == _EXPECT_KEY_OR_END:
+                if char == '"':
+                    self._start_string(is_key=True, char=char)
+                elif char == "}":
+                    self._close_container(events)
+                else:
+                    raise ValueError(f"Expected an object key, got `{char}`")
+            elif state == _EXPECT_COLON:
+                if char != ":":
+                    raise ValueError(f"Expected `:`, got `{char}`")
+                self._state = _EXPECT_VALUE
+            elif state == _EXPECT_VALUE:
+                if char == '"':
+                    self._start_string(is_key=False, char=char)
+                elif char in "{[":
+                    self._open_container(char)
+                elif char == "]" and not self._stack[-1][2]:
+                    # Empty array
+                    self._close_container(events)
+                elif char in _NUMBER_CHARS:
+                    self._pending = [char]
+                    self._state = _IN_NUMBER
+                elif char.isalpha():
+                    self._pending = [char]
+                    self._state = _IN_LITERAL
+                else:
+                    raise ValueError(f"Expected a value, got `{char}`")
+            elif state == _EXPECT_COMMA_OR_END:
+                frame = self._stack[-1]
+                if char == ",":
+                    if frame[2]:
+                        self._state = _EXPECT_KEY_OR_END
+                    else:
+                        frame[1] += 1
+                        self._state = _EXPECT_VALUE
+                elif char == ("}" if frame[2] else "]"):
+                    self._close_container(events)
+                else:
+                    raise ValueError(f"Expected `,` or a closing bracket, got `{char}`")
+            else:
+                # The root value is complete, ignore the rest of the output
+                return
+
+    def _find_string_end(self, text: str, pos: int) -> int | None:
+        """Returns the index right after the closing quote, or None if it is not in `text`."""
+        length = len(text)
+        if self._escape_pending:
+            # The previous chunk ended with a backslash, so this character is escaped
+            self._escape_pending = False
+            pos += 1
+        while pos < length:
+            match = _STRING_SPECIAL_CHARS.search(text, pos)
+            if match is None:
+                return None
+            idx = match.start()
+            if text[idx] == '"':
+                return idx + 1
+            if idx + 1 == length:
+                self._escape_pending = True
+                return None
+            pos = idx + 2
+        return None
+
+    def _start_string(self, is_key: bool, char: str) -> None:
+        self._pending = [char]
+        self._string_is_key = is_key
+        self._escape_pending = False
+        self._state = _IN_STRING
+
+    def _current_path(self) -> tuple[str | int, ...]:
+        return tuple(frame[1] for frame in self._stack)
+
+    def _open_container(self, char: str) -> None:
+        is_object = char == "{"
+        container = {} if is_object else []
+        if self._stack:
+            parent, key, parent_is_object = self._stack[-1]
+            if parent_is_object:
+                parent[key] = container
+            else:
+                parent.append(container)
+        self._stack.append([container, None if is_object else 0, is_object])
+        self._state = _EXPECT_KEY_OR_END if is_object else _EXPECT_VALUE
+
+    def _close_container(self, events: list[JSONEvent]) -> None:
+        container = self._stack.pop()[0]
+        if not self._stack:
+            events.append(JSONEvent((), container))
+            self.done = True
+            self._state = _DONE
+            return
+        events.append(JSONEvent(self._current_path(), container))
+        self._state = _EXPECT_COMMA_OR_END
+
+    def _add_value(self, value: Any, events: list[JSONEvent]) -> None:
+        container, key, is_object = self._stack[-1]
+        if is_object:
+            container[key] = value
+        else:
+            container.append(value)
+        events.append(JSONEvent(self._current_path(), value))
+        self._state = _EXPECT_COMMA_OR_END
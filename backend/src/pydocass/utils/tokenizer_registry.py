@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
+
+from .constants import DEFAULT_TOKENIZER_CHECKPOINT
+
+log = logging.getLogger(__name__)
+
+
+class TokenizerRegistry:
+    """
+    Thread-safe registry that loads each tokenizer once per process. If the tokenizer of a
+    checkpoint cannot be loaded, the checkpoint is mapped to the tokenizer of
+    `DEFAULT_TOKENIZER_CHECKPOINT`, so the failed load is not retried on every request and
+    the fallback tokenizer is kept in memory only once.
+    """
+
+    def __init__(
+        self,
+        load_function: Callable[[str], PreTrainedTokenizerFast] | None = None,
+        fallback_checkpoint: str = DEFAULT_TOKENIZER_CHECKPOINT,
+    ):
+        self._load_function = load_function or _from_pretrained
+        self.fallback_checkpoint = fallback_checkpoint
+        self._tokenizers: dict[str, PreTrainedTokenizerFast] = {}
+        self._metrics: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # One lock per checkpoint, so that different checkpoints can be loaded at the same time
+        self._checkpoint_locks: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, model_checkpoint: str) -> PreTrainedTokenizerFast:
+        tokenizer = self._tokenizers.get(model_checkpoint)
+        if tokenizer is not None:
+            # `+=` is not atomic, the concurrent requests would lose some of the counts
+            with self._lock:
+                self.hits += 1
+            return tokenizer
+        with self._get_checkpoint_lock(model_checkpoint):
+            # Another thread may have loaded it while we were waiting for the lock
+            if model_checkpoint not in self._tokenizers:
+                self._tokenizers[model_checkpoint] = self._load(model_checkpoint)
+            else:
+                with self._lock:
+                    self.hits += 1
+        return self._tokenizers[model_checkpoint]
+
+    def preload(self, model_checkpoints: Iterable[str]) -> None:
+        for model_checkpoint in model_checkpoints:
+            self.get(model_checkpoint)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "tokenizers": {
+                    checkpoint: dict(metrics)
+                    for checkpoint, metrics in self._metrics.items()
+                },
+            }
+
+    def _load(self, model_checkpoint: str) -> PreTrainedTokenizerFast:
+        start_time = time.perf_counter()
+        try:
+            tokenizer = self._load_function(model_checkpoint)
+            loaded_checkpoint = model_checkpoint
+        except Exception as e:
+            if model_checkpoint == self.fallback_checkpoint:
+                raise
+            log.warning(
+                "Could not load the tokenizer of %s, using %s instead: %s",
+                model_checkpoint,
+                self.fallback_checkpoint,
+                e,
+            )
+            tokenizer = self.get(self.fallback_checkpoint)
+            loaded_checkpoint = self.fallback_checkpoint
+        else:
+            with self._lock:
+                self.loads += 1
+        metrics = {
+            "checkpoint": loaded_checkpoint,
+            "load_seconds": time.perf_counter() - start_time,
+            "size_bytes": _get_tokenizer_size(tokenizer),
+        }
+        with self._lock:
+            self._metrics[model_checkpoint] = metrics
+        return tokenizer
+
+    def _get_checkpoint_lock(self, model_checkpoint: str) -> threading.Lock:
+        with self._lock:
+            return self._checkpoint_locks.setdefault(model_checkpoint, threading.Lock())
+
+
+def _from_pretrained(model_checkpoint: str) -> PreTrainedTokenizerFast:
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(
+        model_checkpoint, cache_dir=os.getenv("HF_HOME", None), use_fast=True
+    )
+
+
+def _get_tokenizer_size(tokenizer: PreTrainedTokenizerFast) -> int | None:
+    # The size of the serialized fast tokenizer approximates the memory it takes
+    try:
+        return len(tokenizer.backend_tokenizer.to_str())
+    except Exception:
+        return None
+
+
+TOKENIZER_REGISTRY = TokenizerRegistry()
+
+
+def get_tokenizer(model_checkpoint: str) -> PreTrainedTokenizerFast:
+    return TOKENIZER_REGISTRY.get(model_checkpoint)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import ast
+from typing import Iterable, Union
+
+# `bool` goes before `int` since it is its subclass
+_LITERAL_TYPES = (bool, int, float, complex, str, bytes)
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+_FINAL_ANNOTATIONS = frozenset({"Final", "typing.Final"})
+# Decorators of the functions whose body says nothing about their return type
+_STUB_DECORATORS = frozenset({"abstractmethod", "overload"})
+
+
+class TypeInference:
+    """
+    Infers the annotations that leave no doubt without the LLM: from the literal defaults,
+    e.g. `verbose=False`, the `isinstance` checks of the arguments, the literals returned by
+    the functions and the annotations and constants of the same module. The other annotations
+    are left to the LLM.
+
+    Args:
+        tree (`ast.Module`):
+            The parsed module.
+        nodes (`Iterable[ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef]`):
+            The functions, classes and methods of the module, whose annotations are reused
+            for the arguments with the same name and default.
+    """
+
+    def __init__(
+        self,
+        tree: ast.Module,
+        nodes: Iterable[Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]],
+    ):
+        # The types of the module-level constants, e.g. `DEFAULT_TIMEOUT = 10`
+        self.constant_types: dict[str, str | None] = {}
+        for node in tree.body:
+            if (
+                isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+            ):
+                self._add_constant_type(
+                    node.targets[0].id, self.get_value_type(node.value)
+                )
+            elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+                annotation = ast.unparse(node.annotation)
+                # `Final` says nothing about the type itself
+                if annotation in _FINAL_ANNOTATIONS:
+                    annotation = node.value and self.get_value_type(node.value)
+                self._add_constant_type(node.target.id, annotation)
+        # The annotations of the arguments by their names and defaults
+        self.argument_types: dict[tuple[str, str], str | None] = {}
+        for node in nodes:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for arg, default in _get_args_with_defaults(node).items():
+                if arg.annotation is not None and default is not None:
+                    key = (arg.arg, ast.dump(default))
+                    annotation = ast.unparse(arg.annotation)
+                    # The arguments annotated differently are ambiguous
+                    if self.argument_types.get(key, annotation) != annotation:
+                        annotation = None
+                    self.argument_types[key] = annotation
+
+    def _add_constant_type(self, name: str, type_: str | None) -> None:
+        # The constants assigned several times with different types are ambiguous
+        if self.constant_types.get(name, type_) != type_:
+            type_ = None
+        self.constant_types[name] = type_
+
+    def get_value_type(self, value: ast.expr) -> str | None:
+        """Returns the type of a literal, e.g. `-1`, or of a module-level constant, if known."""
+        if isinstance(value, ast.UnaryOp) and isinstance(
+            value.op, (ast.USub, ast.UAdd)
+        ):
+            value = value.operand
+            if not isinstance(value, ast.Constant) or isinstance(value.value, bool):
+                return None
+        if isinstance(value, ast.Constant):
+            for type_ in _LITERAL_TYPES:
+                if isinstance(value.value, type_):
+                    return type_.__name__
+            return None
+        if isinstance(value, ast.JoinedStr):
+            return "str"
+        if isinstance(value, ast.Name):
+            return self.constant_types.get(value.id)
+        return None
+
+    def infer_argument_type(
+        self, function: Union[ast.FunctionDef, ast.AsyncFunctionDef], arg: ast.arg
+    ) -> str | None:
+        """
+        Infers the annotation of an argument of the function from its default, the
+        `isinstance` checks of the function and the same arguments of the module.
+
+        Returns:
+            `str | None`: The annotation, or None if it is uncertain.
+        """
+        default = _get_args_with_defaults(function).get(arg)
+        if default is None:
+            types = {_get_isinstance_check_type(function, arg.arg)}
+        elif isinstance(default, ast.Constant) and default.value is None:
+            # e.g. `Optional[int]`, known only from the same arguments of the module
+            types = {self.argument_types.get((arg.arg, ast.dump(default)))}
+        else:
+            types = {
+                _get_isinstance_check_type(function, arg.arg),
+                self.get_value_type(default),
+                self.argument_types.get((arg.arg, ast.dump(default))),
+            }
+        types.discard(None)
+        # The sources of the type must agree
+        return types.pop() if len(types) == 1 else None
+
+    def infer_return_type(
+        self, function: Union[ast.FunctionDef, ast.AsyncFunctionDef]
+    ) -> str | None:
+        """
+        Infers the return annotation of the function: `None` if it returns no value, or the
+        type of the literals it returns.
+
+        Returns:
+            `str | None`: The annotation, or None if it is uncertain.
+        """
+        body = function.body
+        # Docstrings, `pass` and `...`
+        statements = [
+            x
+            for x in body
+            if not isinstance(x, ast.Pass)
+            and not (isinstance(x, ast.Expr) and isinstance(x.value, ast.Constant))
+        ]
+        if (
+            not statements
+            or any(isinstance(x, ast.Raise) for x in body)
+            or any(
+                ast.unparse(x).split(".")[-1] in _STUB_DECORATORS
+                for x in function.decorator_list
+            )
+        ):
+            return None
+        returned_values = []
+        nodes = list(body)
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, (ast.Yield, ast.YieldFrom)):
+                return None
+            if isinstance(node, ast.Return):
+                returned_values.append(node.value)
+            nodes.extend(
+                child
+                for child in ast.iter_child_nodes(node)
+                if not isinstance(child, _SCOPES)
+            )
+        if all(
+            value is None or (isinstance(value, ast.Constant) and value.value is None)
+            for value in returned_values
+        ):
+            return "None"
+        # The function must not reach its end, which would return `None`
+        if not isinstance(body[-1], ast.Return):
+            return None
+        types = {
+            self.get_value_type(value) if value is not None else None
+            for value in returned_values
+        }
+        return types.pop() if len(types) == 1 and None not in types else None
+
+
+def _get_args_with_defaults(
+    function: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+) -> dict[ast.arg, ast.expr | None]:
+    # The defaults are those of the last positional arguments, including the positional-only
+    args = function.args.posonlyargs + function.args.args
+    defaults = [None] * (len(args) - len(function.args.defaults))
+    return dict(zip(args, defaults + function.args.defaults))
+
+
+def _get_isinstance_check_type(
+    function: Union[ast.FunctionDef, ast.AsyncFunctionDef], arg_name: str
+) -> str | None:
+    # `assert isinstance(arg, Type)` or `if not isinstance(arg, Type): raise ...` in the
+    # body of the function
+    for statement in function.body:
+        if isinstance(statement, ast.Assert):
+            check = statement.test
+        elif (
+            isinstance(statement, ast.If)
+            and isinstance(statement.test, ast.UnaryOp)
+            and isinstance(statement.test.op, ast.Not)
+            and not statement.orelse
+            and isinstance(statement.body[-1], ast.Raise)
+        ):
+            check = statement.test.operand
+        else:
+            continue
+        if (
+            isinstance(check, ast.Call)
+            and isinstance(check.func, ast.Name)
+            and check.func.id == "isinstance"
+            and len(check.args) == 2
+            and isinstance(check.args[0], ast.Name)
+            and check.args[0].id == arg_name
+            and isinstance(check.args[1], (ast.Name, ast.Attribute))
+        ):
+            return ast.unparse(check.args[1])
+    return None
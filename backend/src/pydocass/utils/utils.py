@@ -1,15 +1,18 @@
+from __future__ import annotations
+
 import ast
+from collections import Counter
 from datetime import datetime
 import json
 import os
-from typing import Union, Literal, Any
-from transformers import PreTrainedTokenizerFast, AutoTokenizer
-from pydantic import BaseModel
+from typing import TYPE_CHECKING, Union, Literal, Any
 import warnings
-import black
 
-from openai import Client
-from openai.lib.streaming.chat._events import ChunkEvent
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerFast
+    from pydantic import BaseModel
+    from openai import AsyncClient, Client
+    from openai.lib.streaming.chat._events import ChunkEvent
 
 from .constants import (
     NUM_SYSTEM_PROMPT_TOKENS_DICT,
@@ -19,9 +22,10 @@ from .constants import (
     DEFAULT_MODEL_CHECKPOINT,
     LONG_CONTEXT_MODEL_CHECKPOINT,
     MAX_TOKENS_FOR_LONG_CONTEXT,
-    DEFAULT_TOKENIZER_CHECKPOINT,
     BASE_URL,
 )
+from .tokenizer_registry import TOKENIZER_REGISTRY
+from .client_pool import ANTHROPIC_CLIENT_POOL, OPENAI_CLIENT_POOL
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -67,6 +71,7 @@ def get_nodes_dict_with_functions_classes_methods(
 def check_no_duplicating_methods(nodes: list[ast.AST]):
     functions_names = []
     classes_names = []
+    classes_methods_names = []
     for node in nodes:
         if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
             functions_names.append(node.name)
@@ -76,28 +81,44 @@ def check_no_duplicating_methods(nodes: list[ast.AST]):
             for subnode in node.body:
                 if isinstance(subnode, (ast.FunctionDef, ast.AsyncFunctionDef)):
                     class_methods_names.append(subnode.name)
-            if len(set(class_methods_names)) != len(class_methods_names):
-                for method in class_methods_names:
-                    if class_methods_names.count(method) != 1:
-                        raise ValueError(
-                            f"Method {method} is duplicated for class {node.name}."
-                            + "Please fix this before running annotation."
-                        )
-
-    if len(set(functions_names)) != len(functions_names):
-        for func in functions_names:
-            if functions_names.count(func) != 1:
-                raise ValueError(
-                    f"Function {func} is duplicated."
-                    + "Please fix this before running annotation."
-                )
-    if len(set(classes_names)) != len(classes_names):
-        for class_ in classes_names:
-            if classes_names.count(class_) != 1:
-                raise ValueError(
-                    f"Class {class_} is duplicated."
-                    + "Please fix this before running annotation."
-                )
+            classes_methods_names.append((node.name, class_methods_names))
+    duplicates = find_duplicated_names(
+        functions_names, classes_names, classes_methods_names
+    )
+    if duplicates:
+        raise ValueError(duplicates[0])
+
+
+def find_duplicated_names(
+    functions_names: list[str],
+    classes_names: list[str],
+    classes_methods_names: list[tuple[str, list[str]]],
+) -> list[str]:
+    """
+    Describes the duplicated methods of each class, then the duplicated functions and
+    classes, in linear time.
+    """
+    duplicates = [
+        f"Method {method} is duplicated for class {class_name}."
+        + "Please fix this before running annotation."
+        for class_name, methods_names in classes_methods_names
+        for method in _get_duplicated_names(methods_names)
+    ]
+    duplicates += [
+        f"Function {func} is duplicated." + "Please fix this before running annotation."
+        for func in _get_duplicated_names(functions_names)
+    ]
+    duplicates += [
+        f"Class {class_} is duplicated." + "Please fix this before running annotation."
+        for class_ in _get_duplicated_names(classes_names)
+    ]
+    return duplicates
+
+
+def _get_duplicated_names(names: list[str]) -> list[str]:
+    # In the order of the first occurrences
+    counts = Counter(names)
+    return [name for name, count in counts.items() if count > 1]
 
 
 def get_model_checkpoint_and_params(
@@ -154,18 +175,13 @@ def extract_llm_response_data(chunk: ChunkEvent):
 
 
 def load_tokenizer(model_checkpoint: str) -> PreTrainedTokenizerFast:
-    cache_dir = os.getenv("HF_HOME", None)
-    try:
-        return AutoTokenizer.from_pretrained(
-            model_checkpoint, cache_dir=cache_dir, use_fast=True
-        )
-    except:
-        return AutoTokenizer.from_pretrained(
-            DEFAULT_TOKENIZER_CHECKPOINT, cache_dir=cache_dir, use_fast=True
-        )
+    # Each tokenizer is loaded once per process, falling back to `DEFAULT_TOKENIZER_CHECKPOINT`
+    return TOKENIZER_REGISTRY.get(model_checkpoint)
 
 
 def format_code_with_black(code: str) -> str:
+    import black
+
     try:
         formatted_code = black.format_str(code, mode=black.Mode())
         return formatted_code
@@ -177,6 +193,22 @@ def format_code_with_black(code: str) -> str:
 
 
 def get_client(data: dict[str, Any]):
+    # Clients are shared by the requests with the same API key to reuse their connections
+    return OPENAI_CLIENT_POOL.get(_get_api_key(data), BASE_URL)
+
+
+def get_async_client(data: dict[str, Any]):
+    from openai import AsyncClient
+
+    return AsyncClient(api_key=_get_api_key(data), base_url=BASE_URL)
+
+
+def get_anthropic_client(client: Client):
+    api_key = os.getenv("ANTHROPIC_API_KEY", client.api_key)
+    return ANTHROPIC_CLIENT_POOL.get(api_key)
+
+
+def _get_api_key(data: dict[str, Any]) -> str:
     api_key = (
         data.get("api_key", None)
         or os.getenv("NEBIUS_API_KEY")
@@ -186,8 +218,7 @@ def get_client(data: dict[str, Any]):
         raise ValueError(
             "Please provide the API key to Nebius AI Studio with `NEBIUS_API_KEY=...` or `OPENAI_API_KEY=...`"
         )
-
-    return Client(api_key=api_key, base_url=BASE_URL)
+    return api_key
 
 
 def _get_model_max_tokens(model_checkpoint: str) -> int:
@@ -0,0 +1,114 @@
+"""Fake OpenAI client that streams structured outputs the way the real one does."""
+
+import json
+from contextlib import asynccontextmanager, contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable
+
+
+def fill_schema(pydantic_model, value_fn: Callable[[tuple[str, ...]], Any]) -> dict:
+    """
+    Builds a response that matches the JSON schema of `pydantic_model`.
+
+    Args:
+        pydantic_model:
+            The pydantic model passed as `response_format`.
+        value_fn (`Callable[[tuple[str, ...]], Any]`):
+            Returns the value of a string field given the path of keys leading to it.
+
+    Returns:
+        `dict`:
+            The response with one value per field.
+    """
+    schema = pydantic_model.model_json_schema()
+    definitions = schema.get("$defs", {})
+
+    def fill(node_schema: dict, path: tuple[str, ...]):
+        if "$ref" in node_schema:
+            node_schema = definitions[node_schema["$ref"].split("/")[-1]]
+        if "properties" in node_schema:
+            return {
+                key: fill(value, path + (key,))
+                for key, value in node_schema["properties"].items()
+            }
+        return value_fn(path)
+
+    return fill(schema, ())
+
+
+class FakeClient:
+    """
+    Mimics `client.beta.chat.completions.stream`: the response is streamed as content
+    deltas of `chunk_size` characters followed by a final usage chunk. The same response
+    is returned at once by `client.beta.chat.completions.parse`.
+    """
+
+    def __init__(
+        self,
+        value_fn: Callable[[tuple[str, ...]], Any] = lambda path: "",
+        chunk_size: int = 7,
+    ):
+        self.value_fn = value_fn
+        self.chunk_size = chunk_size
+        self.api_key = "fake-api-key"
+        self.requests = []
+        self.beta = SimpleNamespace(
+            chat=SimpleNamespace(
+                completions=SimpleNamespace(stream=self._stream, parse=self._parse)
+            )
+        )
+
+    def make_output(self, response_format) -> str:
+        return json.dumps(fill_schema(response_format, self.value_fn))
+
+    @contextmanager
+    def _stream(self, **kwargs):
+        self.requests.append(kwargs)
+        output = self.make_output(kwargs["response_format"])
+        yield iter(self._events(output, kwargs["model"]))
+
+    def _parse(self, **kwargs):
+        self.requests.append(kwargs)
+        output = self.make_output(kwargs["response_format"])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=output))]
+        )
+
+    def _events(self, output: str, model: str):
+        for i in range(0, len(output), self.chunk_size):
+            yield SimpleNamespace(
+                type="content.delta", delta=output[i : i + self.chunk_size]
+            )
+        usage = SimpleNamespace(completion_tokens=len(output), prompt_tokens=1)
+        yield SimpleNamespace(
+            type="chunk",
+            chunk=SimpleNamespace(id="fake", created=0, model=model, usage=usage),
+            snapshot=SimpleNamespace(
+                created=0,
+                choices=[SimpleNamespace(message=SimpleNamespace(content=output))],
+            ),
+        )
+
+
+class FakeAsyncClient(FakeClient):
+    """Mimics the `AsyncClient` methods with the same output as `FakeClient`."""
+
+    @asynccontextmanager
+    async def _stream(self, **kwargs):
+        self.requests.append(kwargs)
+        output = self.make_output(kwargs["response_format"])
+        yield self._aevents(output, kwargs["model"])
+
+    async def _parse(self, **kwargs):
+        return FakeClient._parse(self, **kwargs)
+
+    async def _aevents(self, output: str, model: str):
+        for event in self._events(output, model):
+            yield event
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the interface used by `get_model_checkpoint_and_params`."""
+
+    def tokenize(self, text: str) -> list[str]:
+        return text.split()
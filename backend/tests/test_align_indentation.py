@@ -0,0 +1,36 @@
+import unittest
+
+from pydocass.utils.indentation import align_indentation
+
+
+class TestAlignIndentation(unittest.TestCase):
+
+    def test_align_to_spaces(self):
+        """Test that only the tabs of the indentation are replaced."""
+        code = 'def f():\n\tif x:\n\t\treturn "\\t"\n  \tpass\n'
+        self.assertEqual(
+            align_indentation(code, indent_type="4-space"),
+            'def f():\n    if x:\n        return "\\t"\n      pass\n',
+        )
+        self.assertEqual(
+            align_indentation(code, indent_type="2-space"),
+            'def f():\n  if x:\n    return "\\t"\n    pass\n',
+        )
+
+    def test_align_to_tabs(self):
+        """Test that each 4 spaces become a tab and 2 or 3 spaces are rounded up."""
+        code = "def f():\n    x = 1\n      y = 2\n\t    z = 3\n  \n"
+        expected = "def f():\n\tx = 1\n\t\ty = 2\n\t\tz = 3\n\t\n"
+        self.assertEqual(align_indentation(code, indent_type="tab"), expected)
+        self.assertEqual(align_indentation(code, indent_type="inconsistent"), expected)
+
+    def test_aligned_code_is_returned_as_is(self):
+        """Test that the code whose indentation already matches is not rebuilt."""
+        code = "def f():\n    x = 'a\\tb'\n    return x\n"
+        self.assertIs(align_indentation(code, indent_type="4-space"), code)
+        code = "def f():\n\treturn 1\n"
+        self.assertIs(align_indentation(code, indent_type="tab"), code)
+
+
+if __name__ == "__main__":
+    unittest.main()
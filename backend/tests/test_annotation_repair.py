@@ -0,0 +1,38 @@
+import unittest
+
+from pydocass.utils.annotation_repair import is_valid_annotation, repair_annotation
+
+
+class TestAnnotationRepair(unittest.TestCase):
+
+    def test_is_valid_annotation(self):
+        """Test that only single expressions are valid annotations."""
+        for value in ("int", "dict[str, Any]", "'Foo'", "int | None", "(int,)"):
+            self.assertTrue(is_valid_annotation(value))
+        for value in ("Optional[", "int = 1", "", "x: int", "a\0"):
+            self.assertFalse(is_valid_annotation(value))
+
+    def test_repair_annotation(self):
+        """Test that the brackets and quotes are closed in the order they were opened."""
+        for value, expected in (
+            ("list[int]", "list[int]"),
+            (" int ", "int"),
+            (
+                "Union[str, List[Union[int, str, List[Any]]]",
+                "Union[str, List[Union[int, str, List[Any]]]]",
+            ),
+            ("Callable[[int], str", "Callable[[int], str]"),
+            ("dict[str, tuple[int, ", "dict[str, tuple[int]]"),
+            ("list[int)", "list[int]"),
+            ("int]", "int"),
+            ('Literal["a', 'Literal["a"]'),
+            ("Literal['[']", "Literal['[']"),
+            ("int | ", "int"),
+        ):
+            self.assertEqual(repair_annotation(value), expected)
+        for value in ("Optional[", "integer number", ""):
+            self.assertIsNone(repair_annotation(value))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import (
+    adocument_python_code,
+    document_python_code,
+)
+from pydocass.utils.cache import InMemoryLRUCache
+
+from .fake_client import FakeAsyncClient, FakeClient, FakeTokenizer
+from .test_streaming_components import CODE, _value_fn
+
+
+async def _collect(async_generator) -> list:
+    return [x async for x in async_generator]
+
+
+class TestAsyncPipeline(unittest.TestCase):
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_same_snapshots_as_sync(self, mock_submit):
+        """Test that the async pipeline yields the same code snapshots as the sync one."""
+        expected = list(
+            document_python_code(
+                code=CODE, client=FakeClient(_value_fn), tokenizer=FakeTokenizer()
+            )
+        )
+        client = FakeAsyncClient(_value_fn)
+        outputs = asyncio.run(
+            _collect(
+                adocument_python_code(
+                    code=CODE, client=client, tokenizer=FakeTokenizer()
+                )
+            )
+        )
+        self.assertEqual(outputs, expected)
+        self.assertEqual(len(client.requests), 3)
+        self.assertEqual(mock_submit.call_count, 2)
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_concurrent_sessions_share_cache(self, mock_submit):
+        """Test that concurrent sessions run on one event loop and reuse the cache."""
+        cache = InMemoryLRUCache()
+
+        async def run_sessions():
+            first = await _collect(
+                adocument_python_code(
+                    code=CODE,
+                    client=FakeAsyncClient(_value_fn),
+                    tokenizer=FakeTokenizer(),
+                    cache=cache,
+                )
+            )
+            clients = [FakeAsyncClient(_value_fn) for _ in range(10)]
+            outputs = await asyncio.gather(
+                *(
+                    _collect(
+                        adocument_python_code(
+                            code=CODE,
+                            client=client,
+                            tokenizer=FakeTokenizer(),
+                            cache=cache,
+                        )
+                    )
+                    for client in clients
+                )
+            )
+            return first[-1], [x[-1] for x in outputs], clients
+
+        expected, outputs, clients = asyncio.run(run_sessions())
+        self.assertEqual(outputs, [expected] * 10)
+        self.assertTrue(all(len(client.requests) == 0 for client in clients))
+
+
+if __name__ == "__main__":
+    unittest.main()
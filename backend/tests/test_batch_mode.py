@@ -0,0 +1,143 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from pydocass.scripts.job_manifest import JobManifest
+from pydocass.scripts.run_document import (
+    DEFAULT_MANIFEST_FILE_NAME,
+    document_directory,
+    find_python_files,
+)
+
+from .fake_client import FakeClient, FakeTokenizer
+from .test_streaming_components import CODE, _value_fn
+
+
+class _CountingClient(FakeClient):
+    """Records the maximum number of the requests streamed at the same time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @contextmanager
+    def _stream(self, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.01)
+            with super()._stream(**kwargs) as stream:
+                yield stream
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class TestBatchMode(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        root = self.directory.name
+        for path, code in [
+            ("a.py", CODE),
+            ("pkg/b.py", CODE),
+            ("pkg/c.py", CODE),
+            ("pkg/broken.py", "def broken(:\n"),
+            (".venv/skipped.py", CODE),
+            ("pkg/__pycache__/skipped.py", CODE),
+            ("notes.txt", CODE),
+        ]:
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            with open(os.path.join(root, path), "w") as f:
+                f.write(code)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_python_files(self):
+        """Test that the hidden and cache directories are skipped."""
+        paths = find_python_files(self.directory.name)
+        relative_paths = [os.path.relpath(path, self.directory.name) for path in paths]
+        self.assertEqual(
+            relative_paths, ["a.py", "pkg/b.py", "pkg/broken.py", "pkg/c.py"]
+        )
+
+    def test_document_directory(self):
+        """Test that a broken file is recorded without stopping the batch and the limit holds."""
+        client = _CountingClient(_value_fn)
+        output_directory = os.path.join(self.directory.name, "out")
+        with patch("pydocass.utils.utils.get_client", return_value=client), patch(
+            "pydocass.utils.utils.load_tokenizer", return_value=FakeTokenizer()
+        ), patch("pydocass.connection.submit_record"), patch(
+            "pydocass.core.document_python_code.submit_record"
+        ):
+            summary = document_directory(
+                os.path.join(self.directory.name),
+                output_directory=output_directory,
+                jobs=3,
+                max_inflight_requests=2,
+                use_streaming=True,
+                do_black_format=False,
+            )
+        self.assertEqual((summary["documented"], summary["failed"]), (3, 1))
+        self.assertEqual(summary["failures"][0]["error"], "SyntaxError")
+        self.assertTrue(summary["failures"][0]["file"].endswith("broken.py"))
+        self.assertLessEqual(client.max_in_flight, 2)
+        self.assertGreater(summary["tokens_per_second"], 0)
+        with open(os.path.join(output_directory, "pkg", "b.py")) as f:
+            self.assertIn("Docstring of `function_bar`", f.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(output_directory, "pkg", "broken.py"))
+        )
+        # The inputs are not modified when the output directory is given
+        with open(os.path.join(self.directory.name, "a.py")) as f:
+            self.assertEqual(f.read(), CODE)
+
+    def test_resume_skips_documented_files(self):
+        """Test that a resumed run only redoes the failed and the changed files."""
+        client = _CountingClient(_value_fn)
+
+        def run(**kwargs) -> dict:
+            with patch("pydocass.utils.utils.get_client", return_value=client), patch(
+                "pydocass.utils.utils.load_tokenizer", return_value=FakeTokenizer()
+            ), patch("pydocass.connection.submit_record"), patch(
+                "pydocass.core.document_python_code.submit_record"
+            ):
+                return document_directory(
+                    self.directory.name,
+                    jobs=2,
+                    use_streaming=True,
+                    do_black_format=False,
+                    **kwargs,
+                )
+
+        summary = run()
+        self.assertEqual((summary["documented"], summary["failed"]), (3, 1))
+        with open(os.path.join(self.directory.name, "pkg", "broken.py"), "w") as f:
+            f.write("def fixed(a):\n    return a\n")
+        num_requests = len(client.requests)
+
+        summary = run(resume=True)
+        self.assertEqual(
+            (summary["documented"], summary["failed"], summary["skipped"]), (1, 0, 3)
+        )
+        self.assertLess(len(client.requests) - num_requests, num_requests)
+        manifest = JobManifest(
+            os.path.join(self.directory.name, DEFAULT_MANIFEST_FILE_NAME)
+        )
+        self.assertEqual(manifest.counts(), {"done": 4})
+        manifest.close()
+
+        summary = run()
+        self.assertEqual((summary["documented"], summary["skipped"]), (4, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
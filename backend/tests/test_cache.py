@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import document_python_code
+from pydocass.utils.cache import (
+    DiskCache,
+    InMemoryLRUCache,
+    make_cache_key,
+)
+
+from .fake_client import FakeClient, FakeTokenizer
+from .test_streaming_components import CODE, _value_fn
+
+
+def _document(code: str, client: FakeClient, cache) -> str:
+    with patch("pydocass.core.document_python_code.submit_record"):
+        *_, output = document_python_code(
+            code=code, client=client, tokenizer=FakeTokenizer(), cache=cache
+        )
+    return output
+
+
+class TestResultsCache(unittest.TestCase):
+
+    def test_lru_eviction_and_counters(self):
+        """Test that the least recently used entry is evicted and hits / misses are counted."""
+        cache = InMemoryLRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(
+            cache.stats(), {"hits": 1, "misses": 1, "evictions": 1, "entries": 2}
+        )
+
+    def test_disk_cache_is_bounded_and_persistent(self):
+        """Test that the disk cache survives reloading and evicts above the size limit."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskCache(directory, max_size_bytes=40)
+            cache.set("a", ["x" * 10])
+            cache.set("b", ["y" * 10])
+            self.assertEqual(cache.get("a"), ["x" * 10])
+            cache.set("c", ["z" * 10])
+            self.assertEqual(cache.evictions, 1)
+            reloaded = DiskCache(directory, max_size_bytes=40)
+            self.assertEqual(len(reloaded), 2)
+            self.assertIsNone(reloaded.get("b"))
+            self.assertEqual(reloaded.get("c"), ["z" * 10])
+
+    def test_key_ignores_indentation_style(self):
+        """Test that the key depends on the normalized source, stage and model."""
+        source = "def foo(a):\n    return a\n"
+        key = make_cache_key(source, "docstrings", "model")
+        self.assertEqual(
+            key, make_cache_key("\tdef foo(a):  \n\t\treturn a", "docstrings", "model")
+        )
+        self.assertNotEqual(key, make_cache_key(source, "comments", "model"))
+        self.assertNotEqual(key, make_cache_key(source, "docstrings", "other"))
+
+    def test_unchanged_nodes_skip_llm(self):
+        """Test that a second run makes no requests and only changed nodes are requested."""
+        cache = InMemoryLRUCache()
+        first_client = FakeClient(_value_fn)
+        expected_output = _document(CODE, first_client, cache)
+        self.assertEqual(len(first_client.requests), 3)
+
+        second_client = FakeClient(_value_fn)
+        self.assertEqual(_document(CODE, second_client, cache), expected_output)
+        self.assertEqual(second_client.requests, [])
+
+        # Only the changed function is sent to the LLM
+        third_client = FakeClient(_value_fn)
+        _document(
+            CODE.replace("return os.sep", "return os.sep * 2"), third_client, cache
+        )
+        schemas = [
+            str(request["response_format"].model_json_schema())
+            for request in third_client.requests
+        ]
+        self.assertEqual(len(schemas), 3)
+        self.assertTrue(all("Foo" not in schema for schema in schemas))
+
+
+if __name__ == "__main__":
+    unittest.main()
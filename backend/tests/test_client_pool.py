@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from pydocass.utils.client_pool import ClientPool
+
+
+def _create_client(api_key: str, base_url: str | None):
+    return MagicMock(api_key=api_key, base_url=base_url), MagicMock()
+
+
+class TestClientPool(unittest.TestCase):
+
+    def test_clients_are_reused_per_key_and_url(self):
+        """Test that the same client is returned for the same API key and base URL."""
+        pool = ClientPool(_create_client)
+        client = pool.get("key", "https://a")
+        self.assertIs(pool.get("key", "https://a"), client)
+        self.assertIsNot(pool.get("key", "https://b"), client)
+        self.assertIsNot(pool.get("other", "https://a"), client)
+        self.assertEqual(
+            pool.stats(), {"clients": 3, "hits": 1, "misses": 3, "evictions": 0}
+        )
+
+    def test_bounded_and_idle_eviction(self):
+        """Test that the least recently used and the idle clients are dropped."""
+        pool = ClientPool(_create_client, max_clients=2, idle_seconds=10)
+        with patch("pydocass.utils.client_pool.time.monotonic") as monotonic:
+            monotonic.return_value = 0
+            first = pool.get("a")
+            pool.get("b")
+            pool.get("a")
+            pool.get("c")
+            self.assertEqual(pool.stats()["evictions"], 1)
+            self.assertIs(pool.get("a"), first)
+            monotonic.return_value = 20
+            self.assertIsNot(pool.get("a"), first)
+            self.assertEqual(pool.stats()["clients"], 1)
+
+    def test_prewarm_opens_connection(self):
+        """Test that pre-warming sends a request to the base URL with the pooled HTTP client."""
+        pool = ClientPool(_create_client)
+        pool.prewarm("key", "https://a")
+        http_client = pool._clients[next(iter(pool._clients))][1]
+        http_client.head.assert_called_once_with("https://a")
+
+
+if __name__ == "__main__":
+    unittest.main()
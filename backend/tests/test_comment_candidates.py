@@ -0,0 +1,75 @@
+import unittest
+
+from pydocass.components import write_comments
+from pydocass.utils.comment_candidates import (
+    MIN_COMMENT_SCORE,
+    score_lines,
+    select_comment_candidates,
+)
+
+from .fake_client import FakeClient, FakeTokenizer
+
+CODE = """import re
+
+
+def parse(text, flags=0):
+    pass
+    value = text
+    if value:
+        words = [w.lower() for w in value.split() if w and not w.isdigit()]
+        mask = flags & 0x3F
+        pattern = re.compile(r"(?P<key>\\w+)=(\\d{2,4})")
+    return value
+"""
+
+
+class TestCommentCandidates(unittest.TestCase):
+
+    def test_score_lines(self):
+        """Test that the trivial lines score 0 and the dense ones score high."""
+        scores = score_lines(CODE)
+        for line in (1, 4, 5, 6, 11):
+            self.assertEqual(scores[line], 0.0)
+        for line in (8, 9, 10):
+            self.assertGreaterEqual(scores[line], MIN_COMMENT_SCORE)
+        # The comprehension is more complex than the condition
+        self.assertGreater(scores[8], scores[7])
+
+    def test_select_comment_candidates(self):
+        """Test that at most the budget share of the statements is picked, the best first."""
+        self.assertEqual(select_comment_candidates(CODE, 1.0), {8, 9, 10})
+        self.assertEqual(len(select_comment_candidates(CODE, 0.25)), 2)
+        self.assertEqual(select_comment_candidates(CODE, 0.0), set())
+
+    def test_write_comments_with_budget(self):
+        """Test that only the picked lines are sent to the LLM."""
+        client = FakeClient(lambda path: "Comment")
+        code, _ = list(
+            write_comments(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                comments_budget=1.0,
+            )
+        )[-1]
+        self.assertEqual(len(client.requests), 1)
+        fields = client.requests[0]["response_format"].model_fields
+        # `words = ...`, `mask = ...` and `pattern = ...` are the valid lines 6, 7 and 8
+        self.assertEqual(set(fields), {"line6", "line7", "line8"})
+        self.assertEqual(code.count("# Comment"), 3)
+
+        client = FakeClient(lambda path: "Comment")
+        code, _ = list(
+            write_comments(
+                code="def foo():\n    return 1\n",
+                client=client,
+                tokenizer=FakeTokenizer(),
+                comments_budget=1.0,
+            )
+        )[-1]
+        self.assertEqual(client.requests, [])
+        self.assertEqual(code, "def foo():\n    return 1\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import ast
+import asyncio
+import threading
+import unittest
+
+from pydocass.components import write_arguments_annotations
+from pydocass.utils.concurrency import (
+    aiterate_concurrently_in_order,
+    iterate_concurrently_in_order,
+)
+from pydocass.utils.utils import get_nodes_dict_with_functions_classes_methods
+
+from .fake_client import FakeClient, FakeTokenizer
+from .test_streaming_components import _value_fn
+
+# More nodes than fit into one batch of `ANNOTATION_MAX_NUM_NODES_PER_MODEL`
+MANY_FUNCTIONS_CODE = "\n\n".join(
+    f"def function_{i}(a, b=1):\n    return a + b\n" for i in range(40)
+)
+
+
+class TestIterateConcurrentlyInOrder(unittest.TestCase):
+
+    def test_items_are_chained_in_order(self):
+        """Test that the items of a generator finished first are yielded after the previous ones."""
+        second_finished = threading.Event()
+
+        def first():
+            second_finished.wait(timeout=5)
+            yield "a1"
+
+        def second():
+            yield "b1"
+            yield "b2"
+            second_finished.set()
+
+        outputs = list(iterate_concurrently_in_order([first, second], max_workers=2))
+        self.assertTrue(second_finished.is_set())
+        self.assertEqual(outputs, ["a1", "b1", "b2"])
+
+    def test_exception_is_reraised(self):
+        """Test that the exception raised by a generator is propagated to the consumer."""
+
+        def failing():
+            yield 1
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            list(iterate_concurrently_in_order([failing, failing], max_workers=2))
+
+    def test_async_items_are_chained_in_order(self):
+        """Test that the async version orders the items the same way."""
+
+        async def run():
+            second_finished = asyncio.Event()
+
+            async def first():
+                await second_finished.wait()
+                yield "a1"
+
+            async def second():
+                yield "b1"
+                yield "b2"
+                second_finished.set()
+
+            return [
+                x
+                async for x in aiterate_concurrently_in_order(
+                    [first, second], max_concurrency=2
+                )
+            ]
+
+        self.assertEqual(asyncio.run(run()), ["a1", "b1", "b2"])
+
+    def test_concurrent_batches_match_sequential(self):
+        """Test that annotating the batches concurrently gives the same result as one by one."""
+        target_nodes_dict = get_nodes_dict_with_functions_classes_methods(
+            ast.parse(MANY_FUNCTIONS_CODE).body
+        )
+        results = []
+        for max_concurrent_batches in (1, 3):
+            client = FakeClient(_value_fn)
+            *snapshots, (code, _, _) = write_arguments_annotations(
+                target_nodes_dict=target_nodes_dict,
+                code=MANY_FUNCTIONS_CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                max_concurrent_batches=max_concurrent_batches,
+            )
+            self.assertEqual(len(client.requests), 3)
+            results.append((snapshots, code))
+        self.assertEqual(results[0], results[1])
+        self.assertIn("def function_39(a: int, b: int=1) -> int:", results[1][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import document_python_code
+from pydocass.utils.delta_stream import (
+    apply_delta,
+    compute_delta,
+    get_checksum,
+    iterate_deltas,
+    throttle_snapshots,
+)
+
+from .fake_client import FakeClient, FakeTokenizer
+from .test_streaming_components import CODE, _value_fn
+
+
+class TestDeltaStream(unittest.TestCase):
+
+    def test_compute_delta(self):
+        """Test that the delta contains only the changed part of the code."""
+        old = "x = 1\n" * 1000 + "def f(a, b):\n    return a\n" + "y = 2\n" * 1000
+        new = old.replace("f(a, b)", "f(a: int, b)")
+        delta = compute_delta(old, new)
+        self.assertEqual(
+            delta,
+            {"offset": old.index(", b)"), "delete_len": 0, "insert_text": ": int"},
+        )
+        self.assertEqual(apply_delta(old, delta), new)
+        self.assertIsNone(compute_delta(old, old))
+
+    def test_repeated_characters(self):
+        """Test that the common prefix and suffix do not overlap."""
+        for old, new in [("aaa", "aaaa"), ("aaaa", "aa"), ("abab", "ab"), ("", "x")]:
+            self.assertEqual(apply_delta(old, compute_delta(old, new)), new)
+
+    def test_pipeline_deltas_reconstruct_output(self):
+        """Test that applying the streamed deltas to the input code gives the final snapshot."""
+        with patch("pydocass.core.document_python_code.submit_record"):
+            snapshots = list(
+                document_python_code(
+                    code=CODE,
+                    client=FakeClient(_value_fn),
+                    tokenizer=FakeTokenizer(),
+                    use_streaming=True,
+                )
+            )
+        events = [
+            json.loads(json.dumps(event)) for event in iterate_deltas(snapshots, CODE)
+        ]
+        code = CODE
+        for event in events[:-1]:
+            code = apply_delta(code, event)
+        self.assertEqual(code, snapshots[-1])
+        self.assertEqual(events[-1]["checksum"], get_checksum(snapshots[-1]))
+        self.assertEqual(events[-1]["length"], len(snapshots[-1]))
+        delta_size = sum(len(event["insert_text"]) for event in events[:-1])
+        self.assertLess(delta_size, sum(map(len, snapshots)))
+
+    def test_throttle_keeps_last_snapshot(self):
+        """Test that the throttled stream drops intermediate snapshots but keeps the last one."""
+        with patch("pydocass.utils.delta_stream.time.monotonic") as monotonic:
+            monotonic.side_effect = [0.0, 0.1, 0.2, 1.5, 1.6]
+            throttled = list(throttle_snapshots(["a", "b", "c", "d", "e"], 1.0))
+        self.assertEqual(throttled, ["a", "d", "e"])
+        self.assertEqual(list(throttle_snapshots(["a", "b"], 0)), ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
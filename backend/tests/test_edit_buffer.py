@@ -0,0 +1,62 @@
+import ast
+import random
+import unittest
+
+from pydocass.utils.edit_buffer import EditBuffer
+
+
+class TestEditBuffer(unittest.TestCase):
+
+    def test_edits_in_any_order(self):
+        """Test that the edits are addressed by the original offsets regardless of their order."""
+        buffer = EditBuffer("def f(a, b):\n    return a\n")
+        buffer.insert(10, ": str")
+        buffer.insert(7, ": int")
+        buffer.replace(17, 23, "yield")
+        self.assertEqual(buffer.code, "def f(a: int, b: str):\n    yield a\n")
+        self.assertEqual(buffer.current_offset(11), 21)
+        self.assertEqual(buffer.current_offset(17), 27)
+
+    def test_matches_sequential_edits(self):
+        """Test the position mapping against the edits applied to a string one by one."""
+        rng = random.Random(0)
+        original = "".join(rng.choice("ab\n") for _ in range(200))
+        buffer = EditBuffer(original)
+        edits = []
+        for _ in range(30):
+            start = rng.randrange(len(original))
+            end = min(start + rng.randrange(4), len(original))
+            if any(s < end and start < e or s == start for s, e, _ in edits):
+                continue
+            text = "x" * rng.randrange(5)
+            buffer.replace(start, end, text)
+            edits.append((start, end, text))
+        expected = original
+        for start, end, text in sorted(edits, reverse=True):
+            expected = expected[:start] + text + expected[end:]
+        for start, end, text in edits:
+            # The start of a replaced range is mapped to the start of its replacement
+            if start < end:
+                position = buffer.current_offset(start)
+                self.assertEqual(expected[position : position + len(text)], text)
+        self.assertEqual(buffer.code, expected)
+
+    def test_overlapping_edit_raises(self):
+        """Test that a replacement overlapping a previous one is rejected."""
+        buffer = EditBuffer("abcdef")
+        buffer.replace(1, 4, "X")
+        with self.assertRaises(ValueError):
+            buffer.replace(3, 5, "Y")
+        with self.assertRaises(ValueError):
+            buffer.replace(0, 7, "Y")
+
+    def test_non_ascii_columns(self):
+        """Test that the UTF-8 byte columns of the AST are converted to characters."""
+        code = 'x = "ÿÿ"; y = 1\n'
+        node = ast.parse(code).body[1]
+        buffer = EditBuffer(code)
+        self.assertEqual(buffer.offset(node.lineno, node.col_offset), code.index("y"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import ast
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import document_python_code
+from pydocass.utils.git_diff import (
+    get_changed_lines,
+    get_changed_node_names,
+    parse_changed_lines,
+)
+from pydocass.utils.utils import get_nodes_dict_with_functions_classes_methods
+
+from .fake_client import FakeClient, FakeTokenizer
+from .test_streaming_components import CODE, _value_fn
+
+
+class TestGitDiff(unittest.TestCase):
+
+    def test_parse_changed_lines(self):
+        """Test that the added, modified and removed lines are mapped to the new file."""
+        diff = (
+            "diff --git a/x.py b/x.py\n"
+            "@@ -3 +3 @@ def foo():\n"
+            "@@ -10,0 +11,2 @@\n"
+            "@@ -20,4 +22,0 @@\n"
+        )
+        self.assertEqual(parse_changed_lines(diff), {3, 11, 12, 22, 23})
+
+    def test_get_changed_node_names(self):
+        """Test that a change in a method does not select its class."""
+        nodes_dict = get_nodes_dict_with_functions_classes_methods(ast.parse(CODE).body)
+        self.assertEqual(get_changed_node_names(nodes_dict, {8}), {"Foo-method"})
+        self.assertEqual(get_changed_node_names(nodes_dict, {5, 14}), {"Foo", "bar"})
+        self.assertEqual(get_changed_node_names(nodes_dict, {1, 2}), set())
+
+    def test_get_changed_lines(self):
+        """Test the changed lines of a tracked file and of an untracked one."""
+        with tempfile.TemporaryDirectory() as directory:
+
+            def git(*args):
+                subprocess.run(
+                    ["git", *args], cwd=directory, check=True, capture_output=True
+                )
+
+            git("init", "-q")
+            git("config", "user.email", "test@example.com")
+            git("config", "user.name", "test")
+            path = os.path.join(directory, "module.py")
+            with open(path, "w") as f:
+                f.write(CODE)
+            git("add", "module.py")
+            git("commit", "-q", "-m", "initial")
+            with open(path, "w") as f:
+                f.write(CODE.replace("return beta", "return beta * 2"))
+            self.assertEqual(get_changed_lines(path, "HEAD"), {14})
+
+            new_path = os.path.join(directory, "new.py")
+            with open(new_path, "w") as f:
+                f.write(CODE)
+            self.assertIsNone(get_changed_lines(new_path, "HEAD"))
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_document_changed_nodes_only(self, mock_submit):
+        """Test that only the changed function is documented and the rest is left as is."""
+        client = FakeClient(_value_fn)
+        outputs = list(
+            document_python_code(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                changed_lines={14},
+            )
+        )
+        code = outputs[-1]
+        self.assertIn('def bar(alpha: int, beta: str="x") -> int:', code)
+        self.assertIn("Docstring of `function_bar`", code)
+        # The class and its method are not touched
+        foo_source = CODE[CODE.index("class Foo") : CODE.index("def bar")]
+        self.assertIn(foo_source, code)
+        for request in client.requests:
+            schema = request["response_format"].model_json_schema()
+            self.assertNotIn("Foo", str(schema.get("$defs", {})))
+
+        client = FakeClient(_value_fn)
+        outputs = list(
+            document_python_code(
+                code=CODE, client=client, tokenizer=FakeTokenizer(), changed_lines={2}
+            )
+        )
+        self.assertEqual(outputs, [CODE])
+        self.assertEqual(client.requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = ("transformers", "openai", "black", "sqlalchemy", "anthropic")
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    # The subprocess sees the same `pydocass` as the tests
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, env=env, check=True
+    )
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_heavy_modules_are_not_imported(self):
+        """Test that importing the pipeline does not load the LLM, tokenizer and DB packages."""
+        result = _run_python(
+            "-c",
+            "import sys, pydocass.core, pydocass.connection; "
+            "print(' '.join(sorted(sys.modules)))",
+        )
+        loaded = set(result.stdout.split())
+        self.assertEqual([name for name in HEAVY_MODULES if name in loaded], [])
+
+    def test_cli_help(self):
+        """Test that `run_document --help` still works with the lazy imports."""
+        result = _run_python("-m", "pydocass.scripts.run_document", "--help")
+        self.assertIn("--input-file", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from pydocass.utils.line_index import LineIndex
+
+CODE = '''import os  # The OS
+
+
+def foo(a, b):
+    """
+    Docstring # not a comment
+    """
+    # Comment above
+    # Second line
+
+    text = """first
+second"""
+    total = a + \\
+        b
+    return {"a": "#", "b": b}  # Inline
+'''
+
+
+class TestLineIndex(unittest.TestCase):
+
+    def test_line_index(self):
+        """Test that the code, comment and string lines are told apart."""
+        line_index = LineIndex(CODE)
+        self.assertEqual(line_index.code_lines, [0, 3, 10, 12, 14])
+        self.assertEqual(line_index.comment_lines, [7, 8])
+        self.assertEqual(line_index.inline_comments, {0: 11, 14: 31})
+        self.assertEqual(line_index.string_spans, [(4, 6), (10, 11)])
+        self.assertEqual(line_index.comment_lines_above[10], [7, 8])
+        self.assertEqual(line_index.comment_lines_above[12], [])
+        self.assertEqual(
+            line_index.code_without_comment(14), '    return {"a": "#", "b": b}'
+        )
+        self.assertEqual(line_index.comment_text(14), "Inline")
+        self.assertEqual(line_index.comment_text(7), "Comment above")
+
+    def test_line_index_fallback(self):
+        """Test that the code rejected by `tokenize` is classified line by line."""
+        line_index = LineIndex('def foo():\n  a = 1\n    b = "#"  # B\n# C\n')
+        self.assertEqual(line_index.code_lines, [0, 1, 2])
+        self.assertEqual(line_index.comment_lines, [3])
+        self.assertEqual(line_index.inline_comments, {2: 13})
+
+
+if __name__ == "__main__":
+    unittest.main()
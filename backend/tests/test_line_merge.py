@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import document_python_code
+from pydocass.utils.line_merge import merge_line_edits
+
+from .fake_client import FakeTokenizer
+from .test_batch_mode import _CountingClient
+from .test_streaming_components import CODE, _value_fn
+
+BASE = """def foo(a):
+    total = a + 1
+    return total
+"""
+
+
+class TestLineMerge(unittest.TestCase):
+
+    def test_merge_disjoint_edits(self):
+        """Test that a docstring and a comment inserted at the same place are both kept."""
+        docstring = BASE.replace("(a):\n", '(a):\n    """Docstring."""\n')
+        comment = BASE.replace("    total =", "    # Add one\n    total =")
+        comment = comment.replace("return total", "return total  # The result")
+        self.assertEqual(
+            merge_line_edits(BASE, docstring, comment),
+            'def foo(a):\n    """Docstring."""\n    # Add one\n    total = a + 1\n'
+            "    return total  # The result\n",
+        )
+        self.assertEqual(merge_line_edits(BASE, BASE, comment), comment)
+
+    def test_merge_comments_around_header(self):
+        """Test that the comments above a function and its first statement keep its docstring."""
+        base = (
+            BASE
+            + "\n\ndef bar(c):\n    d = c * 2\n    return d\n\n\ndef baz():\n    pass\n"
+        )
+        docstring = base.replace("(c):\n", '(c):\n    """Docstring."""\n')
+        comment = base.replace("def bar", "# Bar\ndef bar")
+        comment = comment.replace("    d =", "    # Double\n    d =")
+        self.assertEqual(
+            merge_line_edits(base, docstring, comment),
+            comment.replace("(c):\n", '(c):\n    """Docstring."""\n'),
+        )
+
+    def test_merge_conflicting_edits(self):
+        """Test that the edits of the same line conflict."""
+        first = BASE.replace("def foo(a):", "def foo(a):  # First")
+        second = BASE.replace("def foo(a):", "def foo(a):  # Second")
+        self.assertIsNone(merge_line_edits(BASE, first, second))
+
+    def test_merge_repeated_lines(self):
+        """Test the edits of the code with many equal lines."""
+        base = "".join(f"def f{i}():\n    return 1\n\n" for i in range(50))
+        first = base.replace("def f10():\n", 'def f10():\n    """Doc."""\n')
+        second = base.replace("def f20():\n", "def f20():\n    # One\n")
+        merged = merge_line_edits(base, first, second)
+        self.assertEqual(
+            merged, first.replace("def f20():\n", "def f20():\n    # One\n")
+        )
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_concurrent_stages(self, mock_submit):
+        """Test that the concurrent docstrings and comments give the same code."""
+        expected = list(
+            document_python_code(
+                code=CODE, client=_CountingClient(_value_fn), tokenizer=FakeTokenizer()
+            )
+        )[-1]
+        client = _CountingClient(_value_fn)
+        response_data = {}
+        outputs = list(
+            document_python_code(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                concurrent_docstrings_and_comments=True,
+                response_data=response_data,
+            )
+        )
+        self.assertEqual(outputs[-1], expected)
+        self.assertEqual(len(client.requests), 3)
+        # The docstrings and the comments requests were in flight at the same time
+        self.assertEqual(client.max_in_flight, 2)
+        self.assertTrue(response_data["docstrings"])
+        self.assertTrue(response_data["comments"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from pydocass.components import (
+    maybe_add_class_to_typing_import,
+    maybe_add_classes_to_typing_import,
+)
+from pydocass.utils.module_index import ModuleIndex
+from pydocass.utils.utils import (
+    check_no_duplicating_methods,
+    get_nodes_dict_with_functions_classes_methods,
+)
+
+CODE = '''import os
+from typing import List
+
+
+@decorator
+def foo(a,
+        b):
+    """Docstring."""
+    return a
+
+
+class Bar:
+    x = 1
+
+    def method(self):
+        pass
+'''
+
+
+class TestModuleIndex(unittest.TestCase):
+
+    def test_module_index(self):
+        """Test that the nodes, spans and `typing` imports are collected in one traversal."""
+        module_index = ModuleIndex(CODE)
+        self.assertEqual(
+            module_index.target_nodes,
+            get_nodes_dict_with_functions_classes_methods(module_index.tree.body),
+        )
+        self.assertEqual(module_index.node_spans["foo"], (5, 9))
+        self.assertEqual(module_index.signature_spans["foo"], (6, 7))
+        self.assertEqual(module_index.docstring_spans, {"foo": (8, 8)})
+        self.assertEqual(module_index.scope_spans, [(5, 9), (12, 16)])
+        self.assertEqual(module_index.typing_imports, {"List"})
+        self.assertEqual(module_index.typing_import_span, (2, 2))
+        self.assertEqual(module_index.duplicates, [])
+        self.assertEqual(
+            module_index.line_starts[2], len("import os\nfrom typing import List\n")
+        )
+
+    def test_duplicates(self):
+        """Test that the duplicated methods are reported first, as by `check_no_duplicating_methods`."""
+        code = "def f(): pass\ndef f(): pass\nclass A:\n    def m(self): pass\n    def m(self): pass\n"
+        module_index = ModuleIndex(code)
+        self.assertEqual(len(module_index.duplicates), 2)
+        with self.assertRaisesRegex(ValueError, "Method m is duplicated for class A"):
+            module_index.check_no_duplicates()
+        with self.assertRaisesRegex(ValueError, "Method m is duplicated for class A"):
+            check_no_duplicating_methods(module_index.tree.body)
+
+    def test_replace_lines(self):
+        """Test that the index follows the edits as if the new code were parsed again."""
+        for class_names in (["Optional"], ["Any", "Union"]):
+            for code in (
+                CODE,
+                CODE.replace(
+                    "from typing import List", "from typing import (\n    List,\n)"
+                ),
+            ):
+                module_index = ModuleIndex(code)
+                for class_name in class_names:
+                    new_code = maybe_add_class_to_typing_import(
+                        code, class_name, module_index=module_index
+                    )
+                    self.assertEqual(
+                        new_code, maybe_add_class_to_typing_import(code, class_name)
+                    )
+                    code = new_code
+                expected = ModuleIndex(code)
+                self.assertEqual(module_index.code, code)
+                self.assertEqual(module_index.line_starts, expected.line_starts)
+                self.assertEqual(module_index.node_spans, expected.node_spans)
+                self.assertEqual(module_index.docstring_spans, expected.docstring_spans)
+                self.assertEqual(module_index.typing_imports, expected.typing_imports)
+                self.assertEqual(
+                    module_index.typing_import_span, expected.typing_import_span
+                )
+
+        module_index = ModuleIndex(CODE.replace("from typing import List\n", ""))
+        code = maybe_add_class_to_typing_import(
+            module_index.code, "Any", module_index=module_index
+        )
+        self.assertTrue(code.startswith("from typing import Any\nimport os\n"))
+        self.assertEqual(module_index.node_spans, ModuleIndex(code).node_spans)
+
+    def test_add_classes_to_typing_import(self):
+        """Test that the missing classes are added with one edit, as if added one by one."""
+        for code in (
+            CODE,
+            CODE.replace(
+                "from typing import List", "from typing import (\n    List,\n)"
+            ),
+            CODE.replace("from typing import List\n", ""),
+        ):
+            expected = code
+            for class_name in ("Any", "List", "Optional"):
+                expected = maybe_add_class_to_typing_import(expected, class_name)
+            module_index = ModuleIndex(code)
+            new_code = maybe_add_classes_to_typing_import(
+                code, {"Optional", "List", "Any"}, module_index=module_index
+            )
+            self.assertEqual(new_code, expected)
+            self.assertEqual(module_index.node_spans, ModuleIndex(new_code).node_spans)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from pydocass.connection.database import Base, Inputs, Response
+from pydocass.connection.record_writer import RecordWriter
+
+
+class TestRecordWriter(unittest.TestCase):
+
+    def setUp(self):
+        # One in-memory database shared by the test and the writer threads
+        self.engine = create_engine(
+            "sqlite://",
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False},
+        )
+        Base.metadata.create_all(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.database_down = False
+        self.directory = tempfile.TemporaryDirectory()
+        self.spill_path = os.path.join(self.directory.name, "records.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @contextmanager
+    def _get_db(self):
+        if self.database_down:
+            raise OperationalError("connect", {}, Exception("down"))
+        db = self.session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _count(self, table) -> int:
+        with self.session_factory() as db:
+            return len(db.execute(select(table)).all())
+
+    def test_batches_and_spills(self):
+        """Test that the records are bulk-inserted and survive a database outage."""
+        writer = RecordWriter(self.spill_path, batch_size=3, flush_interval=0.05)
+        in_time = datetime(2024, 1, 1)
+        with patch("pydocass.connection.record_writer._get_db", self._get_db):
+            self.database_down = True
+            writer.submit("inputs", in_code="a", in_time=in_time)
+            writer.submit(
+                "responses",
+                in_code="a",
+                out_code="b",
+                annotations_required_imports={"Any"},
+            )
+            self.assertTrue(writer.flush(timeout=5))
+            self.assertTrue(os.path.exists(self.spill_path))
+            self.assertEqual(writer.stats()["spilled"], 2)
+
+            self.database_down = False
+            for i in range(3):
+                writer.submit("inputs", in_code=str(i), in_time=in_time)
+            self.assertTrue(writer.flush(timeout=5))
+
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertEqual(self._count(Inputs), 4)
+        self.assertEqual(self._count(Response), 1)
+        with self.session_factory() as db:
+            response = db.execute(select(Response)).scalar_one()
+            self.assertEqual(response.annotations_required_imports, {"Any"})
+        stats = writer.stats()
+        self.assertEqual((stats["written"], stats["queue_depth"]), (5, 0))
+
+    def test_bad_record_does_not_block_others(self):
+        """Test that a record failing for another reason than an outage is set aside."""
+        writer = RecordWriter(self.spill_path, batch_size=3, flush_interval=0.05)
+        in_time = datetime(2024, 1, 1)
+        with patch("pydocass.connection.record_writer._get_db", self._get_db):
+            self.database_down = True
+            writer.submit("inputs", in_code="a", in_time=in_time)
+            writer.submit("inputs", in_code="b", in_time=in_time)
+            self.assertTrue(writer.flush(timeout=5))
+
+            # A malformed row makes the whole insert fail
+            self.database_down = False
+            writer.submit("inputs", in_code="c", in_time="not a datetime")
+            self.assertTrue(writer.flush(timeout=5))
+            for i in range(5):
+                writer.submit("inputs", in_code=str(i), in_time=in_time)
+            self.assertTrue(writer.flush(timeout=5))
+
+        self.assertEqual(self._count(Inputs), 7)
+        self.assertFalse(os.path.exists(self.spill_path))
+        with open(writer.dead_letter_path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        stats = writer.stats()
+        self.assertEqual((stats["written"], stats["dead_lettered"]), (7, 1))
+
+    def test_spilled_records_per_batch(self):
+        """Test that a batch retries at most `max_spilled_per_batch` spilled records."""
+        writer = RecordWriter(
+            self.spill_path, batch_size=1, flush_interval=0.01, max_spilled_per_batch=2
+        )
+        in_time = datetime(2024, 1, 1)
+        with patch("pydocass.connection.record_writer._get_db", self._get_db):
+            self.database_down = True
+            for i in range(5):
+                writer.submit("inputs", in_code=str(i), in_time=in_time)
+            self.assertTrue(writer.flush(timeout=5))
+
+            self.database_down = False
+            writer.submit("inputs", in_code="5", in_time=in_time)
+            self.assertTrue(writer.flush(timeout=5))
+
+        self.assertEqual(self._count(Inputs), 3)
+        with open(self.spill_path) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_submit_does_not_wait_for_database(self):
+        """Test that `submit` returns while the database write is blocked."""
+        writer = RecordWriter(self.spill_path, batch_size=1, flush_interval=0.01)
+        release = threading.Event()
+
+        @contextmanager
+        def slow_get_db():
+            release.wait(5)
+            with self._get_db() as db:
+                yield db
+
+        with patch("pydocass.connection.record_writer._get_db", slow_get_db):
+            for i in range(5):
+                writer.submit("inputs", in_code=str(i))
+            self.assertGreater(writer.stats()["queue_depth"], 0)
+            release.set()
+            self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(self._count(Inputs), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import ast
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from pydocass.core.document_python_code import (
+    adocument_python_code,
+    document_python_code,
+)
+from pydocass.utils.segmenter import (
+    SEGMENT_SENTINEL,
+    extract_segment,
+    join_segments,
+    make_segment_code,
+    split_module,
+)
+
+from .fake_client import FakeAsyncClient, FakeClient, FakeTokenizer
+from .test_async_pipeline import _collect
+from .test_batch_mode import _CountingClient
+
+CODE = (
+    "import os\n"
+    "from collections import OrderedDict\n"
+    "\n"
+    "SEPARATOR = os.sep\n"
+    "\n"
+    + "".join(
+        f"\n\n# Function number {i}\n"
+        f"def function_{i}(value, count=2):\n"
+        f"    result = value * count\n"
+        f"    return str(result) + SEPARATOR\n"
+        for i in range(6)
+    )
+)
+
+
+def _value_fn(path: tuple[str, ...]) -> str:
+    if len(path) == 2:
+        return "int" if path[1] != "returns" else "Optional[str]"
+    if path[0].startswith("line"):
+        return ""
+    return f"Docstring of `{path[0]}`."
+
+
+class TestSegmenter(unittest.TestCase):
+
+    def test_split_module(self):
+        """Test that the segments fit the budget and cover the module at statement boundaries."""
+        header, ranges = split_module(CODE, FakeTokenizer(), max_tokens=40)
+        self.assertIn("import os\n", header)
+        self.assertIn("SEPARATOR = os.sep\n", header)
+        self.assertIn("function_0, function_1", header)
+        self.assertGreater(len(ranges), 1)
+        lines = CODE.splitlines(keepends=True)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(lines))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+        segments = ["".join(lines[start:end]) for start, end in ranges]
+        self.assertEqual(join_segments(segments), CODE)
+        # The comment of a function stays in its segment
+        self.assertTrue(
+            any(segment.lstrip().startswith("# Function") for segment in segments[1:])
+        )
+        for segment in segments:
+            ast.parse(segment)
+
+    def test_split_module_by_definitions(self):
+        """Test that the segments have at most the given number of functions."""
+        _, ranges = split_module(
+            CODE, FakeTokenizer(), max_tokens=None, max_definitions=2
+        )
+        self.assertEqual(len(ranges), 3)
+        lines = CODE.splitlines(keepends=True)
+        first_segment = "".join(lines[ranges[0][0] : ranges[0][1]])
+        self.assertIn("import os", first_segment)
+        self.assertIn("def function_1", first_segment)
+        self.assertNotIn("def function_2", first_segment)
+
+    def test_extract_segment(self):
+        """Test that the header is removed, including the comments added to it."""
+        segment = "def foo():\n    return 1\n"
+        code = make_segment_code("import os  # The OS module\n", segment)
+        code = code.replace(SEGMENT_SENTINEL, SEGMENT_SENTINEL + "  # Marker")
+        self.assertEqual(extract_segment(code), segment)
+        self.assertEqual(extract_segment(segment), segment)
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_document_segments(self, mock_submit):
+        """Test that a large module is documented in segments and stitched back."""
+        client = FakeClient(_value_fn)
+        response_data = {}
+        outputs = list(
+            document_python_code(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                segment_max_tokens=40,
+                response_data=response_data,
+            )
+        )
+        code = outputs[-1]
+        ast.parse(code)
+        for i in range(6):
+            self.assertIn(f"Docstring of `function_function_{i}`", code)
+            self.assertIn(f"def function_{i}(value: int, count: int=2)", code)
+        self.assertNotIn(SEGMENT_SENTINEL, code)
+        self.assertEqual(code.count("import os"), 1)
+        self.assertEqual(code.count("SEPARATOR = os.sep"), 1)
+        self.assertTrue(code.startswith("from typing import Optional\n"))
+        # Each segment is sent separately to each of the stages
+        self.assertGreater(len(client.requests), 3)
+        self.assertGreater(response_data["docstrings"]["completion_tokens"], 0)
+        self.assertEqual(response_data["annotations"]["required_imports"], {"Optional"})
+        # The headers of the segments are not commented, only their bodies
+        commented_lines = [
+            field.description
+            for request in client.requests
+            for key, field in request["response_format"].model_fields.items()
+            if key.startswith("line")
+        ]
+        self.assertFalse(any(SEGMENT_SENTINEL in x for x in commented_lines))
+        self.assertEqual(sum(x.endswith(": import os") for x in commented_lines), 1)
+        # A single record of the whole module, without the headers of the segments
+        mock_submit.assert_called_once()
+        record = mock_submit.call_args.kwargs
+        self.assertEqual(record["in_code"], CODE)
+        self.assertEqual(record["out_code"], code)
+        self.assertEqual(
+            record["docstrings_completion_tokens"],
+            response_data["docstrings"]["completion_tokens"],
+        )
+
+        unsegmented = list(
+            document_python_code(
+                code=CODE,
+                client=FakeClient(_value_fn),
+                tokenizer=FakeTokenizer(),
+                segment_max_tokens=None,
+            )
+        )[-1]
+        self.assertEqual(code, unsegmented)
+
+        outputs = asyncio.run(
+            _collect(
+                adocument_python_code(
+                    code=CODE,
+                    client=FakeAsyncClient(_value_fn),
+                    tokenizer=FakeTokenizer(),
+                    segment_max_tokens=40,
+                )
+            )
+        )
+        self.assertEqual(outputs[-1], code)
+        self.assertEqual(mock_submit.call_args.kwargs["out_code"], code)
+        self.assertEqual(mock_submit.call_count, 3)
+
+    @patch("pydocass.core.document_python_code.submit_record")
+    def test_pipelined_groups(self, mock_submit):
+        """Test that the groups of functions go through the stages at the same time."""
+        client = _CountingClient(_value_fn)
+        outputs = list(
+            document_python_code(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                pipeline_group_size=1,
+            )
+        )
+        expected = list(
+            document_python_code(
+                code=CODE, client=FakeClient(_value_fn), tokenizer=FakeTokenizer()
+            )
+        )[-1]
+        self.assertEqual(outputs[-1], expected)
+        # One request per stage for each of the 6 functions
+        self.assertEqual(len(client.requests), 18)
+        self.assertGreater(client.max_in_flight, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+import ast
+import unittest
+
+from pydocass.components import (
+    write_arguments_annotations,
+    write_docstrings,
+    write_comments,
+)
+from pydocass.utils.utils import get_nodes_dict_with_functions_classes_methods
+from pydocass.utils.indentation import align_indentation
+
+from .fake_client import FakeClient, FakeTokenizer
+
+CODE = """import os
+
+
+class Foo:
+    x = 1
+
+    def method(self, a, b=3):
+        total = a + b  # inline comment
+        return total
+
+
+def bar(alpha, beta="x"):
+    if alpha:
+        return beta
+    return os.sep
+"""
+
+
+def _value_fn(path: tuple[str, ...]) -> str:
+    if len(path) == 2:
+        # Annotations: `{"FunctionBar": {"alpha": ..., "returns": ...}}`
+        return "str" if path[1] == "beta" else "int"
+    if path[0].startswith("line"):
+        return "Add the values" if path[0] == "line5" else ""
+    return f"Docstring of `{path[0]}`."
+
+
+def _run(component, **kwargs) -> list:
+    tree = ast.parse(CODE)
+    return list(
+        component(
+            code=CODE,
+            client=FakeClient(_value_fn, chunk_size=3),
+            tokenizer=FakeTokenizer(),
+            **kwargs,
+            **(
+                {}
+                if component is write_comments
+                else {
+                    "target_nodes_dict": get_nodes_dict_with_functions_classes_methods(
+                        tree.body
+                    )
+                }
+            ),
+        )
+    )
+
+
+class TestStreamingComponents(unittest.TestCase):
+
+    def test_write_arguments_annotations(self):
+        """Test that each streamed annotation is inserted into the code as it arrives."""
+        outputs = _run(write_arguments_annotations)
+        snapshots = [x for x in outputs if isinstance(x, str)]
+        code, required_imports, response_data = outputs[-1]
+        self.assertIn("x: int = 1", code)
+        self.assertIn("def method(self, a: int, b: int=3) -> int:", code)
+        self.assertIn('def bar(alpha: int, beta: str="x") -> int:', code)
+        self.assertEqual(len(snapshots), 7)
+        self.assertEqual(response_data["model"], "Qwen/Qwen3-32B-fast")
+        ast.parse(code)
+
+    def test_required_typing_imports(self):
+        """Test that only the names of the `typing` classes referenced by the annotations are required."""
+        tree = ast.parse(CODE)
+        code, required_imports, _ = list(
+            write_arguments_annotations(
+                code=CODE,
+                client=FakeClient(
+                    lambda path: (
+                        "Optional[dict[str, Any]]"
+                        if path[-1] == "alpha"
+                        else "typing.Callable"
+                    )
+                ),
+                tokenizer=FakeTokenizer(),
+                target_nodes_dict=get_nodes_dict_with_functions_classes_methods(
+                    tree.body
+                ),
+            )
+        )[-1]
+        self.assertIn("alpha: Optional[dict[str, Any]]", code)
+        self.assertEqual(required_imports, {"Optional", "Any"})
+
+    def test_broken_annotations(self):
+        """Test that the broken annotations are repaired locally or fixed with one request in the end."""
+
+        def value_fn(path: tuple[str, ...]) -> str:
+            if path == ("annotation1",):
+                return "Optional[int]"
+            return {"alpha": "Optional[", "a": "dict[str, list[int]"}.get(
+                path[-1], "int"
+            )
+
+        tree = ast.parse(CODE)
+        client = FakeClient(value_fn)
+        outputs = list(
+            write_arguments_annotations(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                target_nodes_dict=get_nodes_dict_with_functions_classes_methods(
+                    tree.body
+                ),
+            )
+        )
+        code, required_imports, _ = outputs[-1]
+        self.assertIn('def bar(alpha: Optional[int], beta: str="x") -> int:', code)
+        self.assertIn("def method(self, a: dict[str, list[int]], b: int=3)", code)
+        self.assertEqual(required_imports, {"Optional"})
+        fix_requests = [x for x in client.requests if "stream_options" not in x]
+        self.assertEqual(len(fix_requests), 1)
+        self.assertEqual(
+            list(fix_requests[0]["response_format"].model_fields), ["annotation1"]
+        )
+        # The fixed annotation is applied after the others
+        self.assertNotIn("alpha: Optional", outputs[-3])
+        self.assertIn("alpha: Optional[int]", outputs[-2])
+        ast.parse(code)
+
+    def test_returns_annotation_with_multiline_docstring(self):
+        """Test that the return annotation is added before a docstring of several lines."""
+        code = 'def f(x):\n    """\n    Doc: (x).\n    """\n    return x\n'
+        tree = ast.parse(code)
+        code, _, _ = list(
+            write_arguments_annotations(
+                code=code,
+                client=FakeClient(lambda path: "int"),
+                tokenizer=FakeTokenizer(),
+                target_nodes_dict=get_nodes_dict_with_functions_classes_methods(
+                    tree.body
+                ),
+            )
+        )[-1]
+        self.assertTrue(code.startswith('def f(x: int) -> int:\n    """\n'))
+
+    def test_write_docstrings(self):
+        """Test that each streamed docstring is inserted into the code as it arrives."""
+        outputs = _run(write_docstrings)
+        code, _ = outputs[-1]
+        # Docstrings are indented as the bodies, so the code is valid before the alignment
+        self.assertIn('    def method(self, a, b=3):\n        """', code)
+        self.assertEqual(align_indentation(code, indent_type="4-space"), code)
+        self.assertEqual(len(outputs) - 1, 3)
+        self.assertIn("Docstring of `class_Foo_method_method`.", code)
+        self.assertIn("Docstring of `function_bar`.", code)
+        self.assertEqual(
+            ast.get_docstring(ast.parse(code).body[1]).strip(),
+            "Docstring of `class_Foo`.",
+        )
+
+    def test_write_comments(self):
+        """Test that the streamed comment replaces the inline comment of its line."""
+        outputs = _run(write_comments, modify_existing_documentation=True)
+        code, _ = outputs[-1]
+        self.assertIn("        # Add the values\n        total = a + b\n", code)
+        self.assertNotIn("# inline comment", code)
+        ast.parse(code)
+
+    def test_write_comments_by_scopes(self):
+        """Test that the comments of each scope are requested separately and remapped."""
+        # `test_batch_mode` imports this module
+        from .test_batch_mode import _CountingClient
+
+        client = _CountingClient(_value_fn)
+        outputs = list(
+            write_comments(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                max_lines_per_request=2,
+            )
+        )
+        code, response_data = outputs[-1]
+        # The module level, the class and the function are requested separately
+        self.assertEqual(len(client.requests), 3)
+        self.assertGreater(client.max_in_flight, 1)
+        prompts = [request["messages"][-1]["content"] for request in client.requests]
+        bar_prompts = [prompt for prompt in prompts if "def bar(alpha" in prompt]
+        self.assertEqual(len(bar_prompts), 1)
+        self.assertNotIn("class Foo", bar_prompts[0])
+        # `line5` of the class request is the fifth line of the class
+        self.assertIn("        # Add the values\n        return total\n", code)
+        self.assertIn("total = a + b  # inline comment\n", code)
+        self.assertGreater(response_data["completion_tokens"], 0)
+        ast.parse(code)
+
+    def test_write_comments_sparse_format(self):
+        """Test that the sparse comments give the same code as the per-line ones."""
+
+        def sparse_value_fn(path):
+            if path == ("comments",):
+                # The items out of order and for unknown lines are ignored
+                return [
+                    {"line": 5, "comment": "Add the values"},
+                    {"line": 3, "comment": "Out of order"},
+                    {"line": 99, "comment": "Unknown line"},
+                ]
+            return _value_fn(path)
+
+        for modify_existing_documentation in (False, True):
+            expected, _ = _run(
+                write_comments,
+                modify_existing_documentation=modify_existing_documentation,
+            )[-1]
+            client = FakeClient(sparse_value_fn)
+            code, _ = list(
+                write_comments(
+                    code=CODE,
+                    client=client,
+                    tokenizer=FakeTokenizer(),
+                    modify_existing_documentation=modify_existing_documentation,
+                    comments_format="sparse",
+                )
+            )[-1]
+            self.assertEqual(code, expected)
+            prompt = client.requests[0]["messages"][-1]["content"]
+            self.assertIn("5.         total = a + b  # inline comment", prompt)
+            self.assertNotIn("Json schema", prompt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import random
+import unittest
+
+from pydocass.utils.streaming_json import StreamingJSONParser
+
+
+def _feed_in_chunks(document: str, seed: int = 0, max_chunk_size: int = 6):
+    rng = random.Random(seed)
+    parser = StreamingJSONParser()
+    events = []
+    pos = 0
+    while pos < len(document):
+        size = rng.randint(1, max_chunk_size)
+        events += parser.feed(document[pos : pos + size])
+        pos += size
+    return parser, events
+
+
+class TestStreamingJSONParser(unittest.TestCase):
+
+    def test_nested_values_are_reported_once_complete(self):
+        """Test that every value is reported with its path as soon as it is closed."""
+        document = {"FunctionFoo": {"a": "int", "returns": "list[str]"}, "ClassBar": {}}
+        parser, events = _feed_in_chunks(json.dumps(document))
+        self.assertEqual(
+            [path for path, _ in events],
+            [
+                ("FunctionFoo", "a"),
+                ("FunctionFoo", "returns"),
+                ("FunctionFoo",),
+                ("ClassBar",),
+                (),
+            ],
+        )
+        self.assertEqual(events[-1].value, document)
+        self.assertTrue(parser.done)
+
+    def test_values_split_across_chunks(self):
+        """Test escapes, unicode, numbers and literals split at every possible position."""
+        document = json.dumps(
+            {
+                "line1": 'a "quoted" \\ value\n',
+                "line2": "ünïcödé ☃",
+                "numbers": [0, -12.5e3, 7],
+                "literals": [True, False, None],
+                "empty": [],
+            }
+        )
+        for seed in range(50):
+            parser, events = _feed_in_chunks(document, seed=seed, max_chunk_size=3)
+            self.assertFalse(parser.failed)
+            self.assertEqual(events[-1].value, json.loads(document))
+
+    def test_value_is_not_reported_before_it_is_closed(self):
+        """Test that partial strings and numbers are not reported."""
+        parser = StreamingJSONParser()
+        self.assertEqual(parser.feed('{"line1": "Partial comm'), [])
+        self.assertEqual(
+            parser.feed('ent", "line2": 12'), [(("line1",), "Partial comment")]
+        )
+        self.assertEqual(
+            parser.feed("3}"),
+            [(("line2",), 123), ((), {"line1": "Partial comment", "line2": 123})],
+        )
+
+    def test_text_before_root_is_skipped(self):
+        """Test that a markdown fence before the JSON does not break parsing."""
+        parser, events = _feed_in_chunks('```json\n{"a": "b"}\n```')
+        self.assertEqual(events[-1].value, {"a": "b"})
+
+    def test_malformed_output_stops_parsing(self):
+        """Test that the parser stops reporting events on malformed output."""
+        parser = StreamingJSONParser()
+        self.assertEqual(parser.feed('{"a": "b", oops'), [(("a",), "b")])
+        self.assertTrue(parser.failed)
+        self.assertEqual(parser.feed('"c": "d"}'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
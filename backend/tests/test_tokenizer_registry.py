@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+
+from pydocass.utils.tokenizer_registry import TokenizerRegistry
+
+from .fake_client import FakeTokenizer
+
+
+class TestTokenizerRegistry(unittest.TestCase):
+
+    def test_loads_once_under_concurrency(self):
+        """Test that concurrent requests for the same checkpoint load the tokenizer once."""
+        loaded = []
+
+        def load(model_checkpoint: str) -> FakeTokenizer:
+            loaded.append(model_checkpoint)
+            time.sleep(0.05)
+            return FakeTokenizer()
+
+        registry = TokenizerRegistry(load_function=load)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(registry.get("model")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(loaded, ["model"])
+        self.assertEqual(len({id(tokenizer) for tokenizer in results}), 1)
+        stats = registry.stats()
+        self.assertEqual((stats["loads"], stats["hits"]), (1, 7))
+        self.assertGreaterEqual(stats["tokenizers"]["model"]["load_seconds"], 0.05)
+
+    def test_fallback_is_shared(self):
+        """Test that the checkpoints without a tokenizer share the fallback tokenizer."""
+
+        def load(model_checkpoint: str) -> FakeTokenizer:
+            if model_checkpoint != "fallback":
+                raise OSError(model_checkpoint)
+            return FakeTokenizer()
+
+        registry = TokenizerRegistry(load_function=load, fallback_checkpoint="fallback")
+        registry.preload(["a", "b"])
+        self.assertIs(registry.get("a"), registry.get("b"))
+        self.assertIs(registry.get("a"), registry.get("fallback"))
+        self.assertEqual(registry.stats()["loads"], 1)
+        self.assertEqual(registry.stats()["tokenizers"]["a"]["checkpoint"], "fallback")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import ast
+import unittest
+
+from pydocass.components import write_arguments_annotations
+from pydocass.utils.type_inference import TypeInference
+from pydocass.utils.utils import get_nodes_dict_with_functions_classes_methods
+
+from .fake_client import FakeClient, FakeTokenizer
+
+CODE = """import re
+
+DEFAULT_PRECISION = 2
+PATTERN = re.compile("x")
+
+
+def round_value(value, precision=DEFAULT_PRECISION, verbose=False, name=f"x", scale=-1.5):
+    if not isinstance(value, float):
+        raise TypeError("Not a float")
+    return round(value * scale, precision)
+
+
+def log(message, level: Optional[int] = None, fallback=PATTERN):
+    assert isinstance(message, str)
+    print(message)
+
+
+def warn(message, level=None):
+    if level:
+        return
+    log(message)
+
+
+def is_valid(text):
+    if not text:
+        return False
+    return True
+
+
+def get_code(strict):
+    if strict:
+        return 1
+
+
+def read(stream):
+    yield stream.read()
+
+
+def abstract(self):
+    raise NotImplementedError
+
+
+def configure(verbose=False):
+    print(verbose)
+"""
+
+
+class TestTypeInference(unittest.TestCase):
+
+    def test_infer_argument_type(self):
+        """Test that the types are inferred only when they leave no doubt."""
+        tree = ast.parse(CODE)
+        functions = {node.name: node for node in tree.body if hasattr(node, "args")}
+        type_inference = TypeInference(tree, functions.values())
+
+        def infer(function_name: str) -> dict:
+            function = functions[function_name]
+            return {
+                arg.arg: type_inference.infer_argument_type(function, arg)
+                for arg in function.args.args
+                if arg.annotation is None
+            }
+
+        self.assertEqual(
+            infer("round_value"),
+            {
+                "value": "float",
+                "precision": "int",
+                "verbose": "bool",
+                "name": "str",
+                "scale": "float",
+            },
+        )
+        # `re.compile` returns an unknown type
+        self.assertEqual(infer("log"), {"message": "str", "fallback": None})
+        # `level` is annotated elsewhere with the same default
+        self.assertEqual(infer("warn"), {"message": None, "level": "Optional[int]"})
+
+    def test_positional_only_defaults(self):
+        """Test that the defaults are matched with the positional-only arguments too."""
+        tree = ast.parse('def split(separator="x", /, limit=2):\n    pass\n')
+        function = tree.body[0]
+        type_inference = TypeInference(tree, [function])
+        args = function.args.posonlyargs + function.args.args
+        self.assertEqual(
+            [type_inference.infer_argument_type(function, arg) for arg in args],
+            ["str", "int"],
+        )
+
+    def test_infer_return_type(self):
+        """Test that only the returns of `None` or of the literals of one type are inferred."""
+        tree = ast.parse(CODE)
+        type_inference = TypeInference(tree, [])
+        return_types = {
+            node.name: type_inference.infer_return_type(node)
+            for node in tree.body
+            if hasattr(node, "args")
+        }
+        self.assertEqual(
+            return_types,
+            {
+                "round_value": None,
+                "log": "None",
+                "warn": "None",
+                "is_valid": "bool",
+                # The end of the function returns `None`
+                "get_code": None,
+                "read": None,
+                "abstract": None,
+                "configure": "None",
+            },
+        )
+
+    def test_inferred_annotations_are_not_requested(self):
+        """Test that the inferred annotations are written directly and left out of the schema."""
+        tree = ast.parse(CODE)
+        client = FakeClient(lambda path: "Any")
+        code, _, _ = list(
+            write_arguments_annotations(
+                code=CODE,
+                client=client,
+                tokenizer=FakeTokenizer(),
+                target_nodes_dict=get_nodes_dict_with_functions_classes_methods(
+                    tree.body
+                ),
+                annotate_with_any=True,
+            )
+        )[-1]
+        self.assertIn(
+            'def round_value(value: float, precision: int=DEFAULT_PRECISION, verbose: bool=False, name: str=f"x", scale: float=-1.5) -> Any:',
+            code,
+        )
+        self.assertIn("def is_valid(text: Any) -> bool:", code)
+        (request,) = client.requests
+        fields = {
+            name: set(field.annotation.model_fields)
+            for name, field in request["response_format"].model_fields.items()
+        }
+        self.assertEqual(fields["FunctionRound_Value"], {"returns"})
+        self.assertEqual(fields["FunctionIs_Valid"], {"text"})
+        # The returns of `None` are inferred too
+        self.assertEqual(fields["FunctionLog"], {"fallback"})
+        self.assertEqual(fields["FunctionWarn"], {"message"})
+        # All the annotations are inferred
+        self.assertNotIn("FunctionConfigure", fields)
+        self.assertIn("def configure(verbose: bool=False) -> None:", code)
+        ast.parse(code)
+
+
+if __name__ == "__main__":
+    unittest.main()